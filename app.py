@@ -3,20 +3,38 @@ import os
 import tempfile
 from PIL import Image
 import numpy as np
-from config import INPUT_DIR, DB_PATH, VECTOR_DB_PATH, DOCSTORE_PATH
-from data_processing.pdf_handler import handle_pdf
-from data_processing.image_handler import analyze_image
-from storage.vector_store import build_vectorstore, build_retriever
-from retrieval.rag_engine import create_content_summaries, multi_modal_rag
-from langchain.storage import LocalFileStore
+from config import (
+    INPUT_DIR, DB_PATH, VECTOR_DB_PATH, DOCSTORE_PATH, MODEL_WARMUP, TRACE_METRICS_PORT,
+    QUERY_POOL_SIZE, QUERY_QUEUE_SIZE, QUERY_TIMEOUT, QUERY_SERVICE_PORT,
+    INDEX_MANIFEST_PATH, INDEX_READ_ONLY, MMAP_INDEX_PATH, MANIFEST_PATH,
+)
+from data_processing.pipeline import IngestionPipeline
+from storage.vector_store import (
+    open_index, count_vectors, save_index_manifest, compact_index,
+)
+from retrieval.query_service import QueryService, ServiceBusy
+from utils.model_registry import registry
+from utils.tracing import tracer
 
 # Инициализация сессионного состояния
 if 'initialized' not in st.session_state:
     st.session_state.initialized = False
-    st.session_state.content_storage = []
-    st.session_state.retriever = None
     st.session_state.processed_files = set()
 
+@st.cache_resource
+def start_model_warmup():
+    """Фоновая загрузка моделей (один раз на процесс)"""
+    if MODEL_WARMUP:
+        registry.warmup(MODEL_WARMUP, background=True)
+    return True
+
+@st.cache_resource
+def start_metrics_server():
+    """Эндпоинт /metrics для Prometheus (один раз на процесс)"""
+    if TRACE_METRICS_PORT:
+        tracer.serve_metrics(TRACE_METRICS_PORT)
+    return True
+
 def initialize_system():
     """Инициализация системы"""
     if not st.session_state.initialized:
@@ -27,86 +45,119 @@ def initialize_system():
         os.makedirs(DOCSTORE_PATH, exist_ok=True)
         st.session_state.initialized = True
 
-def process_pdf_file(uploaded_file):
-    """Обработка загруженного PDF файла"""
-    if uploaded_file.name not in st.session_state.processed_files:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_file_path = tmp_file.name
-        
-        try:
-            table_elements, text_chunks = handle_pdf(tmp_file_path)
-            text_overviews, table_overviews = create_content_summaries(
-                text_chunks, table_elements, summarize_texts=True
-            )
-            
-            for item, summary in zip(text_chunks, text_overviews):
-                st.session_state.content_storage.append({
-                    'type': 'pdf',
-                    'elem': item,
-                    'sum': summary,
-                    'path': uploaded_file.name,
-                    'metadata': {'start': 0, 'end': 0},
-                })
-                
-            for item, summary in zip(table_elements, table_overviews):
-                st.session_state.content_storage.append({
-                    'type': 'pdf',
-                    'elem': item,
-                    'sum': summary,
-                    'path': uploaded_file.name,
-                    'metadata': {'start': 0, 'end': 0},
-                })
-                
-            st.session_state.processed_files.add(uploaded_file.name)
-            os.unlink(tmp_file_path)
-            return True
-        except Exception as e:
-            st.error(f"Ошибка при обработке PDF файла {uploaded_file.name}: {str(e)}")
-            os.unlink(tmp_file_path)
-            return False
-    return True
+@st.cache_resource
+def open_saved_index():
+    """Сохраненный индекс открывается по манифесту без повторной загрузки данных"""
+    return open_index(VECTOR_DB_PATH, DOCSTORE_PATH, INDEX_MANIFEST_PATH, read_only=INDEX_READ_ONLY)
+
+@st.cache_resource
+def get_query_service():
+    """Общий для всех сессий сервис запросов: один ретривер и пул моделей.
+    None, если индекс открыть нельзя (сведения - в open_saved_index)"""
+    retriever, index_info = open_saved_index()
+    if retriever is None:
+        return None
+    service = QueryService(
+        retriever,
+        pool_size=QUERY_POOL_SIZE,
+        max_queue=QUERY_QUEUE_SIZE,
+        timeout=QUERY_TIMEOUT,
+    )
+    if QUERY_SERVICE_PORT:
+        service.serve_http(QUERY_SERVICE_PORT)
+    service.index_info = index_info
+    return service
 
-def process_image_file(uploaded_file):
-    """Обработка загруженного изображения"""
-    if uploaded_file.name not in st.session_state.processed_files:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
+def process_uploaded_files(uploaded_files):
+    """Потоковая обработка загруженных файлов: каждый файл доступен для поиска сразу после записи"""
+    sources = []
+    names = {}
+    for uploaded_file in uploaded_files:
+        suffix = os.path.splitext(uploaded_file.name)[1].lower()
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
             tmp_file.write(uploaded_file.getvalue())
             tmp_file_path = tmp_file.name
-        
-        try:
-            image_data, image_caption = analyze_image(tmp_file_path)
-            st.session_state.content_storage.append({
-                'type': 'image',
-                'elem': image_data,
-                'sum': image_caption,
-                'path': uploaded_file.name,
-                'metadata': {'start': 0, 'end': 0},
-            })
-            
-            st.session_state.processed_files.add(uploaded_file.name)
-            os.unlink(tmp_file_path)
-            return True
-        except Exception as e:
-            st.error(f"Ошибка при обработке изображения {uploaded_file.name}: {str(e)}")
+        kind = 'pdf' if suffix == '.pdf' else 'image'
+        sources.append((kind, tmp_file_path, uploaded_file.name))
+        names[tmp_file_path] = uploaded_file.name
+    
+    try:
+        retriever = get_query_service().retriever
+        pipeline = IngestionPipeline(retriever.vectorstore, retriever.docstore)
+        for tmp_file_path, doc_ids, error in pipeline.run(sources):
+            file_name = names[tmp_file_path]
+            if error is not None:
+                st.error(f"Ошибка при обработке файла {file_name}: {str(error)}")
+                yield False
+            else:
+                st.session_state.processed_files.add(file_name)
+                yield True
+        compact_index(retriever.vectorstore)
+        save_index_manifest(INDEX_MANIFEST_PATH, retriever.vectorstore, retriever.docstore)
+    finally:
+        for tmp_file_path in names:
             os.unlink(tmp_file_path)
-            return False
-    return True
 
-def build_retriever_system():
-    """Создание ретривера на основе обработанных файлов"""
-    if st.session_state.content_storage and st.session_state.retriever is None:
-        try:
-            vectorstore = build_vectorstore(VECTOR_DB_PATH)
-            docstore = LocalFileStore(DOCSTORE_PATH)
-            st.session_state.retriever = build_retriever(
-                vectorstore, docstore, st.session_state.content_storage
+def show_generation_stats(stats):
+    """Вывод метрик генерации ответа"""
+    if stats:
+        st.caption(
+            f"Первый токен: {stats['time_to_first_token']:.2f} с · "
+            f"{stats['completion_tokens']} токенов · {stats['tokens_per_sec']:.1f} ток./с · "
+            f"всего {stats['total_seconds']:.1f} с · кеш ответов: {stats['answer_cache']} · "
+            f"материалы: {stats['context_documents']} док."
+            + (f", {stats['context_tokens']} токенов" if stats.get('context_tokens') is not None else '')
+            + (f" · ожидание в очереди {stats['queue_wait']:.2f} с" if 'queue_wait' in stats else '')
+            + (
+                f" · декодирование {stats['step_seconds']['decode'] * 1000:.0f} мс, "
+                f"встраивание {stats['step_seconds']['embed'] * 1000:.0f} мс, "
+                f"поиск {stats['step_seconds']['search'] * 1000:.0f} мс"
+                if 'step_seconds' in stats else ''
             )
-            return True
-        except Exception as e:
-            st.error(f"Ошибка при создании системы поиска: {str(e)}")
-            return False
-    return st.session_state.retriever is not None
+        )
+
+def show_debug_panel():
+    """Отладочная панель: время этапов и последние запросы"""
+    with st.expander("🛠 Отладка: время этапов"):
+        summary = tracer.summary()
+        if not summary:
+            st.caption("Данных пока нет")
+            return
+        st.table([
+            {'этап': name, 'вызовов': stats['count'], 'всего, с': round(stats['seconds'], 3),
+             'среднее, с': round(stats['mean'], 3)}
+            for name, stats in summary.items()
+        ])
+        if tracer.traces:
+            trace = tracer.traces[-1]
+            st.markdown(f"Последний запрос: {trace['duration']:.2f} с")
+            st.table([
+                {'этап': span['name'], 'с': round(span['duration'], 3),
+                 **{key: value for key, value in span.items()
+                    if key not in ('name', 'duration', 'span_id', 'parent_id', 'trace_id', 'start', 'pid', 'thread')}}
+                for span in sorted(trace['spans'], key=lambda span: span['start'])
+            ])
+            if trace.get('profile'):
+                st.markdown("Самые частые стеки (профилировщик):")
+                st.code('\n'.join(f"{entry['samples']:>5} {entry['stack']}" for entry in trace['profile'][:10]))
+
+def show_index_problems(index_info):
+    """Индекс построен другой моделью или в другом формате (или отсутствует
+    в режиме только чтения): поиск и загрузка отключены до пересборки"""
+    st.error("Индекс нельзя открыть: " + "; ".join(index_info['problems']))
+    st.markdown(
+        "Поиск и загрузка файлов отключены. Для пересборки индекса:\n"
+        f"1. Остановите другие процессы, работающие с индексом (например, `python main.py`).\n"
+        f"2. Удалите `{VECTOR_DB_PATH}`, `{MMAP_INDEX_PATH}`, `{DOCSTORE_PATH}`, "
+        f"`{MANIFEST_PATH}` и `{INDEX_MANIFEST_PATH}`.\n"
+        "3. Загрузите файлы заново: `python main.py` или через приложение "
+        "(при `INDEX_READ_ONLY = False`).\n"
+        "4. Нажмите «Проверить индекс снова»."
+    )
+    if st.button("🔁 Проверить индекс снова"):
+        open_saved_index.clear()
+        get_query_service.clear()
+        st.rerun()
 
 def main():
     st.set_page_config(page_title="Multimodal RAG System", page_icon="📚", layout="wide")
@@ -115,6 +166,11 @@ def main():
     
     # Инициализация системы
     initialize_system()
+    start_model_warmup()
+    start_metrics_server()
+    service = get_query_service()
+    index_info = open_saved_index()[1]
+    can_upload = service is not None and not index_info['read_only']
     
     # Боковая панель для загрузки файлов
     with st.sidebar:
@@ -126,7 +182,8 @@ def main():
             "Загрузить PDF файлы", 
             type=['pdf'], 
             accept_multiple_files=True,
-            key="pdf_uploader"
+            key="pdf_uploader",
+            disabled=not can_upload,
         )
         
         # Загрузка изображений
@@ -134,33 +191,33 @@ def main():
             "Загрузить изображения", 
             type=['jpg', 'jpeg', 'png'], 
             accept_multiple_files=True,
-            key="image_uploader"
+            key="image_uploader",
+            disabled=not can_upload,
         )
         
         # Кнопка для обработки файлов
-        if st.button("🔄 Обработать файлы", type="primary"):
+        if st.button("🔄 Обработать файлы", type="primary", disabled=not can_upload):
             if pdf_files or image_files:
                 progress_bar = st.progress(0)
                 total_files = len(pdf_files) + len(image_files)
                 processed_count = 0
                 
-                # Обработка PDF файлов
-                for pdf_file in pdf_files:
-                    if process_pdf_file(pdf_file):
-                        processed_count += 1
-                        progress_bar.progress(processed_count / total_files)
-                
-                # Обработка изображений
-                for image_file in image_files:
-                    if process_image_file(image_file):
-                        processed_count += 1
-                        progress_bar.progress(processed_count / total_files)
+                # Обработка PDF файлов и изображений
+                uploaded_files = list(pdf_files) + list(image_files)
+                new_files = [f for f in uploaded_files if f.name not in st.session_state.processed_files]
+                processed_count += len(uploaded_files) - len(new_files)
+                try:
+                    for success in process_uploaded_files(new_files):
+                        if success:
+                            processed_count += 1
+                            progress_bar.progress(processed_count / total_files)
+                except Exception as e:
+                    st.error(f"Ошибка при создании системы поиска: {str(e)}")
                 
                 progress_bar.empty()
                 st.success(f"Обработано {processed_count} из {total_files} файлов")
                 
-                # Создание ретривера
-                if build_retriever_system():
+                if st.session_state.processed_files:
                     st.success("Система поиска готова к работе!")
                 else:
                     st.warning("Не удалось создать систему поиска")
@@ -173,9 +230,48 @@ def main():
             st.subheader("📊 Обработанные файлы")
             for file_name in st.session_state.processed_files:
                 st.markdown(f"- {file_name}")
+        
+        # Сохраненный индекс
+        st.divider()
+        st.subheader("🗂 Индекс")
+        if service is None:
+            st.caption("⛔ индекс несовместим с конфигурацией")
+        else:
+            st.markdown(
+                f"- векторов: {count_vectors(service.retriever.vectorstore)}, "
+                f"документов при запуске: {index_info['document_count']}\n"
+                f"- открыт за {index_info['open_seconds']:.2f} с"
+                + (" (только чтение)" if index_info['read_only'] else "")
+            )
+            for problem in index_info['problems']:
+                st.caption(f"⚠️ {problem}")
+        
+        # Информация о загруженных моделях
+        model_stats = registry.stats()
+        if model_stats:
+            st.divider()
+            st.subheader("🧠 Загруженные модели")
+            for name, stats in model_stats.items():
+                st.markdown(f"- {name}: {stats['load_seconds']:.1f} с, {stats['rss_bytes'] / 2**20:.0f} МБ")
+        
+        # Нагрузка на сервис запросов
+        if service is not None:
+            service_stats = service.stats()
+            st.divider()
+            st.subheader("⚙️ Сервис запросов")
+            st.markdown(
+                f"- выполняется: {service_stats['in_flight']} из {service_stats['pool_size']} "
+                f"(макс. {service_stats['max_in_flight']}), в очереди: {service_stats['queued']}\n"
+                f"- выполнено: {service_stats['completed']}, отклонено: {service_stats['rejected']}, "
+                f"по тайм-ауту: {service_stats['timeouts']}\n"
+                f"- ожидание p50/p95: {service_stats['queue_wait_p50']:.2f} / {service_stats['queue_wait_p95']:.2f} с\n"
+                f"- обслуживание p50/p95: {service_stats['service_p50']:.2f} / {service_stats['service_p95']:.2f} с"
+            )
     
-    # Основная область приложения
-    if st.session_state.retriever:
+    # Основная область приложения: поиск доступен сразу, если индекс уже содержит данные
+    if service is None:
+        show_index_problems(index_info)
+    elif st.session_state.processed_files or index_info['vector_count']:
         st.header("🔍 Поиск и анализ")
         
         # Тип поиска
@@ -188,37 +284,37 @@ def main():
             query = st.text_input("Введите ваш запрос:", placeholder="Например: Что такое глобальное потепление?")
             
             if st.button("🔎 Найти", type="primary") and query:
-                with st.spinner("Поиск информации..."):
-                    try:
-                        result = multi_modal_rag(query, st.session_state.retriever, is_image=False)
-                        st.subheader("Результаты поиска:")
-                        st.markdown(result)
-                    except Exception as e:
-                        st.error(f"Ошибка при поиске: {str(e)}")
+                try:
+                    st.subheader("Результаты поиска:")
+                    stats = {}
+                    st.write_stream(service.stream(query, is_image=False, stats=stats))
+                    show_generation_stats(stats)
+                except ServiceBusy:
+                    st.warning("Сервис перегружен, повторите запрос позже")
+                except Exception as e:
+                    st.error(f"Ошибка при поиске: {str(e)}")
                         
         else:  # Поиск по изображению
             image_file = st.file_uploader("Загрузить изображение для поиска", type=['jpg', 'jpeg', 'png'])
             
             if image_file and st.button("🔎 Найти по изображению", type="primary"):
-                with st.spinner("Анализ изображения и поиск..."):
-                    try:
-                        # Сохраняем изображение временно
-                        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-                            tmp_file.write(image_file.getvalue())
-                            tmp_file_path = tmp_file.name
-                        
-                        result = multi_modal_rag(tmp_file_path, st.session_state.retriever, is_image=True)
-                        st.subheader("Результаты поиска:")
-                        st.markdown(result)
-                        
-                        # Отображаем загруженное изображение
-                        st.divider()
-                        st.subheader("Анализируемое изображение:")
-                        st.image(image_file, caption="Загруженное изображение", use_column_width=True)
-                        
-                        os.unlink(tmp_file_path)
-                    except Exception as e:
-                        st.error(f"Ошибка при поиске по изображению: {str(e)}")
+                try:
+                    # Изображение передается из памяти, без временного файла
+                    st.subheader("Результаты поиска:")
+                    stats = {}
+                    st.write_stream(service.stream(image_file.getvalue(), is_image=True, stats=stats))
+                    show_generation_stats(stats)
+                    
+                    # Отображаем загруженное изображение
+                    st.divider()
+                    st.subheader("Анализируемое изображение:")
+                    st.image(image_file, caption="Загруженное изображение", use_column_width=True)
+                except ServiceBusy:
+                    st.warning("Сервис перегружен, повторите запрос позже")
+                except Exception as e:
+                    st.error(f"Ошибка при поиске по изображению: {str(e)}")
+        
+        show_debug_panel()
     else:
         st.info("📥 Пожалуйста, загрузите файлы и нажмите 'Обработать файлы' для начала работы")
         
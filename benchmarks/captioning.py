@@ -0,0 +1,39 @@
+"""
+Сравнение скорости описания изображений: по одному (analyze_image)
+и пакетно с дедупликацией (caption_images).
+
+Запуск: python -m benchmarks.captioning source/image/*.jpg
+"""
+import sys
+import time
+from data_processing import image_handler
+from utils.model_registry import registry
+
+def compare_captioning(paths):
+    """
+    Параметры:
+    paths (list): Пути к изображениям.
+    
+    Возвращает:
+    dict: Скорость (изобр./с) для обоих способов.
+    """
+    # Время загрузки модели в замеры не входит
+    registry.get('blip')
+
+    started_at = time.perf_counter()
+    for path in paths:
+        image_handler.analyze_image(path)
+    single = len(paths) / (time.perf_counter() - started_at)
+
+    image_handler._caption_cache.clear()
+    image_handler._perceptual_cache.clear()
+    started_at = time.perf_counter()
+    image_handler.caption_images(paths)
+    batched = len(paths) / (time.perf_counter() - started_at)
+
+    print(f"По одному: {single:.2f} изобр./с; пакетно: {batched:.2f} изобр./с "
+          f"(x{batched / single:.1f})")
+    return {'single_images_per_sec': single, 'batched_images_per_sec': batched}
+
+if __name__ == "__main__":
+    compare_captioning(sys.argv[1:])
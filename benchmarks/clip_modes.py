@@ -0,0 +1,140 @@
+"""
+Сравнение режимов вывода OpenCLIP на CPU (fp32, int8, bf16): скорость
+встраивания текстов и изображений, память модели и совпадение результатов
+поиска top-k с fp32 (recall@k) на синтетической выборке.
+
+Нужны настоящие веса OpenCLIP (скачиваются при первом запуске).
+
+Запуск: python -m benchmarks.clip_modes --modes fp32 int8 bf16 --output clip_modes.json
+"""
+import gc
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+from PIL import Image
+from benchmarks.run import measure, _git_commit
+from benchmarks.synthetic import make_texts, make_image
+from storage import vector_store
+from storage.embeddings import INFERENCE_MODES
+from utils.model_registry import current_rss_bytes
+
+def top_k(queries, corpus, k):
+    """
+    Возвращает:
+    np.ndarray: Индексы k ближайших элементов корпуса для каждого запроса.
+    """
+    scores = np.asarray(queries, dtype=np.float32) @ np.asarray(corpus, dtype=np.float32).T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+def recall_at_k(reference, candidate):
+    """
+    Доля результатов top-k эталонного режима, найденных в top-k проверяемого.
+    """
+    return float(np.mean([len(set(r) & set(c)) / len(r) for r, c in zip(reference, candidate)]))
+
+def embed_sample(embeddings, texts, queries, images, batch_size):
+    """
+    Встраивает выборку и измеряет скорость.
+
+    Возвращает:
+    tuple: Метрики текстов и изображений, векторы запросов и корпуса.
+    """
+    text_batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+    image_batches = [images[start:start + batch_size] for start in range(0, len(images), batch_size)]
+    text_metrics, text_vectors = measure([
+        (lambda batch=batch: embeddings.embed_documents(batch), len(batch)) for batch in text_batches
+    ])
+    image_metrics, image_vectors = measure([
+        (lambda batch=batch: embeddings.embed_pil_images(batch), len(batch)) for batch in image_batches
+    ])
+    query_vectors = embeddings.embed_documents(queries)
+    corpus = [vector for batch in text_vectors + image_vectors for vector in batch]
+    return text_metrics, image_metrics, query_vectors, corpus
+
+def run_modes(args, work_dir):
+    texts = make_texts(args.texts, seed=args.seed)
+    # Запрос - начало абзаца: ближайшим должен оказаться сам абзац и похожие на него
+    queries = [' '.join(text.split()[:8]) for text in texts[:args.queries]]
+    images = []
+    for i in range(args.images):
+        with Image.open(make_image(os.path.join(work_dir, f'image-{i}.jpg'), seed=args.seed + i)) as image:
+            images.append(image.convert('RGB'))
+
+    modes = ['fp32'] + [mode for mode in args.modes if mode != 'fp32']
+    results = {}
+    reference = None
+    for mode in modes:
+        gc.collect()
+        rss_before = current_rss_bytes()
+        started_at = time.perf_counter()
+        embeddings = vector_store.load_clip_model(mode)
+        load_seconds = time.perf_counter() - started_at
+        model_rss = current_rss_bytes() - rss_before
+
+        text_metrics, image_metrics, query_vectors, corpus = embed_sample(
+            embeddings, texts, queries, images, args.batch_size
+        )
+        neighbours = top_k(query_vectors, corpus, args.k)
+        if reference is None:
+            reference = (neighbours, np.asarray(corpus, dtype=np.float32))
+        results[mode] = {
+            'load_seconds': load_seconds,
+            'model_rss_bytes': model_rss,
+            'texts_per_sec': text_metrics['items_per_sec'],
+            'images_per_sec': image_metrics['items_per_sec'],
+            'peak_rss_bytes': max(text_metrics['peak_rss_bytes'], image_metrics['peak_rss_bytes']),
+            f'recall@{args.k}': recall_at_k(reference[0], neighbours),
+            # Косинус между векторами режима и fp32 для одних и тех же элементов
+            'mean_cosine_to_fp32': float(np.mean(np.sum(reference[1] * np.asarray(corpus, dtype=np.float32), axis=1))),
+        }
+        del embeddings
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', default='clip_modes.json')
+    parser.add_argument('--modes', nargs='+', default=list(INFERENCE_MODES), choices=INFERENCE_MODES)
+    parser.add_argument('--texts', type=int, default=256)
+    parser.add_argument('--queries', type=int, default=64)
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=None, help='потоки PyTorch (по умолчанию - CLIP_NUM_THREADS)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.threads:
+        vector_store.CLIP_NUM_THREADS = args.threads
+
+    work_dir = tempfile.mkdtemp(prefix='mm-rag-clip-')
+    try:
+        results = run_modes(args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'params': vars(args),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for mode, metrics in results.items():
+        print(f"{mode}: тексты {metrics['texts_per_sec']:.1f}/с, изображения {metrics['images_per_sec']:.1f}/с, "
+              f"модель {metrics['model_rss_bytes'] / 2**20:.0f} МБ, пик {metrics['peak_rss_bytes'] / 2**20:.0f} МБ, "
+              f"recall@{args.k} {metrics[f'recall@{args.k}']:.3f}, косинус к fp32 {metrics['mean_cosine_to_fp32']:.4f}")
+    print(f"Результаты сохранены в {args.output}")
+    return report
+
+if __name__ == "__main__":
+    main()
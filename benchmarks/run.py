@@ -0,0 +1,239 @@
+"""
+Офлайн-бенчмарк путей загрузки и запросов на заглушках моделей.
+Измеряет пропускную способность, задержки p50/p95/p99 и пиковую память
+handle_pdf, create_content_summaries, build_retriever, multi_modal_rag и
+multi_modal_rag_batch на синтетических данных и сохраняет результат в JSON
+для сравнения коммитов.
+
+Разбор PDF выполняется настоящим unstructured: его модели разметки
+должны быть в локальном кеше.
+
+Запуск: python -m benchmarks.run --output benchmark.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import numpy as np
+from benchmarks.stand_ins import StandInLlama, StandInEmbeddings, stand_in_blip, install_stand_ins
+from benchmarks.synthetic import make_corpus
+from data_processing import image_handler
+from data_processing.pdf_handler import handle_pdf
+from data_processing.records import ContentRecord
+from retrieval import rag_engine
+from retrieval.summary_cache import SummaryCache
+from storage import vector_store
+from storage.embedding_cache import EmbeddingCache, CachedEmbeddings
+from utils.model_registry import current_rss_bytes
+
+class PeakMemory:
+    """
+    Отслеживает пиковый резидентный объем памяти процесса в фоновом потоке.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while True:
+            self.peak = max(self.peak, current_rss_bytes())
+            if self._stop.wait(self.interval):
+                break
+
+    def __enter__(self):
+        self.peak = current_rss_bytes()
+        self._thread = threading.Thread(target=self._sample, name='bench-memory', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+
+def measure(calls):
+    """
+    Выполняет вызовы и собирает метрики.
+
+    Параметры:
+    calls (list): Пары (функция без аргументов, число обработанных элементов).
+
+    Возвращает:
+    tuple: Метрики и результаты вызовов.
+    """
+    latencies, outputs = [], []
+    items = 0
+    rss_before = current_rss_bytes()
+    with PeakMemory() as memory:
+        started_at = time.perf_counter()
+        for call, n_items in calls:
+            call_started_at = time.perf_counter()
+            outputs.append(call())
+            latencies.append(time.perf_counter() - call_started_at)
+            items += n_items
+        elapsed = time.perf_counter() - started_at
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (0.0, 0.0, 0.0)
+    return {
+        'calls': len(calls),
+        'items': items,
+        'seconds': elapsed,
+        'items_per_sec': items / elapsed if elapsed else 0.0,
+        'latency_p50': float(p50),
+        'latency_p95': float(p95),
+        'latency_p99': float(p99),
+        'peak_rss_bytes': memory.peak,
+        'peak_rss_delta_bytes': memory.peak - rss_before,
+    }, outputs
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(args, work_dir):
+    install_stand_ins(
+        llm=StandInLlama(
+            output_tokens=args.llm_output_tokens,
+            prefill_seconds_per_token=args.llm_prefill_latency,
+            decode_seconds_per_token=args.llm_token_latency,
+        ),
+        blip=stand_in_blip(seconds_per_image=args.blip_latency, output_words=args.blip_output_words),
+        clip=CachedEmbeddings(
+            StandInEmbeddings(seconds_per_item=args.clip_latency),
+            EmbeddingCache(os.path.join(work_dir, 'embeddings'), 1 << 30),
+            model_id='stand-in',
+        ),
+    )
+    # Каждый запуск начинается с холодных кешей
+    rag_engine.summary_cache = SummaryCache(os.path.join(work_dir, 'summaries.sqlite'), 1 << 30)
+    rag_engine.SUMMARY_WORKERS = 1
+    rag_engine.summarization_engine = None
+    rag_engine.ANSWER_CACHE_ENABLED = False
+    image_handler._caption_cache.clear()
+    image_handler._perceptual_cache.clear()
+    vector_store.MMAP_INDEX_PATH = os.path.join(work_dir, 'mmap')
+
+    pdfs, images = make_corpus(
+        os.path.join(work_dir, 'corpus'), n_pdfs=args.pdfs, n_pages=args.pages,
+        n_images=args.images, seed=args.seed,
+    )
+    results = {}
+
+    results['handle_pdf'], parsed = measure([(lambda path=path: handle_pdf(path), args.pages) for path in pdfs])
+    results['handle_pdf']['unit'] = 'pages'
+
+    results['create_content_summaries'], summarized = measure([
+        (lambda tables=tables, texts=texts: rag_engine.create_content_summaries(texts, tables, summarize_texts=True),
+         len(texts) + len(tables))
+        for tables, texts in parsed
+    ])
+    results['create_content_summaries']['unit'] = 'chunks'
+
+    records = []
+    for path, (tables, texts), (text_overviews, table_overviews) in zip(pdfs, parsed, summarized):
+        for text, summary in zip(list(texts) + list(tables), list(text_overviews) + list(table_overviews)):
+            records.append(ContentRecord('pdf', path, summary=summary))
+    results['caption_images'], (captions,) = measure([
+        (lambda: image_handler.caption_images(images), len(images))
+    ])
+    results['caption_images']['unit'] = 'images'
+    records += [
+        ContentRecord('image', path, summary=caption)
+        for path, caption in zip(images, captions) if caption is not None
+    ]
+
+    vectorstore = vector_store.build_vectorstore(os.path.join(work_dir, 'chroma'), backend=args.backend)
+    docstore = vector_store.build_docstore(os.path.join(work_dir, 'docstore'))
+    batches = [records[start:start + args.index_batch] for start in range(0, len(records), args.index_batch)]
+    results['build_retriever'], retrievers = measure([
+        (lambda batch=batch: vector_store.build_retriever(vectorstore, docstore, batch), len(batch))
+        for batch in batches
+    ])
+    results['build_retriever']['unit'] = 'records'
+
+    # Пересборка индекса в другом хранилище: векторы берутся из кеша встраиваний
+    rebuild_backend = 'chroma' if args.backend == 'mmap' else 'mmap'
+    vector_store.MMAP_INDEX_PATH = os.path.join(work_dir, 'mmap-rebuild')
+    rebuilt_vectorstore = vector_store.build_vectorstore(os.path.join(work_dir, 'chroma-rebuild'), backend=rebuild_backend)
+    rebuilt_docstore = vector_store.build_docstore(os.path.join(work_dir, 'docstore-rebuild'))
+    results['rebuild_retriever'], _ = measure([
+        (lambda batch=batch: vector_store.build_retriever(rebuilt_vectorstore, rebuilt_docstore, batch), len(batch))
+        for batch in batches
+    ])
+    results['rebuild_retriever']['unit'] = 'records'
+
+    retriever = retrievers[-1] if retrievers else vector_store.create_retriever(vectorstore, docstore)
+    rng = np.random.default_rng(args.seed)
+    words = ' '.join(record.summary for record in records).split() or ['query']
+    queries = [' '.join(rng.choice(words, 6)) for _ in range(args.queries)]
+    results['multi_modal_rag'], _ = measure([
+        (lambda query=query: rag_engine.multi_modal_rag(query, retriever), 1) for query in queries
+    ])
+    results['multi_modal_rag']['unit'] = 'queries'
+
+    results['multi_modal_rag_batch'], _ = measure([
+        (lambda: list(rag_engine.multi_modal_rag_batch(queries, retriever)), len(queries))
+    ])
+    results['multi_modal_rag_batch']['unit'] = 'queries'
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--backend', default='chroma', choices=['chroma', 'mmap'])
+    parser.add_argument('--pdfs', type=int, default=2)
+    parser.add_argument('--pages', type=int, default=4)
+    parser.add_argument('--images', type=int, default=8)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--index-batch', type=int, default=32)
+    parser.add_argument('--llm-output-tokens', type=int, default=64)
+    parser.add_argument('--llm-prefill-latency', type=float, default=0.0002)
+    parser.add_argument('--llm-token-latency', type=float, default=0.002)
+    parser.add_argument('--blip-latency', type=float, default=0.05)
+    parser.add_argument('--blip-output-words', type=int, default=12)
+    parser.add_argument('--clip-latency', type=float, default=0.002)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help='не удалять рабочую директорию')
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='mm-rag-bench-')
+    try:
+        results = run_benchmarks(args, work_dir)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'params': vars(args),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for name, metrics in results.items():
+        print(f"{name}: {metrics['items_per_sec']:.2f} {metrics['unit']}/с, "
+              f"p50 {metrics['latency_p50'] * 1000:.0f} мс, p95 {metrics['latency_p95'] * 1000:.0f} мс, "
+              f"p99 {metrics['latency_p99'] * 1000:.0f} мс, пик памяти {metrics['peak_rss_bytes'] / 2**20:.0f} МБ")
+    print(f"Результаты сохранены в {args.output}")
+    return report
+
+if __name__ == "__main__":
+    main()
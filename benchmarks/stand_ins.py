@@ -0,0 +1,150 @@
+"""
+Детерминированные заглушки Llama, BLIP-2 и OpenCLIP для бенчмарков без
+загрузки моделей. Задержка и объем вывода настраиваются; результат зависит
+только от входных данных.
+"""
+import io
+import time
+import hashlib
+import numpy as np
+from PIL import Image
+from langchain_core.embeddings import Embeddings
+from utils.model_registry import registry
+
+_WORDS = (
+    'данные анализ система модель документ таблица значение результат процесс '
+    'метод структура информация отчет показатель изменение уровень период'
+).split()
+
+def _digest(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).digest()
+
+def _words(seed, n_words):
+    rng = np.random.default_rng(int.from_bytes(_digest(seed)[:8], 'little'))
+    return ' '.join(_WORDS[i] for i in rng.integers(0, len(_WORDS), n_words))
+
+class StandInLlama:
+    """
+    Заглушка llama_cpp.Llama: токены - 4-байтовые фрагменты UTF-8,
+    задержка пропорциональна длине промпта и числу генерируемых токенов.
+    """
+
+    def __init__(self, output_tokens=64, prefill_seconds_per_token=0.0002,
+                 decode_seconds_per_token=0.002, n_ctx=4096):
+        self.output_tokens = output_tokens
+        self.prefill_seconds_per_token = prefill_seconds_per_token
+        self.decode_seconds_per_token = decode_seconds_per_token
+        self._n_ctx = n_ctx
+        self.metadata = {}
+        self.model_path = 'stand-in.gguf'
+        self.n_tokens = 0
+
+    def n_ctx(self):
+        return self._n_ctx
+
+    def tokenize(self, text, add_bos=True, special=False):
+        return [int.from_bytes(text[i:i + 4], 'little') for i in range(0, len(text), 4)]
+
+    def detokenize(self, tokens):
+        return b''.join(token.to_bytes(4, 'little').rstrip(b'\0') for token in tokens)
+
+    def create_chat_completion(self, messages, stream=False, **kwargs):
+        prompt = ''.join(message['content'] for message in messages)
+        n_prompt = len(self.tokenize(prompt.encode('utf-8')))
+        if n_prompt > self._n_ctx:
+            raise ValueError(f"Requested tokens ({n_prompt}) exceed context window of {self._n_ctx}")
+        time.sleep(n_prompt * self.prefill_seconds_per_token)
+        words = _words(prompt, self.output_tokens).split()
+        if not stream:
+            time.sleep(len(words) * self.decode_seconds_per_token)
+            return {'choices': [{'message': {'role': 'assistant', 'content': ' '.join(words)}}]}
+        return self._stream(words)
+
+    def _stream(self, words):
+        for i, word in enumerate(words):
+            time.sleep(self.decode_seconds_per_token)
+            yield {'choices': [{'delta': {'content': word if i == 0 else ' ' + word}}]}
+
+class _StandInBlipProcessor:
+
+    def __call__(self, images=None, return_tensors=None, **kwargs):
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+        return {'pixel_values': [_digest(image.tobytes()) for image in images]}
+
+    def decode(self, output, skip_special_tokens=True):
+        return output
+
+    def batch_decode(self, outputs, skip_special_tokens=True):
+        return list(outputs)
+
+class _StandInBlipModel:
+
+    def __init__(self, seconds_per_image, output_words):
+        self.seconds_per_image = seconds_per_image
+        self.output_words = output_words
+
+    def generate(self, pixel_values, max_new_tokens=64, **kwargs):
+        time.sleep(self.seconds_per_image * len(pixel_values))
+        n_words = min(self.output_words, max_new_tokens)
+        return [_words(digest, n_words) for digest in pixel_values]
+
+def stand_in_blip(seconds_per_image=0.05, output_words=12):
+    """
+    Возвращает пару (процессор, модель) с интерфейсом Blip2Processor /
+    Blip2ForConditionalGeneration, используемым в image_handler.
+    """
+    return _StandInBlipProcessor(), _StandInBlipModel(seconds_per_image, output_words)
+
+class StandInEmbeddings(Embeddings):
+    """
+    Заглушка BatchedOpenCLIPEmbeddings: нормированные псевдослучайные векторы,
+    зависящие только от текста или пикселей.
+    """
+
+    def __init__(self, dim=512, seconds_per_item=0.002):
+        self.dim = dim
+        self.seconds_per_item = seconds_per_item
+
+    def _vector(self, data):
+        rng = np.random.default_rng(int.from_bytes(_digest(data)[:8], 'little'))
+        vector = rng.standard_normal(self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.seconds_per_item * len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def embed_pil_images(self, images):
+        time.sleep(self.seconds_per_item * len(images))
+        return [self._vector(image.convert('RGB').tobytes()) for image in images]
+
+    def embed_image_bytes(self, datas):
+        images = []
+        for data in datas:
+            with Image.open(io.BytesIO(data)) as image:
+                images.append(image.convert('RGB'))
+        return self.embed_pil_images(images)
+
+    def embed_image(self, uris):
+        images = []
+        for uri in uris:
+            with Image.open(uri) as image:
+                images.append(image.convert('RGB'))
+        return self.embed_pil_images(images)
+
+def install_stand_ins(llm=None, blip=None, clip=None):
+    """
+    Подменяет модели в реестре заглушками и выгружает объекты,
+    созданные из прежней языковой модели.
+    """
+    registry.override('llm', llm or StandInLlama())
+    registry.override('blip', blip or stand_in_blip())
+    registry.override('clip', clip or StandInEmbeddings())
+    for name in ('llm_prefix_cache', 'context_packer'):
+        registry.unload(name)
@@ -0,0 +1,109 @@
+"""
+Генерация синтетических PDF-документов и изображений для бенчмарков.
+"""
+import os
+import textwrap
+import numpy as np
+from PIL import Image, ImageDraw
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+
+_WORDS = (
+    'climate energy market policy growth report analysis region sector demand supply '
+    'index average annual change forecast emission storage network capacity model'
+).split()
+
+def _paragraph(rng, n_words):
+    words = [_WORDS[i] for i in rng.integers(0, len(_WORDS), n_words)]
+    return ' '.join(words).capitalize() + '.'
+
+def make_texts(n_texts, words_per_text=40, seed=0):
+    """
+    Возвращает:
+    list: Синтетические абзацы текста.
+    """
+    rng = np.random.default_rng(seed)
+    return [_paragraph(rng, words_per_text) for _ in range(n_texts)]
+
+def make_pdf(path, n_pages=4, paragraphs_per_page=4, words_per_paragraph=60, table_every=2, seed=0):
+    """
+    Создает PDF с заголовками, абзацами текста и таблицами.
+
+    Параметры:
+    path (str): Путь к создаваемому файлу.
+    n_pages (int): Число страниц.
+    paragraphs_per_page (int): Число абзацев на странице.
+    words_per_paragraph (int): Число слов в абзаце.
+    table_every (int): Таблица на каждой table_every-й странице (0 - без таблиц).
+    seed (int): Начальное значение генератора случайных чисел.
+
+    Возвращает:
+    str: Путь к файлу.
+    """
+    rng = np.random.default_rng(seed)
+    with PdfPages(path) as pdf:
+        for page in range(n_pages):
+            fig = plt.figure(figsize=(8.27, 11.69))
+            fig.text(0.08, 0.95, f'Section {page + 1}: {_paragraph(rng, 4)[:-1]}', fontsize=16, weight='bold')
+            y = 0.9
+            for _ in range(paragraphs_per_page):
+                lines = textwrap.wrap(_paragraph(rng, words_per_paragraph), 95)
+                fig.text(0.08, y, '\n'.join(lines), fontsize=9, va='top')
+                y -= 0.02 * len(lines) + 0.03
+            if table_every and page % table_every == table_every - 1:
+                ax = fig.add_axes([0.08, 0.05, 0.84, max(y - 0.1, 0.1)])
+                ax.axis('off')
+                ax.table(
+                    cellText=rng.integers(0, 1000, (6, 4)).astype(str).tolist(),
+                    colLabels=['Region', 'Year', 'Value', 'Change'],
+                    loc='center',
+                )
+            pdf.savefig(fig)
+            plt.close(fig)
+    return path
+
+def make_image(path, size=(640, 480), seed=0):
+    """
+    Создает JPEG-изображение из градиента и случайных фигур.
+
+    Возвращает:
+    str: Путь к файлу.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    base = (gradient * rng.random(3)[None, None, :]).repeat(height, axis=0).astype(np.uint8)
+    image = Image.fromarray(base)
+    draw = ImageDraw.Draw(image)
+    for _ in range(8):
+        x0, y0 = int(rng.integers(0, width - 20)), int(rng.integers(0, height - 20))
+        x1, y1 = x0 + int(rng.integers(10, width // 3)), y0 + int(rng.integers(10, height // 3))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        (draw.ellipse if rng.random() < 0.5 else draw.rectangle)([x0, y0, x1, y1], fill=color)
+    image.save(path, format='JPEG', quality=90)
+    return path
+
+def make_corpus(directory, n_pdfs=2, n_pages=4, n_images=8, duplicate_images=2, seed=0):
+    """
+    Создает набор синтетических PDF и изображений (часть изображений - копии).
+
+    Возвращает:
+    tuple: Списки путей к PDF и изображениям.
+    """
+    os.makedirs(directory, exist_ok=True)
+    pdfs = [
+        make_pdf(os.path.join(directory, f'doc-{i}.pdf'), n_pages=n_pages, seed=seed + i)
+        for i in range(n_pdfs)
+    ]
+    images = [
+        make_image(os.path.join(directory, f'image-{i}.jpg'), seed=seed + i)
+        for i in range(n_images - duplicate_images)
+    ]
+    for i in range(duplicate_images if images else 0):
+        path = os.path.join(directory, f'image-copy-{i}.jpg')
+        with open(images[i % len(images)], 'rb') as src, open(path, 'wb') as dst:
+            dst.write(src.read())
+        images.append(path)
+    return pdfs, images
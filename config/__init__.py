@@ -5,4 +5,125 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 INPUT_DIR = os.path.join(PROJECT_ROOT, 'source')
 DB_PATH = os.path.join(PROJECT_ROOT, 'db')
 VECTOR_DB_PATH = os.path.join(PROJECT_ROOT, 'db_v1')
-DOCSTORE_PATH = os.path.join(PROJECT_ROOT, 'db_d1')
\ No newline at end of file
+DOCSTORE_PATH = os.path.join(PROJECT_ROOT, 'db_d1')
+
+# Incremental ingestion manifest
+MANIFEST_PATH = os.path.join(PROJECT_ROOT, 'db_manifest.json')
+# Bump when partitioning, splitting, summarization or embedding changes
+# so that every file is re-indexed on the next start
+PIPELINE_VERSION = '2|Qwen3-8B-Q6_K|blip2-opt-2.7b|ViT-B-32/laion2b_s34b_b79k'
+
+# Persistent LLM summary cache
+SUMMARY_CACHE_PATH = os.path.join(PROJECT_ROOT, 'db_cache', 'summaries.sqlite')
+SUMMARY_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Parallel summarization: number of llama.cpp worker processes
+# (1 = summarize sequentially with the shared model)
+SUMMARY_WORKERS = 1
+SUMMARY_THREADS_PER_WORKER = None
+SUMMARY_TIMEOUT = 600
+SUMMARY_RETRIES = 1
+
+# Mini-batch size for OpenCLIP embedding and bulk index writes
+EMBED_BATCH_SIZE = 32
+
+# OpenCLIP inference on CPU: 'fp32', 'int8' (dynamic quantization of linear layers) or 'bf16'
+# (python -m benchmarks.clip_modes compares speed, memory and recall@k against fp32)
+CLIP_INFERENCE_MODE = 'fp32'
+# PyTorch intra-op / inter-op threads for OpenCLIP (None = PyTorch default)
+CLIP_NUM_THREADS = None
+CLIP_INTEROP_THREADS = None
+
+# Persistent OpenCLIP embedding cache keyed by model, modality and content hash
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_PATH = os.path.join(PROJECT_ROOT, 'db_cache', 'embeddings')
+EMBEDDING_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Models to load in a background thread at startup ('llm', 'blip', 'clip');
+# everything else is loaded lazily on first use
+MODEL_WARMUP = []
+
+# KV-state cache for the static system-prompt prefixes
+PREFIX_CACHE_ENABLED = True
+PREFIX_CACHE_MAX_ENTRIES = 2
+PREFIX_CACHE_DIR = os.path.join(PROJECT_ROOT, 'db_cache', 'kv')
+
+# Answer cache in front of multi_modal_rag (exact + semantic tiers)
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_MAX_ENTRIES = 512
+ANSWER_CACHE_TTL = 24 * 3600
+ANSWER_CACHE_SIMILARITY = 0.95
+
+# Parallel PDF partitioning (1 = partition in the current process)
+PDF_PARTITION_WORKERS = 1
+PDF_PAGES_PER_SHARD = 20
+PDF_PARALLEL_MIN_PAGES = 40
+
+# Streaming ingestion pipeline
+PIPELINE_QUEUE_SIZE = 64
+PIPELINE_REPORT_INTERVAL = 30
+
+# Batched BLIP-2 captioning
+CAPTION_BATCH_SIZE = 8
+CAPTION_MAX_NEW_TOKENS = 64
+CAPTION_MAX_SIDE = 512
+# Max Hamming distance between 64-bit dHashes for near-duplicates (-1 = exact only)
+CAPTION_PHASH_DISTANCE = 4
+CAPTION_CACHE_SIZE = 4096
+# Also caption figures extracted from PDFs into image_output_dir_path
+CAPTION_PDF_FIGURES = False
+
+# Near-duplicate text chunks and tables (MinHash/LSH) are summarized and indexed once per ingestion run
+DEDUP_ENABLED = True
+# Estimated Jaccard similarity of word 3-gram shingles above which chunks are collapsed
+DEDUP_THRESHOLD = 0.85
+DEDUP_NUM_PERM = 64
+DEDUP_BANDS = 16
+
+# Vector index backend: 'chroma' or 'mmap' (in-process memory-mapped float16 index)
+VECTOR_BACKEND = 'chroma'
+MMAP_INDEX_PATH = os.path.join(PROJECT_ROOT, 'db_mmap')
+# Clusters probed per query once an IVF quantizer is built (MemmapVectorStore.build_ivf)
+MMAP_IVF_NPROBE = 8
+# Rewrite the index without deleted rows once they reach this share (and row count)
+MMAP_COMPACT_RATIO = 0.3
+MMAP_COMPACT_MIN_ROWS = 4096
+
+# Token-budget context packing for answers (tokens counted by the LLM tokenizer)
+CONTEXT_PACKING_ENABLED = True
+CONTEXT_TOKEN_BUDGET = 2048
+ANSWER_TOKEN_RESERVE = 1024
+# Candidates over-fetched from the index before packing (text / image queries)
+CONTEXT_CANDIDATES = 12
+CONTEXT_IMAGE_CANDIDATES = 4
+# Word-trigram Jaccard similarity above which a passage counts as a duplicate
+CONTEXT_DEDUP_THRESHOLD = 0.8
+# multi_modal_rag_batch: unique queries embedded and searched per block
+BATCH_QUERY_BLOCK = 256
+
+# Docstore backend: 'packed' (single append-only log in DOCSTORE_PATH) or 'files' (LocalFileStore)
+DOCSTORE_BACKEND = 'packed'
+# Compact the log once this share of it is overwritten/deleted data
+DOCSTORE_COMPACT_RATIO = 0.5
+DOCSTORE_COMPACT_MIN_BYTES = 16 << 20
+
+# Tracing: JSON span log (None = off), Prometheus /metrics port (None = off)
+TRACE_JSON_LOG = None
+TRACE_METRICS_PORT = None
+TRACE_HISTORY = 50
+# Attach sampled stacks to queries slower than this many seconds (None = no profiling)
+TRACE_PROFILE_SLOW_SECONDS = None
+TRACE_PROFILE_INTERVAL = 0.01
+
+# Shared query service (one retriever and LLM pool per process)
+QUERY_POOL_SIZE = 1
+QUERY_QUEUE_SIZE = 16
+QUERY_TIMEOUT = 300
+# Local HTTP endpoint of the query service (None = off)
+QUERY_SERVICE_PORT = None
+
+# Versioned manifest of the persisted index (embedding model, collection, item counts);
+# checked on startup so an existing index is reopened instead of rebuilt
+INDEX_MANIFEST_PATH = os.path.join(PROJECT_ROOT, 'db_index.json')
+# Open the persisted index read-only in the app (uploads are disabled)
+INDEX_READ_ONLY = False
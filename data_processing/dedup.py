@@ -0,0 +1,105 @@
+import re
+import hashlib
+import numpy as np
+
+# Простое число Мерсенна 2^61 - 1 для универсального хеширования
+_PRIME = (1 << 61) - 1
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+def _shingle_hashes(text, shingle_size):
+    words = _WORD.findall(text.lower())
+    if len(words) < shingle_size:
+        shingles = [' '.join(words)] if words else [text]
+    else:
+        shingles = {' '.join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)}
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little') for s in shingles),
+        dtype=np.uint64,
+    )
+
+class NearDuplicateIndex:
+    """
+    Поиск почти одинаковых фрагментов (повторяющиеся дисклеймеры, колонтитулы,
+    таблицы) по MinHash-сигнатурам словесных шинглов с индексом LSH:
+    сигнатура делится на полосы, кандидатами считаются фрагменты хотя бы
+    с одной совпавшей полосой, поэтому поиск не перебирает весь корпус.
+    Кандидат подтверждается оценкой сходства Жаккара по сигнатурам.
+    """
+
+    def __init__(self, threshold=0.85, num_perm=64, bands=16, shingle_size=3, seed=0):
+        """
+        Параметры:
+        threshold (float): Минимальное сходство Жаккара для дубликата.
+        num_perm (int): Длина MinHash-сигнатуры.
+        bands (int): Число полос LSH (num_perm должно делиться на bands).
+        shingle_size (int): Длина шингла в словах.
+        seed (int): Начальное значение для коэффициентов хеш-функций.
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # Хеши шинглов и коэффициенты меньше 2^32: a * h + b помещается в uint64
+        self._a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = {}
+
+    def signature(self, text):
+        """
+        Возвращает:
+        np.ndarray: MinHash-сигнатура текста.
+        """
+        hashes = _shingle_hashes(text, self.shingle_size)
+        return ((self._a[:, None] * hashes[None, :] + self._b[:, None]) % np.uint64(_PRIME)).min(axis=1)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def find(self, signature):
+        """
+        Ищет ранее добавленный почти одинаковый фрагмент.
+
+        Возвращает:
+        tuple: Ключ найденного фрагмента и оценка сходства или (None, 0.0).
+        """
+        best_key, best_score = None, 0.0
+        seen = set()
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            for key in bucket.get(band_key, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                score = float(np.mean(self._signatures[key] == signature))
+                if score > best_score:
+                    best_key, best_score = key, score
+        if best_score >= self.threshold:
+            return best_key, best_score
+        return None, 0.0
+
+    def add(self, key, signature):
+        """
+        Добавляет фрагмент в индекс.
+        """
+        self._signatures[key] = signature
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(band_key, []).append(key)
+
+    def remove(self, key):
+        """
+        Убирает фрагмент из индекса (если он там есть).
+        """
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            keys = bucket[band_key]
+            keys.remove(key)
+            if not keys:
+                del bucket[band_key]
+
+    def __len__(self):
+        return len(self._signatures)
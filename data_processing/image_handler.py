@@ -1,11 +1,26 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 from PIL import Image
 import cv2
 import numpy as np
+import torch
 from transformers import Blip2Processor, Blip2ForConditionalGeneration
+from config import (
+    CAPTION_BATCH_SIZE, CAPTION_MAX_NEW_TOKENS, CAPTION_MAX_SIDE,
+    CAPTION_PHASH_DISTANCE, CAPTION_CACHE_SIZE,
+)
+from utils.model_registry import registry
+from utils.tracing import tracer
 
-# Initialize BLIP model for image captioning
-blip_processor = Blip2Processor.from_pretrained("Salesforce/blip2-opt-2.7b")
-blip_model = Blip2ForConditionalGeneration.from_pretrained("Salesforce/blip2-opt-2.7b")
+def _load_blip():
+    # Initialize BLIP model for image captioning
+    blip_processor = Blip2Processor.from_pretrained("Salesforce/blip2-opt-2.7b")
+    blip_model = Blip2ForConditionalGeneration.from_pretrained("Salesforce/blip2-opt-2.7b")
+    return blip_processor, blip_model
+
+registry.register('blip', _load_blip)
 
 def analyze_image(image_path):
     """
@@ -23,6 +38,7 @@ def analyze_image(image_path):
         elif isinstance(image_path, np.ndarray):
             image_data = Image.fromarray(cv2.cvtColor(image_path, cv2.COLOR_BGR2RGB))
 
+        blip_processor, blip_model = registry.get('blip')
         inputs = blip_processor(image_data, return_tensors="pt")
         output = blip_model.generate(**inputs, max_new_tokens=256)
         image_caption = blip_processor.decode(output[0], skip_special_tokens=True)
@@ -31,4 +47,153 @@ def analyze_image(image_path):
 
     except Exception as e:
         print(f"Ошибка при обработке изображения {image_path}: {e}")
-        return None
\ No newline at end of file
+        return None
+
+# Недавние описания: точный хеш файла -> описание и перцептивный хеш -> описание.
+# Кеши общие для всех конвейеров процесса (в приложении - по одному на загрузку)
+_caption_cache = OrderedDict()
+_perceptual_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _load_for_caption(source, max_side):
+    """
+    Загружает изображение сразу в уменьшенном виде: для JPEG декодирование
+    выполняется с понижением разрешения, затем сторона ограничивается max_side.
+    """
+    if isinstance(source, np.ndarray):
+        image = Image.fromarray(cv2.cvtColor(source, cv2.COLOR_BGR2RGB))
+    elif isinstance(source, Image.Image):
+        image = source.copy()
+    else:
+        image = Image.open(source)
+        image.draft('RGB', (max_side, max_side))
+    image = image.convert('RGB')
+    image.thumbnail((max_side, max_side))
+    return image
+
+def _exact_hash(source):
+    if isinstance(source, np.ndarray):
+        return hashlib.sha256(source.tobytes()).hexdigest()
+    if isinstance(source, Image.Image):
+        return hashlib.sha256(source.tobytes()).hexdigest()
+    with open(source, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def perceptual_hash(image, hash_size=8):
+    """
+    Вычисляет разностный перцептивный хеш (dHash) изображения.
+    
+    Параметры:
+    image (PIL.Image): Изображение.
+    hash_size (int): Размер хеша по стороне (хеш содержит hash_size**2 бит).
+    
+    Возвращает:
+    int: Хеш в виде целого числа.
+    """
+    pixels = np.asarray(image.convert('L').resize((hash_size + 1, hash_size)), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+def _cached_caption(digest):
+    with _cache_lock:
+        caption = _caption_cache.get(digest)
+        if caption is not None:
+            _caption_cache.move_to_end(digest)
+        return caption
+
+def _find_similar(phash, max_distance):
+    with _cache_lock:
+        for other, caption in _perceptual_cache.items():
+            if bin(phash ^ other).count('1') <= max_distance:
+                _perceptual_cache.move_to_end(other)
+                return caption
+    return None
+
+def _remember_caption(digest, phash, caption):
+    with _cache_lock:
+        _caption_cache[digest] = caption
+        _caption_cache.move_to_end(digest)
+        _perceptual_cache[phash] = caption
+        _perceptual_cache.move_to_end(phash)
+        for cache in (_caption_cache, _perceptual_cache):
+            while len(cache) > CAPTION_CACHE_SIZE:
+                cache.popitem(last=False)
+
+def caption_images(sources, batch_size=CAPTION_BATCH_SIZE, max_new_tokens=CAPTION_MAX_NEW_TOKENS,
+                   max_side=CAPTION_MAX_SIDE, max_hash_distance=CAPTION_PHASH_DISTANCE):
+    """
+    Пакетно генерирует описания изображений моделью BLIP-2. Изображения заранее
+    уменьшаются, точные дубликаты и перцептивно похожие изображения
+    (по dHash) описываются один раз.
+    
+    Параметры:
+    sources (list): Пути к файлам, массивы numpy (BGR) или изображения PIL.
+    batch_size (int): Размер пакета для generate.
+    max_new_tokens (int): Максимальная длина описания в токенах.
+    max_side (int): Максимальная сторона изображения после уменьшения.
+    max_hash_distance (int): Максимальное расстояние Хэмминга между dHash
+    для признания изображений дубликатами (-1 - только точные дубликаты).
+    
+    Возвращает:
+    list: Описания в порядке входных изображений; None для изображений,
+    которые не удалось обработать.
+    """
+    started_at = time.perf_counter()
+    captions = [None] * len(sources)
+    pending = []
+    duplicates = 0
+
+    for index, source in enumerate(sources):
+        try:
+            digest = _exact_hash(source)
+            cached = _cached_caption(digest)
+            if cached is not None:
+                captions[index] = cached
+                duplicates += 1
+                continue
+            image = _load_for_caption(source, max_side)
+            phash = perceptual_hash(image)
+            similar = _find_similar(phash, max_hash_distance) if max_hash_distance >= 0 else None
+            if similar is not None:
+                captions[index] = similar
+                _remember_caption(digest, phash, similar)
+                duplicates += 1
+                continue
+            # Дубликат среди еще не описанных изображений этого вызова
+            for other in pending:
+                if other['digest'] == digest or (
+                        max_hash_distance >= 0 and bin(phash ^ other['phash']).count('1') <= max_hash_distance):
+                    other['indices'].append(index)
+                    duplicates += 1
+                    break
+            else:
+                pending.append({'digest': digest, 'phash': phash, 'image': image, 'indices': [index]})
+        except Exception as e:
+            print(f"Ошибка при обработке изображения {source}: {e}")
+
+    if pending:
+        blip_processor, blip_model = registry.get('blip')
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        try:
+            with tracer.span('blip.caption', images=len(batch)):
+                inputs = blip_processor(images=[entry['image'] for entry in batch], return_tensors="pt")
+                with torch.inference_mode():
+                    output = blip_model.generate(**inputs, max_new_tokens=max_new_tokens)
+                batch_captions = blip_processor.batch_decode(output, skip_special_tokens=True)
+        except Exception as e:
+            print(f"Ошибка при описании пакета изображений: {e}")
+            continue
+        for entry, caption in zip(batch, batch_captions):
+            caption = caption.strip()
+            _remember_caption(entry['digest'], entry['phash'], caption)
+            for index in entry['indices']:
+                captions[index] = caption
+        for entry in batch:
+            entry['image'] = None
+
+    elapsed = time.perf_counter() - started_at
+    if sources:
+        print(f"Описание изображений: {len(sources)} шт. ({len(pending)} уникальных, "
+              f"{duplicates} дубликатов) за {elapsed:.1f} с ({len(sources) / elapsed:.2f} изобр./с)")
+    return captions
@@ -1,11 +1,130 @@
+import io
 import os
-from langchain.text_splitter import CharacterTextSplitter
+import glob
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pypdf import PdfReader, PdfWriter
 from unstructured.partition.pdf import partition_pdf
+from unstructured.chunking.title import chunk_by_title
+from config import PDF_PARTITION_WORKERS, PDF_PAGES_PER_SHARD, PDF_PARALLEL_MIN_PAGES
+from data_processing.text_splitter import StreamingTokenSplitter, TextChunk
+from utils.tracing import tracer
+
+# Параметры разбиения на фрагменты по заголовкам
+CHUNKING_PARAMS = {
+    'max_characters': 1500,
+    'new_after_n_chars': 1500,
+    'combine_text_under_n_chars': 500,
+}
+
+# Разбиение текста на фрагменты для суммаризации (в токенах tiktoken gpt2)
+text_splitter = StreamingTokenSplitter(chunk_size=500, chunk_overlap=100)
+
+def _partition_page_range(pdf_path, first_page, last_page, output_dir):
+    """
+    Извлекает элементы из диапазона страниц PDF без разбиения на фрагменты.
+    Номера страниц в метаданных приводятся к нумерации исходного документа.
+    last_page = None - весь документ (без копирования страниц через pypdf).
+    """
+    if last_page is None:
+        with tracer.span('pdf.partition', path=pdf_path) as span:
+            elements = partition_pdf(
+                filename=pdf_path,
+                extract_images_in_pdf=True,
+                infer_table_structure=True,
+                image_output_dir_path=output_dir,
+            )
+            span.set(elements=len(elements))
+        return elements
+
+    reader = PdfReader(pdf_path)
+    writer = PdfWriter()
+    for page_index in range(first_page, last_page):
+        writer.add_page(reader.pages[page_index])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    buffer.seek(0)
+
+    with tracer.span('pdf.partition', path=pdf_path, pages=last_page - first_page, first_page=first_page + 1) as span:
+        elements = partition_pdf(
+            file=buffer,
+            metadata_filename=pdf_path,
+            extract_images_in_pdf=True,
+            infer_table_structure=True,
+            # Имена извлеченных изображений содержат номер страницы внутри диапазона
+            image_output_dir_path=os.path.join(output_dir, f'pages-{first_page + 1}-{last_page}'),
+        )
+        span.set(elements=len(elements))
+    for element in elements:
+        if element.metadata.page_number is not None:
+            element.metadata.page_number += first_page
+    return elements
+
+def _page_ranges(pdf_path):
+    # Без параллельного разбора число страниц не нужно - документ не читается через pypdf
+    if PDF_PARTITION_WORKERS <= 1:
+        return None, [(0, None)]
+    n_pages = len(PdfReader(pdf_path).pages)
+    if n_pages < PDF_PARALLEL_MIN_PAGES:
+        return n_pages, [(0, None)]
+    return n_pages, [
+        (first_page, min(first_page + PDF_PAGES_PER_SHARD, n_pages))
+        for first_page in range(0, n_pages, PDF_PAGES_PER_SHARD)
+    ]
+
+def _create_executor():
+    # spawn: родительский процесс может уже держать потоки torch/llama.cpp
+    return ProcessPoolExecutor(
+        max_workers=PDF_PARTITION_WORKERS,
+        mp_context=multiprocessing.get_context('spawn'),
+    )
+
+def _figure_dir(pdf_path):
+    return '.'.join(pdf_path.split('.')[:-1])
+
+def _figure_paths(output_dir):
+    # Изображения всего документа и поддиректорий диапазонов страниц pages-<первая>-<последняя>
+    return glob.glob(os.path.join(output_dir, 'figure-*.jpg')) + glob.glob(
+        os.path.join(output_dir, 'pages-*', 'figure-*.jpg')
+    )
+
+def _clear_figures(output_dir):
+    """
+    Удаляет изображения, извлеченные из документа при прошлых запусках
+    (в том числе с другим разбиением на диапазоны страниц), чтобы
+    pdf_figures вернул только изображения текущего разбора.
+    """
+    for figure_path in _figure_paths(output_dir):
+        os.remove(figure_path)
+    for shard_dir in glob.glob(os.path.join(output_dir, 'pages-*')):
+        if os.path.isdir(shard_dir) and not os.listdir(shard_dir):
+            os.rmdir(shard_dir)
+
+def _submit_pdf(executor, pdf_path):
+    output_dir = _figure_dir(pdf_path)
+    _clear_figures(output_dir)
+    n_pages, ranges = _page_ranges(pdf_path)
+    futures = [
+        executor.submit(_partition_page_range, pdf_path, first_page, last_page, output_dir)
+        for first_page, last_page in ranges
+    ]
+    return n_pages, futures
+
+def _merge_shards(futures):
+    # Диапазоны идут по порядку страниц, поэтому достаточно склеить списки;
+    # разбиение по заголовкам выполняется уже над всем документом
+    elements = []
+    for future in futures:
+        elements.extend(future.result())
+    return chunk_by_title(elements, **CHUNKING_PARAMS)
 
 def process_pdf_file(pdf_path):
     """
     Извлекает содержимое PDF-файла, включая текст, таблицы и изображения.
     Разбивает текст на фрагменты для дальнейшей обработки.
+    Большие документы (от PDF_PARALLEL_MIN_PAGES страниц) при PDF_PARTITION_WORKERS > 1
+    разбираются параллельно по диапазонам страниц.
     
     Параметры:
     pdf_path (str): Путь к PDF-файлу для обработки.
@@ -13,17 +132,29 @@ def process_pdf_file(pdf_path):
     Возвращает:
     list: Список элементов, извлеченных из PDF.
     """
-    output_dir = '.'.join(pdf_path.split('.')[:-1])
-    return partition_pdf(
-        filename=pdf_path,
-        extract_images_in_pdf=True,
-        infer_table_structure=True,
-        chunking_strategy="by_title",
-        max_characters=1500,
-        new_after_n_chars=1500,
-        combine_text_under_n_chars=500,
-        image_output_dir_path=output_dir,
-    )
+    output_dir = _figure_dir(pdf_path)
+    n_pages, ranges = _page_ranges(pdf_path)
+    if len(ranges) == 1:
+        _clear_figures(output_dir)
+        with tracer.span('pdf.partition', path=pdf_path, pages=n_pages) as span:
+            elements = partition_pdf(
+                filename=pdf_path,
+                extract_images_in_pdf=True,
+                infer_table_structure=True,
+                chunking_strategy="by_title",
+                image_output_dir_path=output_dir,
+                **CHUNKING_PARAMS,
+            )
+            span.set(elements=len(elements))
+        return elements
+
+    started_at = time.perf_counter()
+    with _create_executor() as executor:
+        _, futures = _submit_pdf(executor, pdf_path)
+        elements = _merge_shards(futures)
+    elapsed = time.perf_counter() - started_at
+    print(f"Разбор PDF {pdf_path}: {n_pages} стр. за {elapsed:.1f} с ({n_pages / elapsed:.2f} стр./с)")
+    return elements
 
 def sort_pdf_content(pdf_content):
     """
@@ -46,6 +177,90 @@ def sort_pdf_content(pdf_content):
             
     return text_elements, table_elements
 
+def pdf_figures(pdf_path):
+    """
+    Находит изображения, извлеченные из PDF-файла в image_output_dir_path.
+    
+    Параметры:
+    pdf_path (str): Путь к PDF-файлу.
+    
+    Возвращает:
+    list: Пары (путь к изображению, номер страницы или None) в порядке страниц.
+    """
+    figures = []
+    for figure_path in _figure_paths(_figure_dir(pdf_path)):
+        try:
+            page = int(os.path.basename(figure_path).split('-')[1])
+        except (IndexError, ValueError):
+            page = None
+        # Изображения диапазона страниц лежат в поддиректории pages-<первая>-<последняя>
+        shard_dir = os.path.basename(os.path.dirname(figure_path))
+        if page is not None and shard_dir.startswith('pages-'):
+            page += int(shard_dir.split('-')[1]) - 1
+        figures.append((figure_path, page))
+    return sorted(figures, key=lambda figure: (figure[1] or 0, figure[0]))
+
+def _element_spans(pdf_content, kind):
+    # Смещения считаются по тексту всех текстовых элементов и таблиц, соединенных пробелом
+    offset = 0
+    for element in pdf_content:
+        element_type = str(type(element))
+        if "unstructured.documents.elements.Table" in element_type:
+            element_kind = 'table'
+        elif "unstructured.documents.elements.CompositeElement" in element_type:
+            element_kind = 'text'
+        else:
+            continue
+        text = str(element)
+        if element_kind == kind:
+            yield text, offset, element.metadata.page_number
+        offset += len(text) + 1
+
+def iter_pdf_chunks(pdf_content):
+    """
+    Потоково разбивает элементы PDF на фрагменты: текстовые элементы
+    набираются во фрагменты по токенам, таблицы остаются целыми.
+    
+    Параметры:
+    pdf_content (list): Список элементов, извлеченных из PDF.
+    
+    Возвращает:
+    generator: Пары (тип 'text' или 'table', TextChunk) со смещениями
+    в тексте документа и номерами страниц.
+    """
+    busy = 0.0
+    counts = {'text': 0, 'table': 0}
+    started_at = time.perf_counter()
+    chunks = text_splitter.split(_element_spans(pdf_content, 'text'))
+    tables = (
+        TextChunk(text, start, start + len(text), page, page)
+        for text, start, page in _element_spans(pdf_content, 'table')
+    )
+    for kind, stream in (('text', chunks), ('table', tables)):
+        for chunk in stream:
+            busy += time.perf_counter() - started_at
+            counts[kind] += 1
+            yield kind, chunk
+            started_at = time.perf_counter()
+    busy += time.perf_counter() - started_at
+    # Время разбиения без времени обработки фрагментов потребителем
+    tracer.record('pdf.split', busy, chunks=counts['text'], tables=counts['table'])
+
+def split_pdf_content(pdf_content):
+    """
+    Классифицирует элементы PDF и разбивает текст на фрагменты.
+    
+    Параметры:
+    pdf_content (list): Список элементов, извлеченных из PDF.
+    
+    Возвращает:
+    tuple: Списки таблиц и текстовых фрагментов.
+    """
+    table_elements, text_chunks = [], []
+    for kind, chunk in iter_pdf_chunks(pdf_content):
+        (text_chunks if kind == 'text' else table_elements).append(chunk.text)
+    return table_elements, text_chunks
+
 def handle_pdf(pdf_path):
     """
     Основная функция обработки PDF-файла: извлечение, классификация и разбиение на части.
@@ -57,14 +272,70 @@ def handle_pdf(pdf_path):
     tuple: Списки таблиц и текстовых фрагментов.
     """
     pdf_content = process_pdf_file(pdf_path)
-    text_elements, table_elements = sort_pdf_content(pdf_content)
+    return split_pdf_content(pdf_content)
+
+def partition_pdfs(pdf_paths):
+    """
+    Извлекает элементы из нескольких PDF-файлов: файлы и диапазоны страниц
+    больших документов разбираются в общем пуле процессов.
     
-    text_splitter = CharacterTextSplitter.from_tiktoken_encoder(
-        chunk_size=500,
-        chunk_overlap=100,
-    )
+    Параметры:
+    pdf_paths (list): Пути к PDF-файлам.
     
-    combined_text = " ".join(text_elements)
-    text_chunks = text_splitter.split_text(combined_text)
+    Возвращает:
+    generator: Кортежи (путь, элементы, ошибка) в порядке входных файлов;
+    при ошибке второй элемент равен None.
+    """
+    if PDF_PARTITION_WORKERS <= 1:
+        for pdf_path in pdf_paths:
+            try:
+                yield pdf_path, process_pdf_file(pdf_path), None
+            except Exception as e:
+                yield pdf_path, None, e
+        return
+
+    started_at = time.perf_counter()
+    total_pages = 0
+    with _create_executor() as executor:
+        submitted = []
+        for pdf_path in pdf_paths:
+            try:
+                submitted.append((pdf_path, _submit_pdf(executor, pdf_path), None))
+            except Exception as e:
+                submitted.append((pdf_path, None, e))
+
+        for pdf_path, job, error in submitted:
+            if error is not None:
+                yield pdf_path, None, error
+                continue
+            n_pages, futures = job
+            try:
+                pdf_content = _merge_shards(futures)
+            except Exception as e:
+                yield pdf_path, None, e
+                continue
+            total_pages += n_pages
+            yield pdf_path, pdf_content, None
+
+    elapsed = time.perf_counter() - started_at
+    if total_pages:
+        print(f"Разбор PDF: {len(pdf_paths)} файлов, {total_pages} стр. за {elapsed:.1f} с "
+              f"({total_pages / elapsed:.2f} стр./с)")
+
+def handle_pdfs(pdf_paths):
+    """
+    Обрабатывает несколько PDF-файлов: параллельное извлечение,
+    классификация и разбиение на части.
     
-    return table_elements, text_chunks
\ No newline at end of file
+    Параметры:
+    pdf_paths (list): Пути к PDF-файлам.
+    
+    Возвращает:
+    generator: Кортежи (путь, (таблицы, текстовые фрагменты), ошибка) в порядке
+    входных файлов; при ошибке второй элемент равен None.
+    """
+    for pdf_path, pdf_content, error in partition_pdfs(pdf_paths):
+        if error is not None:
+            yield pdf_path, None, error
+        else:
+            yield pdf_path, split_pdf_content(pdf_content), None
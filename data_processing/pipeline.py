@@ -0,0 +1,419 @@
+import os
+import time
+import queue
+import uuid
+import hashlib
+import threading
+from config import (
+    PIPELINE_QUEUE_SIZE, PIPELINE_REPORT_INTERVAL, EMBED_BATCH_SIZE, CAPTION_PDF_FIGURES,
+    DEDUP_ENABLED, DEDUP_THRESHOLD, DEDUP_NUM_PERM, DEDUP_BANDS,
+)
+from data_processing.dedup import NearDuplicateIndex
+from data_processing.pdf_handler import partition_pdfs, iter_pdf_chunks, pdf_figures
+from data_processing.image_handler import caption_images
+from data_processing.records import ContentRecord
+from retrieval.rag_engine import create_content_summaries
+from storage.vector_store import embed_batch, write_batch, remove_documents, update_metadata
+from utils.helpers import file_sha256
+from utils.tracing import tracer
+
+# Конец потока сообщений
+_STOP = ('stop',)
+
+class IngestionPipeline:
+    """
+    Потоковый конвейер загрузки: разбор → разбиение → суммаризация →
+    встраивание → запись. Стадии работают в отдельных потоках и связаны
+    ограниченными очередями, поэтому переполненная стадия притормаживает
+    предыдущие, а элементы становятся доступны для поиска сразу после записи.
+    Почти одинаковые текстовые фрагменты и таблицы (в том числе из разных
+    файлов) после разбиения объединяются в одну запись, которая
+    суммаризуется и индексируется один раз.
+    """
+
+    STAGES = ('partitioned', 'split', 'summarized', 'embedded')
+
+    def __init__(self, vectorstore, docstore, queue_size=PIPELINE_QUEUE_SIZE,
+                 batch_size=EMBED_BATCH_SIZE, report_interval=PIPELINE_REPORT_INTERVAL, dedup=DEDUP_ENABLED):
+        """
+        Параметры:
+        vectorstore (Chroma | MemmapVectorStore): Векторное хранилище.
+        docstore (PackedDocStore): Хранилище документов.
+        queue_size (int): Емкость каждой межстадийной очереди.
+        batch_size (int): Размер пакета для суммаризации и встраивания.
+        report_interval (float): Период вывода глубины очередей в секундах (0 - не выводить).
+        dedup (bool): Объединять почти одинаковые фрагменты.
+        """
+        self.vectorstore = vectorstore
+        self.docstore = docstore
+        self.batch_size = batch_size
+        self.report_interval = report_interval
+        self.queues = {name: queue.Queue(maxsize=queue_size) for name in self.STAGES}
+        self.processed = {name: 0 for name in self.STAGES + ('stored',)}
+        self._errors = {}
+        self._results = queue.Queue()
+        # Ошибка стадии, остановившейся целиком, и записанные документы еще не завершенных файлов
+        self._crash = None
+        self._stored_ids = {}
+        self.dedup = {
+            kind: NearDuplicateIndex(DEDUP_THRESHOLD, DEDUP_NUM_PERM, DEDUP_BANDS) for kind in ('text', 'table')
+        } if dedup else None
+        self.deduplicated = {'text': 0, 'table': 0}
+        # Идентификаторы записей других файлов, которыми заменены дубликаты файла
+        self.shared_doc_ids = {}
+        # Канонические записи: doc_id -> (путь файла, {путь файла: имя для метаданных})
+        self._canonical = {}
+        # Отброшенные копии по пути файла канонической записи: нужны, только пока этот файл не записан
+        self._dropped = {}
+        self._finished = set()
+        self._dedup_lock = threading.Lock()
+
+    def queue_depths(self):
+        """
+        Возвращает:
+        dict: Текущее число сообщений в каждой межстадийной очереди.
+        """
+        return {name: q.qsize() for name, q in self.queues.items()}
+
+    def _fail(self, source, error):
+        self._errors.setdefault(source, error)
+
+    def _partition_stage(self, sources):
+        out = self.queues['partitioned']
+        pdfs = [(path, name) for kind, path, name in sources if kind == 'pdf']
+        names = dict(pdfs)
+        for path, pdf_content, error in partition_pdfs([path for path, _ in pdfs]):
+            if error is not None:
+                self._fail(path, error)
+            out.put(('pdf', path, names[path], pdf_content))
+            self.processed['partitioned'] += 1
+        for kind, path, name in sources:
+            if kind == 'image':
+                out.put(('image', path, name, None))
+                self.processed['partitioned'] += 1
+
+    def _deduplicate(self, path, kind, record):
+        """
+        Возвращает идентификатор канонической записи, если такой фрагмент уже
+        встречался, иначе регистрирует запись как каноническую и возвращает None.
+        """
+        index = self.dedup[kind]
+        signature = index.signature(record.text)
+        with self._dedup_lock:
+            key, _ = index.find(signature)
+            if key is None:
+                # Идентификатор нужен заранее: на него ссылаются дубликаты из других файлов
+                record.doc_id = str(uuid.uuid4())
+                index.add(record.doc_id, signature)
+                self._canonical[record.doc_id] = (path, {path: record.path})
+                return None
+            canonical_path, sources = self._canonical[key]
+            sources.setdefault(path, record.path)
+            if canonical_path != path:
+                self.shared_doc_ids.setdefault(path, []).append(key)
+                if canonical_path not in self._finished:
+                    # Если файл канонической записи не запишется, копия будет проиндексирована сама
+                    self._dropped.setdefault(canonical_path, {}).setdefault((key, path), (kind, record))
+        self.deduplicated[kind] += 1
+        tracer.count('dedup_collapsed', kind=kind)
+        return key
+
+    def _settle_duplicates(self, path, failed):
+        """
+        Отмечает файл как завершенный. Если файл не записан, его канонические
+        записи убираются из индексов дубликатов, а отброшенные из-за них копии
+        других файлов возвращаются.
+
+        Возвращает:
+        list: Кортежи (путь, тип, запись) копий, которые нужно проиндексировать.
+        """
+        with self._dedup_lock:
+            self._finished.add(path)
+            dropped = self._dropped.pop(path, {})
+            if not failed:
+                return []
+            for doc_id in [doc_id for doc_id, (owner, _) in self._canonical.items() if owner == path]:
+                del self._canonical[doc_id]
+                for index in self.dedup.values():
+                    index.remove(doc_id)
+            restored = []
+            for (doc_id, copy_path), (kind, record) in dropped.items():
+                shared = self.shared_doc_ids.get(copy_path, [])
+                shared[:] = [shared_id for shared_id in shared if shared_id != doc_id]
+                self.deduplicated[kind] -= 1
+                restored.append((copy_path, kind, record))
+            return restored
+
+    def _restore(self, entries, doc_ids):
+        """
+        Проводит копии через суммаризацию, встраивание и запись вместо
+        неудавшейся канонической записи. Файлы копий еще не завершены:
+        их маркеры конца идут по конвейеру после маркера файла канонической записи.
+        """
+        entries = [entry for entry in entries if entry[0] not in self._errors]
+        if not entries:
+            return
+        try:
+            entries = self._summarize(entries)
+            prepared = embed_batch(self.vectorstore._embedding_function, [record for _, _, record in entries])
+            write_batch(self.vectorstore, self.docstore, prepared)
+        except Exception as e:
+            for path, _, _ in entries:
+                self._fail(path, e)
+            return
+        for (path, _, _), (doc_id, _) in zip(entries, prepared['docstore']):
+            doc_ids.setdefault(path, []).append(doc_id)
+        self.processed['stored'] += len(entries)
+        tracer.count('ingested_items', len(entries))
+
+    def _save_sources(self):
+        """
+        Записывает в метаданные канонических записей все файлы, где встретился
+        фрагмент. Вызывается после завершения всех стадий, когда списки файлов окончательны.
+        """
+        updates = {}
+        for doc_id, (path, sources) in self._canonical.items():
+            names = list(dict.fromkeys(name for source, name in sources.items() if source not in self._errors))
+            if path not in self._errors and len(names) > 1:
+                # Метаданные индекса - только скалярные значения
+                updates[doc_id] = {'sources': '\n'.join(names)}
+        update_metadata(self.vectorstore, updates)
+
+    def _split_stage(self):
+        source_queue, out = self.queues['partitioned'], self.queues['split']
+        for message in iter(source_queue.get, _STOP):
+            kind, path, name, pdf_content = message
+            if kind == 'pdf' and path not in self._errors:
+                try:
+                    # Фрагменты передаются дальше по мере разбиения
+                    for item_kind, chunk in iter_pdf_chunks(pdf_content):
+                        record = ContentRecord(
+                            'pdf', name, source=path, text=chunk.text,
+                            content_hash=hashlib.sha256(chunk.text.encode('utf-8')).hexdigest(),
+                            page_start=chunk.page_start, page_end=chunk.page_end,
+                            start=chunk.start, end=chunk.end,
+                        )
+                        self.processed['split'] += 1
+                        if self.dedup is not None and self._deduplicate(path, item_kind, record) is not None:
+                            continue
+                        out.put(('item', path, item_kind, record))
+                except Exception as e:
+                    self._fail(path, e)
+                if CAPTION_PDF_FIGURES:
+                    for figure_path, page in pdf_figures(path):
+                        out.put(('item', path, 'image', ContentRecord(
+                            'image', f"{name}#{os.path.basename(figure_path)}", source=figure_path,
+                            content_hash=file_sha256(figure_path), page_start=page, page_end=page,
+                        )))
+                        self.processed['split'] += 1
+            elif kind == 'image':
+                out.put(('item', path, 'image', ContentRecord(
+                    'image', name, source=path, content_hash=file_sha256(path),
+                )))
+                self.processed['split'] += 1
+            out.put(('end', path))
+
+    def _summarize(self, batch):
+        """
+        Создает резюме и описания для пакета записей.
+
+        Возвращает:
+        list: Записи пакета, которые передаются дальше (без пропущенных изображений).
+        """
+        texts = [record for _, kind, record in batch if kind == 'text']
+        tables = [record for _, kind, record in batch if kind == 'table']
+        text_overviews, table_overviews = create_content_summaries(
+            [record.text for record in texts], [record.text for record in tables], summarize_texts=True
+        )
+        for record, summary in zip(texts + tables, list(text_overviews) + list(table_overviews)):
+            record.summary = summary
+            # Исходный текст дальше не нужен - в индекс попадает только резюме
+            record.text = None
+
+        images = [(path, record) for path, kind, record in batch if kind == 'image']
+        skipped = set()
+        if images:
+            # Декодированные изображения не храним: при встраивании они будут прочитаны заново
+            captions = caption_images([record.source for _, record in images])
+            for (path, record), caption in zip(images, captions):
+                if caption is not None:
+                    record.summary = caption
+                elif record.source != path:
+                    # Неудачное изображение из PDF пропускается, остальной документ индексируется
+                    print(f"Пропущено изображение {record.source}: не удалось получить описание")
+                    skipped.add(id(record))
+                else:
+                    self._fail(path, ValueError(f"не удалось обработать изображение {record.source}"))
+        return [entry for entry in batch if id(entry[2]) not in skipped]
+
+    def _consume_batched(self, source_queue, out, batch, flush):
+        """
+        Набирает пакет из записей разных файлов (отдельное изображение - это
+        целый файл) и обрабатывает его при заполнении или когда входная
+        очередь опустела. Маркеры конца файлов передаются дальше только
+        после обработки всех записей этих файлов.
+        """
+        ends = []
+
+        def flush_all():
+            flush()
+            batch.clear()
+            for message in ends:
+                out.put(message)
+            ends.clear()
+
+        while True:
+            try:
+                message = source_queue.get_nowait()
+            except queue.Empty:
+                flush_all()
+                message = source_queue.get()
+            if message is _STOP:
+                break
+            if message[0] == 'item':
+                batch.append(message[1:])
+                if len(batch) >= self.batch_size:
+                    flush_all()
+            else:
+                ends.append(message)
+        flush_all()
+
+    def _summarize_stage(self):
+        source_queue, out = self.queues['split'], self.queues['summarized']
+        batch = []
+
+        def flush():
+            live = [entry for entry in batch if entry[0] not in self._errors]
+            if live:
+                try:
+                    live = self._summarize(live)
+                except Exception as e:
+                    for path, _, _ in live:
+                        self._fail(path, e)
+                for path, _, record in live:
+                    if path not in self._errors:
+                        out.put(('item', path, record))
+                        self.processed['summarized'] += 1
+
+        self._consume_batched(source_queue, out, batch, flush)
+
+    def _embed_stage(self):
+        source_queue, out = self.queues['summarized'], self.queues['embedded']
+        embeddings = self.vectorstore._embedding_function
+        batch = []
+
+        def flush():
+            live = [(path, record) for path, record in batch if path not in self._errors]
+            if live:
+                try:
+                    prepared = embed_batch(embeddings, [record for _, record in live])
+                    out.put(('batch', [path for path, _ in live], prepared))
+                    self.processed['embedded'] += len(live)
+                except Exception as e:
+                    for path, _ in live:
+                        self._fail(path, e)
+
+        self._consume_batched(source_queue, out, batch, flush)
+
+    def _store_stage(self):
+        source_queue = self.queues['embedded']
+        doc_ids = self._stored_ids
+        for message in iter(source_queue.get, _STOP):
+            if message[0] == 'batch':
+                _, paths, prepared = message
+                try:
+                    write_batch(self.vectorstore, self.docstore, prepared)
+                except Exception as e:
+                    for path in paths:
+                        self._fail(path, e)
+                    continue
+                for path, (doc_id, _) in zip(paths, prepared['docstore']):
+                    doc_ids.setdefault(path, []).append(doc_id)
+                self.processed['stored'] += len(paths)
+                tracer.count('ingested_items', len(paths))
+            else:
+                path = message[1]
+                if self.dedup is not None:
+                    self._restore(self._settle_duplicates(path, path in self._errors), doc_ids)
+                stored_ids = doc_ids.pop(path, [])
+                error = self._errors.get(path)
+                if error is not None and stored_ids:
+                    # Файл обработан не полностью - убираем его частично записанные документы
+                    remove_documents(self.vectorstore, self.docstore, stored_ids)
+                    stored_ids = []
+                tracer.count('ingested_files', result='error' if error is not None else 'ok')
+                self._results.put((path, stored_ids, error))
+
+    def _run_stage(self, name, body, source_queue, out_queue, *args):
+        try:
+            body(*args)
+        except Exception as e:
+            print(f"Ошибка на стадии конвейера {name}: {e}")
+            if self._crash is None:
+                self._crash = RuntimeError(f"стадия конвейера {name} остановлена: {e}")
+            # Разгружаем входную очередь, чтобы не блокировать предыдущую стадию
+            if source_queue is not None:
+                for _ in iter(source_queue.get, _STOP):
+                    pass
+        finally:
+            out_queue.put(_STOP)
+
+    def _report(self, stop_event):
+        while not stop_event.wait(self.report_interval):
+            depths = ', '.join(f"{name}={depth}" for name, depth in self.queue_depths().items())
+            print(f"Конвейер: очереди [{depths}], записано {self.processed['stored']}")
+
+    def run(self, sources):
+        """
+        Запускает конвейер.
+
+        Параметры:
+        sources (list): Кортежи (тип 'pdf' или 'image', путь к файлу, имя для метаданных).
+
+        Возвращает:
+        generator: Кортежи (путь, идентификаторы документов, ошибка) по мере того,
+        как файлы полностью записаны в индекс. Если стадия остановилась целиком,
+        для каждого файла без результата в конце возвращается ошибка.
+        """
+        started_at = time.perf_counter()
+        stages = [
+            ('partition', self._partition_stage, None, self.queues['partitioned'], sources),
+            ('split', self._split_stage, self.queues['partitioned'], self.queues['split']),
+            ('summarize', self._summarize_stage, self.queues['split'], self.queues['summarized']),
+            ('embed', self._embed_stage, self.queues['summarized'], self.queues['embedded']),
+            ('store', self._store_stage, self.queues['embedded'], self._results),
+        ]
+        threads = [
+            threading.Thread(target=self._run_stage, args=stage, name=f'ingest-{stage[0]}', daemon=True)
+            for stage in stages
+        ]
+        stop_event = threading.Event()
+        if self.report_interval:
+            threads.append(threading.Thread(target=self._report, args=(stop_event,), name='ingest-report', daemon=True))
+        for thread in threads:
+            thread.start()
+
+        reported = set()
+        try:
+            for result in iter(self._results.get, _STOP):
+                reported.add(result[0])
+                yield result
+            for _, path, _ in sources:
+                if path in reported:
+                    continue
+                # Файл не дошел до конца конвейера: частично записанные документы удаляются
+                self._fail(path, self._crash or RuntimeError("конвейер остановлен"))
+                remove_documents(self.vectorstore, self.docstore, self._stored_ids.pop(path, []))
+                yield path, [], self._errors[path]
+        finally:
+            stop_event.set()
+        if self.dedup is not None:
+            self._save_sources()
+
+        elapsed = time.perf_counter() - started_at
+        print(f"Конвейер: {len(sources)} файлов, {self.processed['stored']} элементов за {elapsed:.1f} с")
+        saved = sum(self.deduplicated.values())
+        if saved:
+            # Каждый дубликат - это непосчитанное резюме языковой модели и незаписанный вектор
+            print(f"Дедупликация: объединено {self.deduplicated['text']} фрагментов текста и "
+                  f"{self.deduplicated['table']} таблиц, сэкономлено {saved} вызовов LLM и {saved} векторов")
@@ -0,0 +1,69 @@
+from PIL import Image
+
+class ContentRecord:
+    """
+    Компактная запись об элементе контента. Хранит только ссылки на исходные
+    данные (путь, хеш содержимого, смещения и номера страниц); пиксели
+    изображения загружаются с диска лишь в момент встраивания.
+    """
+
+    __slots__ = (
+        'type', 'path', 'source', 'text', 'summary', 'content_hash',
+        'page_start', 'page_end', 'start', 'end', 'doc_id', 'sources',
+    )
+
+    def __init__(self, type, path, source=None, text=None, summary=None, content_hash=None,
+                 page_start=None, page_end=None, start=0, end=0, doc_id=None, sources=None):
+        """
+        Параметры:
+        type (str): Тип элемента ('pdf' или 'image').
+        path (str): Исходный путь (имя) файла для метаданных.
+        source (str): Локальный путь для чтения данных (по умолчанию равен path).
+        text (str): Текст фрагмента или таблицы (для PDF, до суммаризации).
+        summary (str): Резюме или описание элемента.
+        content_hash (str): Хеш содержимого элемента.
+        page_start (int): Первая страница фрагмента.
+        page_end (int): Последняя страница фрагмента.
+        start (int): Начальное смещение фрагмента в документе.
+        end (int): Конечное смещение фрагмента в документе.
+        doc_id (str): Идентификатор документа в индексе.
+        sources (list): Другие файлы, в которых встречается почти такой же фрагмент.
+        """
+        self.type = type
+        self.path = path
+        self.source = source or path
+        self.text = text
+        self.summary = summary
+        self.content_hash = content_hash
+        self.page_start = page_start
+        self.page_end = page_end
+        self.start = start
+        self.end = end
+        self.doc_id = doc_id
+        self.sources = sources if sources is not None else []
+
+    def load_image(self):
+        """
+        Возвращает:
+        PIL.Image: Изображение, полностью загруженное в память.
+        """
+        with Image.open(self.source) as image:
+            return image.convert('RGB')
+
+    def metadata(self):
+        """
+        Возвращает:
+        dict: Метаданные для векторного хранилища (без пустых значений).
+        """
+        metadata = {'path': self.path, 'start': self.start, 'end': self.end}
+        for key in ('page_start', 'page_end', 'content_hash'):
+            value = getattr(self, key)
+            if value is not None:
+                metadata[key] = value
+        if self.sources:
+            # Метаданные индекса - только скалярные значения
+            metadata['sources'] = '\n'.join([self.path] + self.sources)
+        return metadata
+
+    def __repr__(self):
+        return f"ContentRecord(type={self.type!r}, path={self.path!r}, doc_id={self.doc_id!r})"
@@ -0,0 +1,99 @@
+from functools import lru_cache
+from collections import deque, namedtuple
+import tiktoken
+
+# Фрагмент текста документа: смещения в символах от начала документа
+# (элементы соединяются пробелом) и диапазон страниц
+TextChunk = namedtuple('TextChunk', 'text start end page_start page_end')
+
+# Части фрагмента: сначала по абзацам, слишком длинные абзацы - по строкам, затем по словам
+_SEPARATORS = ('\n\n', '\n', ' ')
+
+_Piece = namedtuple('_Piece', 'joiner text start end page tokens')
+
+@lru_cache(maxsize=None)
+def get_encoding(name='gpt2'):
+    """
+    Возвращает кодировку tiktoken (создается один раз на процесс).
+    """
+    return tiktoken.get_encoding(name)
+
+class StreamingTokenSplitter:
+    """
+    Потоковое разбиение текста документа на фрагменты по числу токенов.
+    Элементы документа читаются по одному; абзацы (а при необходимости строки
+    и слова) набираются во фрагмент, пока он не достигнет chunk_size токенов,
+    следующий фрагмент начинается с перекрытия из последних частей.
+    В памяти находится только текущий фрагмент, а не весь документ.
+    """
+
+    def __init__(self, chunk_size=500, chunk_overlap=100, encoding_name='gpt2'):
+        """
+        Параметры:
+        chunk_size (int): Максимальный размер фрагмента в токенах.
+        chunk_overlap (int): Максимальный размер перекрытия соседних фрагментов в токенах.
+        encoding_name (str): Кодировка tiktoken для подсчета токенов.
+        """
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.encoding = get_encoding(encoding_name)
+
+    def count_tokens(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def _pieces(self, text, offset, page, joiner, separators=_SEPARATORS):
+        separator = separators[0]
+        position = 0
+        while True:
+            index = text.find(separator, position)
+            end = len(text) if index < 0 else index
+            part = text[position:end]
+            if part.strip():
+                tokens = self.count_tokens(part)
+                if tokens > self.chunk_size and len(separators) > 1:
+                    yield from self._pieces(part, offset + position, page, joiner, separators[1:])
+                else:
+                    # Пробел входит в токен следующего слова, перевод строки - отдельный токен
+                    yield _Piece(joiner, part, offset + position, offset + end, page, tokens + (joiner not in ('', ' ')))
+                joiner = separator
+            if index < 0:
+                return
+            position = index + len(separator)
+
+    @staticmethod
+    def _chunk(window):
+        # Разделитель перед первой частью во фрагмент не входит
+        pages = [piece.page for piece in window if piece.page is not None]
+        return TextChunk(
+            window[0].text + ''.join(piece.joiner + piece.text for piece in list(window)[1:]),
+            window[0].start,
+            window[-1].end,
+            min(pages) if pages else None,
+            max(pages) if pages else None,
+        )
+
+    def split(self, elements):
+        """
+        Разбивает поток элементов на фрагменты.
+
+        Параметры:
+        elements (iterable): Тройки (текст элемента, смещение в документе, номер страницы).
+
+        Возвращает:
+        generator: Фрагменты TextChunk в порядке документа.
+        """
+        window = deque()
+        total = 0
+        fresh = False
+        for text, offset, page in elements:
+            for piece in self._pieces(text, offset, page, ' '):
+                if window and fresh and total + piece.tokens > self.chunk_size:
+                    yield self._chunk(window)
+                    fresh = False
+                    while window and (total > self.chunk_overlap or total + piece.tokens > self.chunk_size):
+                        total -= window.popleft().tokens
+                window.append(piece)
+                total += piece.tokens
+                fresh = True
+        if window and fresh:
+            yield self._chunk(window)
@@ -1,80 +1,86 @@
 import os
-from config import INPUT_DIR, DB_PATH, VECTOR_DB_PATH, DOCSTORE_PATH
-from data_processing.pdf_handler import handle_pdf
-from data_processing.image_handler import analyze_image
-from storage.vector_store import initialize_chroma_client, build_vectorstore, build_retriever
-from retrieval.rag_engine import create_content_summaries, multi_modal_rag
+from config import INPUT_DIR, DB_PATH, VECTOR_DB_PATH, MMAP_INDEX_PATH, DOCSTORE_PATH, MANIFEST_PATH, INDEX_MANIFEST_PATH, PIPELINE_VERSION, MODEL_WARMUP, TRACE_METRICS_PORT, CLIP_INFERENCE_MODE
+from data_processing.pipeline import IngestionPipeline
+from storage.vector_store import (
+    initialize_chroma_client, build_vectorstore, build_docstore, create_retriever, remove_documents, compact_index,
+    describe_index, save_index_manifest,
+)
+from storage.manifest import IngestionManifest, IndexManifest
+from storage.embedding_cache import CachedEmbeddings
+from retrieval.rag_engine import multi_modal_rag, summary_cache, answer_cache
 from utils.helpers import get_file_list
-from langchain.storage import LocalFileStore
+from utils.model_registry import registry
+from utils.tracing import tracer
 
-# Global content storage
-content_storage = []
+# Optionally expose Prometheus metrics
+if TRACE_METRICS_PORT:
+    tracer.serve_metrics(TRACE_METRICS_PORT)
 
-def include_pdf(pdf_path):
-    """
-    Обрабатывает PDF-файл: извлекает содержимое, создает резюме и добавляет в хранилище.
-    
-    Параметры:
-    pdf_path (str): Путь к PDF-файлу.
-    """
-    table_elements, text_chunks = handle_pdf(pdf_path)
-    text_overviews, table_overviews = create_content_summaries(
-        text_chunks, table_elements, summarize_texts=True
-    )
-    
-    for item, summary in zip(text_chunks, text_overviews):
-        content_storage.append({
-            'type': 'pdf',
-            'elem': item,
-            'sum': summary,
-            'path': pdf_path,
-            'metadata': {'start':0, 'end':0},
-        })
-        
-    for item, summary in zip(table_elements, table_overviews):
-        content_storage.append({
-            'type': 'pdf',
-            'elem': item,
-            'sum': summary,
-            'path': pdf_path,
-            'metadata': {'start':0, 'end':0},
-        })
-
-def include_image(image_path):
-    """
-    Обрабатывает изображение: генерирует описание и добавляет в хранилище.
-    
-    Параметры:
-    image_path (str): Путь к файлу изображения.
-    """
-    image_data, image_caption = analyze_image(image_path)
-    content_storage.append({
-        'type': 'image',
-        'elem': image_data,
-        'sum': image_caption,
-        'path': image_path,
-        'metadata': {'start':0, 'end':0},
-    })
+# Optionally start loading models in the background
+if MODEL_WARMUP:
+    registry.warmup(MODEL_WARMUP, background=True)
 
 # Initialize Chroma client
 chroma_client = initialize_chroma_client(DB_PATH)
 
-# Process all files in source directory
-pdf_list = get_file_list('pdf', "*.pdf")
-for file in pdf_list:
-    include_pdf(file)
+# An index built by another embedding model or format cannot be extended:
+# stop before any vectors are added and require a rebuild from scratch
+index_manifest = IndexManifest(INDEX_MANIFEST_PATH)
+index_problems = index_manifest.check(describe_index())
+if index_manifest.data is not None and index_problems:
+    raise SystemExit(
+        f"Индекс несовместим с конфигурацией: {'; '.join(index_problems)}. "
+        f"Для пересборки удалите {VECTOR_DB_PATH}, {MMAP_INDEX_PATH}, {DOCSTORE_PATH}, "
+        f"{MANIFEST_PATH} и {INDEX_MANIFEST_PATH}"
+    )
+# Vectors from another CLIP inference mode stay searchable, but the index becomes mixed
+for problem in index_manifest.check_inference_mode(CLIP_INFERENCE_MODE):
+    print(f"Предупреждение: {problem}")
 
+# Build vector store and docstore
+# Only one process may write to the index; the app keeps it open for uploads
+try:
+    docstore = build_docstore(DOCSTORE_PATH)
+    vectorstore = build_vectorstore(VECTOR_DB_PATH)
+except BlockingIOError as e:
+    raise SystemExit(f"Индекс уже открыт на запись другим процессом ({e}). Остановите приложение и повторите")
+
+# Compare source directory with the ingestion manifest
+manifest = IngestionManifest(MANIFEST_PATH, PIPELINE_VERSION)
+pdf_list = get_file_list('pdf', "*.pdf")
 image_list = get_file_list('image', "*.jpg")
-for file in image_list:
-    include_image(file)
+changed_files, stale_doc_ids = manifest.plan(pdf_list + image_list)
+
+# Drop vectors and summaries of removed or replaced files
+remove_documents(vectorstore, docstore, stale_doc_ids)
+answer_cache.invalidate(stale_doc_ids)
+manifest.prune(pdf_list + image_list)
+manifest.save()
 
-# Build vector store and retriever
-vectorstore = build_vectorstore(VECTOR_DB_PATH)
-docstore = LocalFileStore(DOCSTORE_PATH)
-retriever_multi_vector_img = build_retriever(vectorstore, docstore, content_storage)
+# Stream new and changed files through the ingestion pipeline;
+# every file becomes searchable as soon as it is stored
+retriever_multi_vector_img = create_retriever(vectorstore, docstore)
+pipeline = IngestionPipeline(vectorstore, docstore)
+sources = [('pdf', file, file) for file in pdf_list if file in changed_files]
+sources += [('image', file, file) for file in image_list if file in changed_files]
+for file, doc_ids, error in pipeline.run(sources):
+    if error is not None:
+        print(f"Ошибка при обработке файла {file}: {error}")
+        continue
+    manifest.record(file, changed_files[file], doc_ids, pipeline.shared_doc_ids.get(file, []))
+    manifest.save()
+# Removed and replaced files leave deleted rows in the mmap index
+compact_index(vectorstore)
+save_index_manifest(INDEX_MANIFEST_PATH, vectorstore, docstore)
+print(f"Summary cache: {summary_cache.stats()}")
+if registry.is_loaded('clip') and isinstance(registry.get('clip'), CachedEmbeddings):
+    print(f"Embedding cache: {registry.get('clip').cache.stats()}")
+if registry.is_loaded('llm_prefix_cache'):
+    print(f"Prefix KV cache: {registry.get('llm_prefix_cache').stats()}")
 
 # Example queries
 if __name__ == "__main__":
     print(multi_modal_rag('Что такое глобальное потепление?', retriever_multi_vector_img))
     print(multi_modal_rag('На кого возлагают основную ответственность за глобальное потепление?', retriever_multi_vector_img))
-    print(multi_modal_rag('Как сильно увеличилась темпиратура за последние 20 лет?', retriever_multi_vector_img))
\ No newline at end of file
+    print(multi_modal_rag('Как сильно увеличилась темпиратура за последние 20 лет?', retriever_multi_vector_img))
+    print(f"Answer cache: {answer_cache.stats()}")
\ No newline at end of file
@@ -0,0 +1,121 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+class AnswerCache:
+    """
+    Двухуровневый кеш ответов перед генерацией:
+    1) точное совпадение нормализованного запроса;
+    2) близкий по смыслу запрос (косинусная близость векторов OpenCLIP).
+    Запись действительна, только если поиск вернул тот же набор документов,
+    поэтому переиндексация автоматически делает старые ответы недействительными.
+    """
+
+    def __init__(self, max_entries=512, ttl=86400, similarity_threshold=0.95):
+        """
+        Параметры:
+        max_entries (int): Максимальное число записей (вытеснение LRU).
+        ttl (float): Время жизни записи в секундах.
+        similarity_threshold (float): Порог косинусной близости для второго уровня.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query):
+        """
+        Приводит запрос к нормальной форме: нижний регистр, без пунктуации
+        и лишних пробелов.
+        """
+        return ' '.join(re.findall(r'\w+', query.lower()))
+
+    def _expire(self, now):
+        for key in [key for key, entry in self._entries.items() if now - entry['created'] > self.ttl]:
+            del self._entries[key]
+
+    def get(self, query, embedding, doc_ids):
+        """
+        Ищет готовый ответ.
+
+        Параметры:
+        query (str): Текст запроса.
+        embedding (list): Нормированный вектор запроса.
+        doc_ids (frozenset): Идентификаторы найденных документов.
+
+        Возвращает:
+        tuple: Ответ (или None) и уровень попадания ('exact', 'semantic' или 'miss').
+        """
+        with self._lock:
+            self._expire(time.time())
+
+            key = self.normalize(query)
+            entry = self._entries.get(key)
+            if entry is not None and entry['doc_ids'] == doc_ids:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry['answer'], 'exact'
+
+            if embedding is not None:
+                candidates = [
+                    (other_key, other) for other_key, other in self._entries.items()
+                    if other['doc_ids'] == doc_ids and other['embedding'] is not None
+                ]
+                if candidates:
+                    matrix = np.stack([other['embedding'] for _, other in candidates])
+                    scores = matrix @ np.asarray(embedding, dtype=np.float32)
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.similarity_threshold:
+                        best_key, best_entry = candidates[best]
+                        self._entries.move_to_end(best_key)
+                        self.semantic_hits += 1
+                        return best_entry['answer'], 'semantic'
+
+            self.misses += 1
+            return None, 'miss'
+
+    def put(self, query, embedding, doc_ids, answer):
+        """
+        Сохраняет ответ на запрос.
+        """
+        with self._lock:
+            key = self.normalize(query)
+            self._entries[key] = {
+                'answer': answer,
+                'doc_ids': doc_ids,
+                'embedding': None if embedding is None else np.asarray(embedding, dtype=np.float32),
+                'created': time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, doc_ids):
+        """
+        Удаляет ответы, построенные по указанным документам.
+        """
+        doc_ids = set(doc_ids)
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry['doc_ids'] & doc_ids]:
+                del self._entries[key]
+
+    def stats(self):
+        """
+        Возвращает:
+        dict: Число попаданий по уровням, промахов, долю попаданий и размер кеша.
+        """
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            'exact_hits': self.exact_hits,
+            'semantic_hits': self.semantic_hits,
+            'misses': self.misses,
+            'hit_rate': (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            'entries': len(self._entries),
+        }
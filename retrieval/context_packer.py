@@ -0,0 +1,103 @@
+import re
+
+def _shingles(text, size=3):
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < size:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+class ContextPacker:
+    """
+    Отбирает найденные фрагменты в контекст промпта с учетом бюджета токенов:
+    токены считаются токенизатором самой модели, почти одинаковые фрагменты
+    отбрасываются, остальные добавляются жадно в порядке релевантности,
+    пока не будет исчерпан бюджет (с резервом под ответ).
+    """
+
+    def __init__(self, llm, budget=None, answer_reserve=1024, dedup_threshold=0.8, separator='\n'):
+        """
+        Параметры:
+        llm (Llama): Модель, токенизатор которой используется для подсчета.
+        budget (int): Максимальный размер контекста в токенах (None - ограничен только n_ctx).
+        answer_reserve (int): Число токенов, оставляемых под ответ.
+        dedup_threshold (float): Порог сходства Жаккара (по триграммам слов) для дубликатов.
+        separator (str): Разделитель фрагментов в промпте.
+        """
+        self.llm = llm
+        self.budget = budget
+        self.answer_reserve = answer_reserve
+        self.dedup_threshold = dedup_threshold
+        self.separator = separator
+
+    def tokenize(self, text):
+        return self.llm.tokenize(text.encode('utf-8'), add_bos=False, special=False)
+
+    def count_tokens(self, text):
+        return len(self.tokenize(text))
+
+    def available_tokens(self, prompt_tokens):
+        """
+        Возвращает число токенов, доступных для материалов, при данном размере
+        остальной части промпта.
+        """
+        available = self.llm.n_ctx() - self.answer_reserve - prompt_tokens
+        if self.budget is not None:
+            available = min(available, self.budget)
+        return max(available, 0)
+
+    def _truncate(self, text, max_tokens):
+        tokens = self.tokenize(text)[:max_tokens]
+        return self.llm.detokenize(tokens).decode('utf-8', errors='ignore')
+
+    def pack(self, docs, prompt_tokens, stats=None):
+        """
+        Параметры:
+        docs (list): Кандидаты (Document) в порядке убывания релевантности.
+        prompt_tokens (int): Размер промпта без материалов в токенах.
+        stats (dict): Словарь, в который записываются число кандидатов, отобранных,
+        дубликатов, не поместившихся и использованных токенов. Упаковщик общий
+        для всех запросов, поэтому статистика не хранится в нем самом.
+
+        Возвращает:
+        tuple: Отобранные документы и текст материалов для промпта.
+        """
+        available = self.available_tokens(prompt_tokens)
+        separator_tokens = self.count_tokens(self.separator)
+        selected, texts, seen = [], [], []
+        used = duplicates = skipped = 0
+
+        for doc in docs:
+            shingles = _shingles(doc.page_content)
+            if any(_jaccard(shingles, other) >= self.dedup_threshold for other in seen):
+                duplicates += 1
+                continue
+            cost = self.count_tokens(doc.page_content) + (separator_tokens if texts else 0)
+            if used + cost > available:
+                skipped += 1
+                continue
+            selected.append(doc)
+            texts.append(doc.page_content)
+            seen.append(shingles)
+            used += cost
+
+        if not selected and docs and available > 0:
+            # Даже самый релевантный фрагмент не помещается - берем его начало
+            selected = [docs[0]]
+            texts = [self._truncate(docs[0].page_content, available)]
+            used = self.count_tokens(texts[0])
+
+        if stats is not None:
+            stats.update(
+                candidates=len(docs),
+                packed=len(selected),
+                duplicates=duplicates,
+                skipped=skipped,
+                context_tokens=used,
+                available_tokens=available,
+            )
+        return selected, self.separator.join(texts)
@@ -0,0 +1,154 @@
+import os
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+
+class PrefixCache:
+    """
+    Кеш KV-состояния llama.cpp для неизменных префиксов промптов
+    (системных инструкций). Вместо повторного prefill префикса
+    восстанавливает сохраненное состояние модели - из памяти или с диска.
+    """
+
+    def __init__(self, llm, max_entries=2, disk_dir=None):
+        """
+        Параметры:
+        llm (Llama): Экземпляр модели.
+        max_entries (int): Число состояний, хранимых в памяти.
+        disk_dir (str): Директория для сохранения состояний на диск (необязательно).
+        """
+        self.llm = llm
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.last_saved_tokens = 0
+        self.total_saved_tokens = 0
+        self.calls = 0
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        self._formatter = self._build_formatter(llm)
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def _build_formatter(llm):
+        # Тот же шаблон чата, что использует create_chat_completion
+        template = llm.metadata.get('tokenizer.chat_template')
+        if not template:
+            return None
+        eos_id, bos_id = llm.token_eos(), llm.token_bos()
+        return Jinja2ChatFormatter(
+            template=template,
+            eos_token=llm._model.token_get_text(eos_id) if eos_id != -1 else '',
+            bos_token=llm._model.token_get_text(bos_id) if bos_id != -1 else '',
+        )
+
+    def _tokenize_prompt(self, messages, static_prefix):
+        result = self._formatter(messages=messages)
+        end = result.prompt.find(static_prefix)
+        if end == -1:
+            return None, None
+        add_bos = not getattr(result, 'added_special', False)
+        prompt_tokens = self.llm.tokenize(result.prompt.encode('utf-8'), add_bos=add_bos, special=True)
+        prefix_tokens = self.llm.tokenize(
+            result.prompt[:end + len(static_prefix)].encode('utf-8'), add_bos=add_bos, special=True
+        )
+        return prompt_tokens, prefix_tokens
+
+    def _key(self, tokens):
+        digest = hashlib.sha256(str(self.llm.model_path).encode('utf-8'))
+        digest.update(str(self.llm.n_ctx()).encode('utf-8'))
+        digest.update(' '.join(map(str, tokens)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _load(self, key):
+        state = self._states.get(key)
+        if state is not None:
+            self._states.move_to_end(key)
+            return state
+        if self.disk_dir:
+            path = os.path.join(self.disk_dir, key + '.state')
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    state = pickle.load(f)
+                self._remember(key, state)
+        return state
+
+    def _remember(self, key, state):
+        self._states[key] = state
+        self._states.move_to_end(key)
+        while len(self._states) > self.max_entries:
+            self._states.popitem(last=False)
+
+    def _store(self, key, state):
+        self._remember(key, state)
+        if self.disk_dir:
+            path = os.path.join(self.disk_dir, key + '.state')
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(state, f)
+            os.replace(tmp_path, path)
+
+    def prepare(self, messages, static_prefix):
+        """
+        Готовит модель к вызову create_chat_completion с данными сообщениями:
+        восстанавливает KV-состояние неизменного префикса, чтобы llama.cpp
+        вычислял только оставшуюся часть промпта.
+
+        Параметры:
+        messages (list): Сообщения чата.
+        static_prefix (str): Неизменное начало системного сообщения.
+
+        Возвращает:
+        int: Число токенов prefill, которые не нужно вычислять повторно.
+        """
+        with self._lock:
+            self.calls += 1
+            self.last_saved_tokens = 0
+            if self._formatter is None:
+                return 0
+            prompt_tokens, prefix_tokens = self._tokenize_prompt(messages, static_prefix)
+            if prompt_tokens is None:
+                return 0
+
+            # Граница префикса может токенизироваться иначе, чем в полном промпте
+            common = 0
+            for a, b in zip(prefix_tokens, prompt_tokens[:-1]):
+                if a != b:
+                    break
+                common += 1
+            if common == 0:
+                return 0
+            tokens = prompt_tokens[:common]
+
+            if self.llm.n_tokens >= common and list(self.llm._input_ids[:common]) == tokens:
+                # Префикс уже находится в KV-кеше модели после предыдущего вызова
+                saved = common
+            else:
+                key = self._key(tokens)
+                state = self._load(key)
+                if state is None:
+                    self.llm.reset()
+                    self.llm.eval(tokens)
+                    self._store(key, self.llm.save_state())
+                    saved = 0
+                else:
+                    self.llm.load_state(state)
+                    saved = common
+
+            self.last_saved_tokens = saved
+            self.total_saved_tokens += saved
+            return saved
+
+    def stats(self):
+        """
+        Возвращает:
+        dict: Число вызовов и сэкономленных токенов prefill.
+        """
+        return {
+            'calls': self.calls,
+            'saved_tokens': self.total_saved_tokens,
+            'saved_tokens_per_call': self.total_saved_tokens / self.calls if self.calls else 0.0,
+            'states_in_memory': len(self._states),
+        }
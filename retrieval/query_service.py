@@ -0,0 +1,307 @@
+import time
+import json
+import base64
+import queue
+import asyncio
+import threading
+from collections import deque
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from retrieval.rag_engine import multi_modal_rag_stream, get_llm, _load_llm
+from utils.tracing import tracer
+
+class ServiceBusy(Exception):
+    """Очередь запросов заполнена - запрос отклонен."""
+
+class QueryTimeout(TimeoutError):
+    """Запрос не выполнен за отведенное время."""
+
+# Сообщения о ходе выполнения запроса
+_CHUNK, _DONE, _ERROR = 'chunk', 'done', 'error'
+
+class QueryService:
+    """
+    Общий для процесса сервис запросов: один ретривер и пул моделей.
+    Запросы принимаются через очередь asyncio ограниченного размера
+    (при переполнении отклоняются сразу), каждый пул-слот обслуживает
+    один запрос за раз, у каждого запроса есть общий срок выполнения.
+    """
+
+    def __init__(self, retriever, pool_size=1, max_queue=16, timeout=300, latency_history=1000):
+        """
+        Параметры:
+        retriever (MultiVectorRetriever): Ретривер.
+        pool_size (int): Число экземпляров языковой модели (одновременных генераций).
+        max_queue (int): Максимальное число ожидающих запросов.
+        timeout (float): Срок выполнения запроса в секундах, включая ожидание в очереди.
+        latency_history (int): Число последних запросов для расчета процентилей.
+        """
+        self.retriever = retriever
+        self.pool_size = pool_size
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.counts = {'accepted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'cancelled': 0, 'timeouts': 0}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._waits = deque(maxlen=latency_history)
+        self._services = deque(maxlen=latency_history)
+        self._stats_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='query')
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name='query-service', daemon=True)
+        self._loop_thread.start()
+        self._queue = asyncio.run_coroutine_threadsafe(self._create_queue(), self._loop).result()
+        self._workers = [
+            asyncio.run_coroutine_threadsafe(self._worker(slot), self._loop) for slot in range(pool_size)
+        ]
+        self._http_server = None
+
+    async def _create_queue(self):
+        return asyncio.Queue(maxsize=self.max_queue)
+
+    # --- Обслуживание -------------------------------------------------
+
+    def _llm_for_slot(self, slot):
+        # Первый слот использует общую модель реестра, остальные - собственные экземпляры
+        return get_llm() if slot == 0 else _load_llm()
+
+    async def _worker(self, slot):
+        loop = asyncio.get_running_loop()
+        llm = None
+        while True:
+            job = await self._queue.get()
+            try:
+                if llm is None:
+                    llm = await loop.run_in_executor(self._executor, self._llm_for_slot, slot)
+                await loop.run_in_executor(self._executor, self._run_job, job, llm)
+            except Exception as e:
+                job['out'].put((_ERROR, e))
+            finally:
+                self._queue.task_done()
+
+    def _run_job(self, job, llm):
+        started_at = time.perf_counter()
+        wait = started_at - job['submitted_at']
+        if job['cancelled'].is_set():
+            # Клиент ушел, пока запрос стоял в очереди: поиск и упаковка уже не нужны
+            self._finish(wait, None, 'cancelled')
+            return
+        if started_at > job['deadline']:
+            self._finish(wait, None, 'timeouts')
+            job['out'].put((_ERROR, QueryTimeout(f"запрос ожидал в очереди {wait:.1f} с")))
+            return
+
+        with self._stats_lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        stats = {}
+        outcome = 'completed'
+        try:
+            # Отмена и срок проверяются на каждом токене модели, в том числе
+            # пока она рассуждает и видимых фрагментов нет
+            stream = multi_modal_rag_stream(
+                job['query'], self.retriever, is_image=job['is_image'], stats=stats, llm=llm,
+                cancel_event=job['cancelled'], deadline=job['deadline'],
+            )
+            try:
+                for chunk in stream:
+                    job['out'].put((_CHUNK, chunk))
+            finally:
+                # Закрытие генератора останавливает генерацию и освобождает модель
+                stream.close()
+            if stats.get('stopped'):
+                outcome = 'cancelled' if job['cancelled'].is_set() else 'timeouts'
+        except Exception as e:
+            outcome = 'failed'
+            job['out'].put((_ERROR, e))
+        finally:
+            with self._stats_lock:
+                self.in_flight -= 1
+        service = time.perf_counter() - started_at
+        self._finish(wait, service, outcome)
+        tracer.record('service.queue_wait', wait)
+        if outcome == 'timeouts':
+            job['out'].put((_ERROR, QueryTimeout(f"запрос не выполнен за {self.timeout} с")))
+        elif outcome == 'completed':
+            stats.update(queue_wait=wait, service_seconds=service)
+            job['out'].put((_DONE, stats))
+
+    def _finish(self, wait, service, outcome):
+        with self._stats_lock:
+            self.counts[outcome] += 1
+            self._waits.append(wait)
+            if service is not None:
+                self._services.append(service)
+
+    # --- Python API ---------------------------------------------------
+
+    async def _enqueue(self, job):
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise ServiceBusy(f"очередь запросов заполнена ({self.max_queue})")
+
+    def submit(self, query, is_image=False, timeout=None):
+        """
+        Ставит запрос в очередь.
+
+        Параметры:
+        query (str | bytes): Текстовый запрос, путь к изображению или содержимое файла изображения.
+        is_image (bool): Флаг поиска по изображению.
+        timeout (float): Срок выполнения (по умолчанию - self.timeout).
+
+        Возвращает:
+        dict: Задание: 'out' - очередь сообщений ('chunk', текст), ('done', статистика)
+        или ('error', исключение); 'cancelled' - событие для отмены; 'deadline' - срок.
+        """
+        submitted_at = time.perf_counter()
+        job = {
+            'query': query,
+            'is_image': is_image,
+            'submitted_at': submitted_at,
+            'deadline': submitted_at + (timeout or self.timeout),
+            'out': queue.Queue(),
+            'cancelled': threading.Event(),
+        }
+        try:
+            asyncio.run_coroutine_threadsafe(self._enqueue(job), self._loop).result()
+        except ServiceBusy:
+            with self._stats_lock:
+                self.counts['rejected'] += 1
+            raise
+        with self._stats_lock:
+            self.counts['accepted'] += 1
+        return job
+
+    def stream(self, query, is_image=False, stats=None, timeout=None):
+        """
+        Выполняет запрос и выдает фрагменты ответа по мере генерации.
+
+        Параметры:
+        stats (dict): Словарь, в который записывается статистика генерации,
+        время ожидания в очереди и время обслуживания.
+
+        Возвращает:
+        generator: Видимые фрагменты ответа.
+        """
+        job = self.submit(query, is_image, timeout)
+        try:
+            while True:
+                try:
+                    # Пока модель рассуждает, видимых фрагментов нет - срок проверяется здесь
+                    kind, payload = job['out'].get(timeout=max(job['deadline'] - time.perf_counter(), 0.001))
+                except queue.Empty:
+                    raise QueryTimeout(f"запрос не выполнен за {timeout or self.timeout} с")
+                if kind == _CHUNK:
+                    yield payload
+                elif kind == _DONE:
+                    if stats is not None:
+                        stats.update(payload)
+                    return
+                else:
+                    raise payload
+        finally:
+            # Клиент больше не читает ответ - обработчик остановит генерацию
+            job['cancelled'].set()
+
+    def query(self, query, is_image=False, timeout=None):
+        """
+        Выполняет запрос и возвращает ответ целиком.
+        """
+        return ''.join(self.stream(query, is_image, timeout=timeout)).strip()
+
+    async def aquery(self, query, is_image=False, timeout=None):
+        """
+        Асинхронный вариант query для вызова из другого цикла событий.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.query, query, is_image, timeout)
+
+    def stats(self):
+        """
+        Возвращает:
+        dict: Счетчики запросов, глубина очереди, текущая и максимальная
+        параллельность, процентили ожидания в очереди и времени обслуживания.
+        """
+        with self._stats_lock:
+            waits, services = list(self._waits), list(self._services)
+            result = dict(self.counts)
+            result.update(
+                queued=self._queue.qsize(),
+                in_flight=self.in_flight,
+                max_in_flight=self.max_in_flight,
+                pool_size=self.pool_size,
+            )
+        for name, values in (('queue_wait', waits), ('service', services)):
+            p50, p95 = np.percentile(values, [50, 95]) if values else (0.0, 0.0)
+            result[f'{name}_p50'] = float(p50)
+            result[f'{name}_p95'] = float(p95)
+        return result
+
+    # --- HTTP ---------------------------------------------------------
+
+    def serve_http(self, port, host='127.0.0.1'):
+        """
+        Запускает локальный HTTP-эндпоинт в фоновом потоке:
+        POST /query с JSON {"query": ..., "is_image": false} или {"image": <base64>}
+        (поиск по изображению из памяти) и GET /stats.
+
+        Возвращает:
+        ThreadingHTTPServer: Запущенный сервер.
+        """
+        service = self
+
+        class QueryHandler(BaseHTTPRequestHandler):
+            def _send_json(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.split('?')[0] == '/stats':
+                    self._send_json(200, service.stats())
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                if self.path.split('?')[0] != '/query':
+                    self.send_error(404)
+                    return
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                    stats = {}
+                    if 'image' in request:
+                        query, is_image = base64.b64decode(request['image']), True
+                    else:
+                        query, is_image = request['query'], bool(request.get('is_image'))
+                    answer = ''.join(service.stream(query, is_image, stats, request.get('timeout'))).strip()
+                    self._send_json(200, {'answer': answer, 'stats': stats})
+                except ServiceBusy as e:
+                    self._send_json(503, {'error': str(e)})
+                except QueryTimeout as e:
+                    self._send_json(504, {'error': str(e)})
+                except (KeyError, ValueError) as e:
+                    self._send_json(400, {'error': str(e)})
+                except Exception as e:
+                    self._send_json(500, {'error': str(e)})
+
+            def log_message(self, format, *args):
+                pass
+
+        self._http_server = ThreadingHTTPServer((host, port), QueryHandler)
+        threading.Thread(target=self._http_server.serve_forever, name='query-http', daemon=True).start()
+        return self._http_server
+
+    def close(self):
+        """
+        Останавливает HTTP-эндпоинт, обработчики и цикл событий.
+        """
+        if self._http_server is not None:
+            self._http_server.shutdown()
+        for worker in self._workers:
+            worker.cancel()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._executor.shutdown(wait=False)
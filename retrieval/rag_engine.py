@@ -1,29 +1,183 @@
-from llama_cpp import Llama
+import time
+import queue
+import hashlib
+import weakref
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from llama_cpp import Llama, StoppingCriteriaList
 from huggingface_hub import hf_hub_download
+from config import (
+    SUMMARY_CACHE_PATH, SUMMARY_CACHE_MAX_BYTES,
+    SUMMARY_WORKERS, SUMMARY_THREADS_PER_WORKER, SUMMARY_TIMEOUT, SUMMARY_RETRIES,
+    PREFIX_CACHE_ENABLED, PREFIX_CACHE_MAX_ENTRIES, PREFIX_CACHE_DIR,
+    ANSWER_CACHE_ENABLED, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY,
+    CONTEXT_PACKING_ENABLED, CONTEXT_TOKEN_BUDGET, ANSWER_TOKEN_RESERVE,
+    CONTEXT_CANDIDATES, CONTEXT_IMAGE_CANDIDATES, CONTEXT_DEDUP_THRESHOLD,
+    BATCH_QUERY_BLOCK,
+)
+from retrieval.summary_cache import SummaryCache
+from retrieval.summarizer import SummarizationEngine
+from retrieval.streaming import ThinkFilter
+from retrieval.prefix_cache import PrefixCache
+from retrieval.answer_cache import AnswerCache
+from retrieval.context_packer import ContextPacker
+from storage.vector_store import search_by_vectors
+from storage.embeddings import decode_image
+from utils.model_registry import registry
+from utils.tracing import tracer
+
+MODEL_REPO_ID = "unsloth/Qwen3-8B-GGUF"
+MODEL_FILENAME = "Qwen3-8B-Q6_K.gguf"
+# Параметры генерации резюме (входят в ключ кеша резюме)
+SUMMARY_GENERATION_PARAMS = {}
+
+def get_model_path():
+    """
+    Возвращает локальный путь к GGUF-файлу модели (скачивает его при необходимости).
+    """
+    return hf_hub_download(repo_id=MODEL_REPO_ID, filename=MODEL_FILENAME)
 
-# Initialize LLM
-model_path = hf_hub_download(repo_id="unsloth/Qwen3-8B-GGUF", filename="Qwen3-8B-Q6_K.gguf")
-llm = Llama(
-    model_path,
-    n_gpu_layers=-1,
-    verbose=False,
-    n_ctx=4096
+def _load_llm():
+    # Initialize LLM
+    return Llama(
+        get_model_path(),
+        n_gpu_layers=-1,
+        verbose=False,
+        n_ctx=4096
+    )
+
+registry.register('llm', _load_llm)
+
+def get_llm():
+    """
+    Возвращает общий экземпляр языковой модели, загружая его при первом вызове.
+    """
+    return registry.get('llm')
+
+registry.register(
+    'llm_prefix_cache',
+    lambda: PrefixCache(get_llm(), max_entries=PREFIX_CACHE_MAX_ENTRIES, disk_dir=PREFIX_CACHE_DIR)
 )
 
-def create_content_summaries(texts, tables, summarize_texts=False):
+registry.register(
+    'context_packer',
+    lambda: ContextPacker(
+        get_llm(),
+        budget=CONTEXT_TOKEN_BUDGET,
+        answer_reserve=ANSWER_TOKEN_RESERVE,
+        dedup_threshold=CONTEXT_DEDUP_THRESHOLD,
+    )
+)
+
+# Экземпляр Llama нельзя использовать из нескольких потоков одновременно:
+# каждый вызов (включая восстановление префикса) выполняется под его блокировкой
+_llm_locks = weakref.WeakKeyDictionary()
+_extra_prefix_caches = weakref.WeakKeyDictionary()
+_llm_locks_guard = threading.Lock()
+
+def _llm_lock(llm):
+    with _llm_locks_guard:
+        lock = _llm_locks.get(llm)
+        if lock is None:
+            lock = _llm_locks[llm] = threading.Lock()
+        return lock
+
+def get_prefix_cache(llm, create=True):
     """
-    Создает краткие резюме текстов и таблиц с помощью языковой модели.
+    Возвращает кеш префиксов для экземпляра модели (None, если он не создан и create=False).
+    """
+    if registry.is_loaded('llm') and llm is get_llm():
+        if create or registry.is_loaded('llm_prefix_cache'):
+            return registry.get('llm_prefix_cache')
+        return None
+    with _llm_locks_guard:
+        prefix_cache = _extra_prefix_caches.get(llm)
+        if prefix_cache is None and create:
+            prefix_cache = _extra_prefix_caches[llm] = PrefixCache(
+                llm, max_entries=PREFIX_CACHE_MAX_ENTRIES, disk_dir=PREFIX_CACHE_DIR
+            )
+        return prefix_cache
+
+def _prepare_prefix(llm, messages, static_prefix):
+    if static_prefix and PREFIX_CACHE_ENABLED:
+        with tracer.span('llm.prefix_cache') as span:
+            span.set(saved_tokens=get_prefix_cache(llm).prepare(messages, static_prefix))
+
+def chat_completion(messages, static_prefix=None, llm=None, **kwargs):
+    """
+    Вызывает create_chat_completion модели. Если задан неизменный
+    префикс системного сообщения, его KV-состояние берется из кеша префиксов.
+    Вызовы одного экземпляра модели выполняются по очереди.
     
     Параметры:
-    texts (list): Список текстовых элементов.
-    tables (list): Список таблиц.
-    summarize_texts (bool): Флаг необходимости суммаризации текстов.
+    messages (list): Сообщения чата.
+    static_prefix (str): Неизменное начало системного сообщения.
+    llm (Llama): Экземпляр модели (по умолчанию - общий из реестра).
     
     Возвращает:
-    tuple: Списки резюме текстов и таблиц.
+    dict или generator: Ответ llama.cpp.
     """
-    # Улучшенный промпт для суммаризации текстов
-    text_prompt = """Вы являетесь профессиональным редактором и аналитиком контента. Ваша задача - создать точное и лаконичное резюме представленного текста на русском языке для последующего поиска и анализа.
+    llm = llm or get_llm()
+    if kwargs.get('stream'):
+        return _stream_completion(llm, messages, static_prefix, kwargs)
+
+    with _llm_lock(llm):
+        _prepare_prefix(llm, messages, static_prefix)
+        with tracer.span('llm.chat') as span:
+            started_at = time.perf_counter()
+            response = llm.create_chat_completion(messages=messages, **kwargs)
+            elapsed = time.perf_counter() - started_at
+            usage = response.get('usage') or {}
+            prompt_tokens, completion_tokens = usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0)
+            span.set(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                tokens_per_sec=completion_tokens / elapsed if elapsed else 0.0,
+            )
+    tracer.count('llm_tokens', prompt_tokens, kind='prompt')
+    tracer.count('llm_tokens', completion_tokens, kind='completion')
+    return response
+
+def _stream_completion(llm, messages, static_prefix, kwargs):
+    # Модель занята до конца генерации (или до закрытия генератора)
+    with _llm_lock(llm):
+        _prepare_prefix(llm, messages, static_prefix)
+        yield from _traced_stream(llm.create_chat_completion(messages=messages, **kwargs))
+
+def _traced_stream(stream):
+    # Prefill - время до первого фрагмента, decode - генерация остальных
+    started_at = time.perf_counter()
+    first_chunk_at = None
+    n_chunks = 0
+    try:
+        for chunk in stream:
+            if first_chunk_at is None:
+                first_chunk_at = time.perf_counter()
+            n_chunks += 1
+            yield chunk
+    finally:
+        finished_at = time.perf_counter()
+        first_chunk_at = first_chunk_at or finished_at
+        decode_seconds = finished_at - first_chunk_at
+        tracer.record('llm.prefill', first_chunk_at - started_at)
+        tracer.record(
+            'llm.decode', decode_seconds,
+            completion_tokens=n_chunks,
+            tokens_per_sec=n_chunks / decode_seconds if decode_seconds else 0.0,
+        )
+        tracer.count('llm_tokens', n_chunks, kind='completion')
+
+summary_cache = SummaryCache(SUMMARY_CACHE_PATH, SUMMARY_CACHE_MAX_BYTES)
+summarization_engine = None
+answer_cache = AnswerCache(
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    ttl=ANSWER_CACHE_TTL,
+    similarity_threshold=ANSWER_CACHE_SIMILARITY,
+)
+
+# Улучшенный промпт для суммаризации текстов
+TEXT_SUMMARY_PROMPT = """Вы являетесь профессиональным редактором и аналитиком контента. Ваша задача - создать точное и лаконичное резюме представленного текста на русском языке для последующего поиска и анализа.
 
 Требования к резюме:
 • Сохраняйте фактическую точность и ключевые детали оригинала
@@ -36,8 +190,8 @@ def create_content_summaries(texts, tables, summarize_texts=False):
 
 Если текст слишком короткий или не содержит значимой информации, верните его без изменений."""
 
-    # Улучшенный промпт для суммаризации таблиц
-    table_prompt = """Вы являетесь экспертом по анализу структурированных данных. Ваша задача - проанализировать таблицу и создать информативное описание на русском языке для системы поиска.
+# Улучшенный промпт для суммаризации таблиц
+TABLE_SUMMARY_PROMPT = """Вы являетесь экспертом по анализу структурированных данных. Ваша задача - проанализировать таблицу и создать информативное описание на русском языке для системы поиска.
 
 Алгоритм анализа:
 1. Определите тип данных и их структуру
@@ -53,56 +207,121 @@ def create_content_summaries(texts, tables, summarize_texts=False):
 • Без домыслов и предположений
 • Если данных недостаточно, укажите это явно"""
 
-    text_overviews = []
-    table_overviews = []
+def get_summarization_engine():
+    """
+    Возвращает общий пул параллельной суммаризации, создавая его при первом вызове.
+    """
+    global summarization_engine
+    if summarization_engine is None:
+        summarization_engine = SummarizationEngine(
+            # Одному исполнителю достаточно общей модели процесса
+            get_model_path() if SUMMARY_WORKERS > 1 else None,
+            n_workers=SUMMARY_WORKERS,
+            n_threads=SUMMARY_THREADS_PER_WORKER,
+            timeout=SUMMARY_TIMEOUT,
+            retries=SUMMARY_RETRIES,
+            generation_params=SUMMARY_GENERATION_PARAMS,
+            prefix_cache_dir=PREFIX_CACHE_DIR if PREFIX_CACHE_ENABLED else None,
+            local_summarize=generate_summary,
+        )
+    return summarization_engine
 
-    if texts and summarize_texts:
-        for text in texts:
-            response = llm.create_chat_completion(
-                messages = [
-                    {"role": "system", "content": text_prompt},
-                    {"role": "user", "content": text}
-                ]
-            )
-            summary = response['choices'][0]['message']['content'].split('</think>')[-1].strip()
-            text_overviews.append(summary)
-    elif texts:
-        text_overviews = texts
+def generate_summary(content, prompt, deadline=None):
+    """
+    Создает резюме одного фрагмента моделью текущего процесса.
+    
+    Параметры:
+    content (str): Текст или таблица.
+    prompt (str): Системный промпт.
+    deadline (float): Срок по time.monotonic(); генерация останавливается
+    на первом токене после него.
+    
+    Возвращает:
+    str: Резюме фрагмента.
+    """
+    kwargs = dict(SUMMARY_GENERATION_PARAMS)
+    if deadline is not None:
+        kwargs['stopping_criteria'] = StoppingCriteriaList([lambda input_ids, logits: time.monotonic() > deadline])
+    response = chat_completion(
+        [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": content}
+        ],
+        static_prefix=prompt,
+        **kwargs
+    )
+    if deadline is not None and time.monotonic() > deadline:
+        # Резюме, оборванное по сроку, не сохраняется в кеш
+        raise TimeoutError(f"Суммаризация не уложилась в {SUMMARY_TIMEOUT} с")
+    return response['choices'][0]['message']['content'].split('</think>')[-1].strip()
 
-    if tables:
-        for table in tables:
-            response = llm.create_chat_completion(
-                messages = [
-                    {"role": "system", "content": text_prompt},  # Используем тот же промпт для таблиц
-                    {"role": "user", "content": table}
-                ]
-            )
-            summary = response['choices'][0]['message']['content'].split('</think>')[-1].strip()
-            table_overviews.append(summary)
+def summarize_batch(jobs):
+    """
+    Создает резюме для списка фрагментов: сначала ищет их в кеше резюме,
+    оставшиеся обрабатывает пулом суммаризации (при SUMMARY_WORKERS = 1 -
+    последовательно в текущем процессе) с ограничением времени и повторами.
+    
+    Параметры:
+    jobs (list): Список пар (фрагмент, системный промпт).
+    
+    Возвращает:
+    list: Резюме в порядке входных фрагментов.
+    """
+    keys = [
+        SummaryCache.make_key(content, prompt, MODEL_FILENAME, SUMMARY_GENERATION_PARAMS)
+        for content, prompt in jobs
+    ]
+    summaries = [summary_cache.get(key) for key in keys]
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    tracer.count('summary_cache_lookups', len(jobs) - len(missing), result='hit')
+    tracer.count('summary_cache_lookups', len(missing), result='miss')
+    if not missing:
+        return summaries
 
-    return text_overviews, table_overviews
+    with tracer.span('llm.summarize_batch', chunks=len(missing), cached=len(jobs) - len(missing)):
+        generated = get_summarization_engine().summarize([jobs[i] for i in missing])
+
+        for i, summary in zip(missing, generated):
+            if summary is None:
+                # Фрагмент не удалось обработать - индексируем исходный текст
+                summaries[i] = jobs[i][0]
+            else:
+                summaries[i] = summary
+                summary_cache.put(keys[i], summary)
+    return summaries
 
-def multi_modal_rag(query, retriever, is_image=False):
+def create_content_summaries(texts, tables, summarize_texts=False):
     """
-    Выполняет поиск и генерацию ответов по запросу пользователя.
+    Создает краткие резюме текстов и таблиц с помощью языковой модели.
     
     Параметры:
-    query (str): Текстовый запрос или путь к изображению.
-    retriever (MultiVectorRetriever): Ретривер для поиска.
-    is_image (bool): Флаг поиска по изображению.
+    texts (list): Список текстовых элементов.
+    tables (list): Список таблиц.
+    summarize_texts (bool): Флаг необходимости суммаризации текстов.
     
     Возвращает:
-    str: Сгенерированный ответ.
+    tuple: Списки резюме текстов и таблиц.
     """
-    if is_image:
-        docs = retriever.vectorstore.similarity_search_by_image(query, k=2)
-        query = 'Предоставьте краткое содержание'
-        print(docs)
+    jobs = []
+    if texts and summarize_texts:
+        jobs += [(text, TEXT_SUMMARY_PROMPT) for text in texts]
+    if tables:
+        # Используем тот же промпт для таблиц
+        jobs += [(table, TEXT_SUMMARY_PROMPT) for table in tables]
+
+    summaries = summarize_batch(jobs)
+
+    if texts and summarize_texts:
+        text_overviews = summaries[:len(texts)]
+        table_overviews = summaries[len(texts):]
     else:
-        docs = retriever.vectorstore.search(query, search_type="similarity", k=5)
+        text_overviews = texts if texts else []
+        table_overviews = summaries
 
-    # Улучшенный промпт для генерации ответов
-    prompt_template = """Вы - профессиональный ассистент, специализирующийся на анализе и систематизации информации. Ваша задача - предоставить точный и содержательный ответ на запрос пользователя на русском языке, используя только предоставленные материалы.
+    return text_overviews, table_overviews
+
+# Улучшенный промпт для генерации ответов
+ANSWER_PROMPT_TEMPLATE = """Вы - профессиональный ассистент, специализирующийся на анализе и систематизации информации. Ваша задача - предоставить точный и содержательный ответ на запрос пользователя на русском языке, используя только предоставленные материалы.
 
 Процесс формирования ответа:
 1. Внимательно изучите все предоставленные документы
@@ -124,14 +343,373 @@ def multi_modal_rag(query, retriever, is_image=False):
 
 Запрос пользователя:
 {query}"""
+
+# Неизменная часть промпта ответа (до подстановки материалов)
+ANSWER_STATIC_PREFIX = ANSWER_PROMPT_TEMPLATE.split('{elements}')[0]
+# Запас на служебные токены шаблона чата
+CHAT_TEMPLATE_OVERHEAD_TOKENS = 32
+
+def retrieve_documents(query, retriever, is_image=False):
+    """
+    Ищет документы, релевантные запросу.
     
-    additional_texts = '\n'.join([d.page_content for d in docs])
+    Параметры:
+    query (str | bytes | np.ndarray | PIL.Image): Текстовый запрос; для поиска
+    по изображению - путь к файлу, содержимое файла, декодированный массив
+    или изображение PIL (изображения из памяти не записываются на диск).
+    retriever (MultiVectorRetriever): Ретривер для поиска.
+    is_image (bool): Флаг поиска по изображению.
     
-    response = llm.create_chat_completion(
-        messages = [
-            {"role": "system", "content": prompt_template.format(elements=additional_texts, query=query)},
-            {"role": "user", "content": query}
-        ]
+    Возвращает:
+    tuple: Найденные документы, текст запроса для модели и вектор
+    текстового запроса (None для поиска по изображению).
+    """
+    if is_image:
+        k = CONTEXT_IMAGE_CANDIDATES if CONTEXT_PACKING_ENABLED else 2
+        if isinstance(query, str):
+            with tracer.span('vector.search_by_image', k=k) as span:
+                docs = retriever.vectorstore.similarity_search_by_image(query, k=k)
+                span.set(hits=len(docs))
+        else:
+            embeddings = retriever.vectorstore._embedding_function
+            with tracer.span('embed.query_image'):
+                # Содержимое файла ищется в кеше встраиваний по хешу до декодирования
+                if isinstance(query, (bytes, bytearray)):
+                    image_embedding = embeddings.embed_image_bytes([bytes(query)])[0]
+                else:
+                    image_embedding = embeddings.embed_pil_images([decode_image(query)])[0]
+            with tracer.span('vector.search', k=k) as span:
+                docs = retriever.vectorstore.similarity_search_by_vector(image_embedding, k=k)
+                span.set(hits=len(docs))
+        query = 'Предоставьте краткое содержание'
+        query_embedding = None
+        print(docs)
+    else:
+        k = CONTEXT_CANDIDATES if CONTEXT_PACKING_ENABLED else 5
+        with tracer.span('embed.query'):
+            query_embedding = retriever.vectorstore._embedding_function.embed_query(query)
+        with tracer.span('vector.search', k=k) as span:
+            docs = retriever.vectorstore.similarity_search_by_vector(query_embedding, k=k)
+            span.set(hits=len(docs))
+    return docs, query, query_embedding
+
+def pack_documents(query, docs, stats=None):
+    """
+    Отбирает найденные документы в контекст ответа в пределах бюджета токенов.
+    
+    Параметры:
+    query (str): Текст запроса для модели.
+    docs (list): Найденные документы в порядке убывания релевантности.
+    stats (dict): Словарь для статистики упаковки (число токенов материалов и др.).
+    
+    Возвращает:
+    tuple: Отобранные документы и текст материалов для промпта.
+    """
+    if not CONTEXT_PACKING_ENABLED:
+        return docs, '\n'.join([d.page_content for d in docs])
+    packer = registry.get('context_packer')
+    with tracer.span('context.pack') as span:
+        prompt_tokens = (
+            packer.count_tokens(ANSWER_PROMPT_TEMPLATE.format(elements='', query=query))
+            + packer.count_tokens(query)
+            + CHAT_TEMPLATE_OVERHEAD_TOKENS
+        )
+        pack_stats = {} if stats is None else stats
+        packed = packer.pack(docs, prompt_tokens, pack_stats)
+        span.set(**pack_stats)
+    return packed
+
+def get_doc_ids(docs):
+    """
+    Возвращает набор идентификаторов найденных документов
+    (для записей без doc_id - хеш содержимого).
+    """
+    return frozenset(
+        d.metadata.get('doc_id') or hashlib.sha256(d.page_content.encode('utf-8')).hexdigest()
+        for d in docs
     )
+
+def build_answer_messages(query, additional_texts):
+    """
+    Формирует сообщения для генерации ответа по тексту отобранных материалов.
+    """
+    return [
+        {"role": "system", "content": ANSWER_PROMPT_TEMPLATE.format(elements=additional_texts, query=query)},
+        {"role": "user", "content": query}
+    ]
+
+def _lookup_answer(query, query_embedding, doc_ids, is_image):
+    if is_image or not ANSWER_CACHE_ENABLED:
+        return None, 'miss'
+    answer, level = answer_cache.get(query, query_embedding, doc_ids)
+    tracer.count('answer_cache_lookups', result=level)
+    return answer, level
+
+def _remember_answer(query, query_embedding, doc_ids, is_image, answer):
+    if not is_image and ANSWER_CACHE_ENABLED:
+        answer_cache.put(query, query_embedding, doc_ids, answer)
+
+def _step_seconds(trace):
+    """
+    Возвращает время этапов поиска текущего запроса по отрезкам трассы:
+    декодирование изображения, встраивание запроса и поиск в индексе.
+    """
+    seconds = {'decode': 0.0, 'embed': 0.0, 'search': 0.0}
+    for span in trace['spans']:
+        if span['name'] == 'image.decode':
+            seconds['decode'] += span['duration']
+        elif span['name'] in ('embed.query', 'embed.query_image'):
+            seconds['embed'] += span['duration']
+        elif span['name'] in ('vector.search', 'vector.search_by_image'):
+            seconds['search'] += span['duration']
+    # Декодирование выполняется внутри отрезка встраивания
+    seconds['embed'] = max(seconds['embed'] - seconds['decode'], 0.0)
+    return seconds
+
+def _answer_text(response):
+    return response['choices'][0]['message']['content'].split('</think>')[-1].strip()
+
+def multi_modal_rag(query, retriever, is_image=False, llm=None):
+    """
+    Выполняет поиск и генерацию ответов по запросу пользователя.
+    
+    Параметры:
+    query (str): Текстовый запрос или путь к изображению.
+    retriever (MultiVectorRetriever): Ретривер для поиска.
+    is_image (bool): Флаг поиска по изображению.
+    llm (Llama): Экземпляр модели для генерации (по умолчанию - общий из реестра).
+    
+    Возвращает:
+    str: Сгенерированный ответ.
+    """
+    with tracer.trace('query', is_image=is_image):
+        docs, query, query_embedding = retrieve_documents(query, retriever, is_image)
+        docs, elements = pack_documents(query, docs)
+        doc_ids = get_doc_ids(docs)
+        answer, _ = _lookup_answer(query, query_embedding, doc_ids, is_image)
+        if answer is not None:
+            return answer
+    
+        response = chat_completion(
+            build_answer_messages(query, elements),
+            static_prefix=ANSWER_STATIC_PREFIX,
+            llm=llm
+        )
     
-    return response['choices'][0]['message']['content'].split('</think>')[-1].strip()
\ No newline at end of file
+        answer = _answer_text(response)
+        _remember_answer(query, query_embedding, doc_ids, is_image, answer)
+        return answer
+
+def multi_modal_rag_stream(query, retriever, is_image=False, stats=None, llm=None, cancel_event=None, deadline=None):
+    """
+    Потоковый вариант multi_modal_rag: выдает фрагменты ответа по мере генерации,
+    скрывая блок рассуждений модели.
+    
+    Параметры:
+    query (str): Текстовый запрос или путь к изображению.
+    retriever (MultiVectorRetriever): Ретривер для поиска.
+    is_image (bool): Флаг поиска по изображению.
+    stats (dict): Словарь, в который по окончании записываются время до первого
+    видимого токена, число токенов, скорость генерации и результат поиска в кеше ответов.
+    llm (Llama): Экземпляр модели для генерации (по умолчанию - общий из реестра).
+    cancel_event (threading.Event): Событие отмены запроса.
+    deadline (float): Срок выполнения по time.perf_counter().
+    Отмена и срок проверяются на каждом токене, в том числе внутри скрытого
+    блока рассуждений; остановленный ответ не сохраняется в кеш ответов.
+    
+    Возвращает:
+    generator: Видимые фрагменты ответа.
+    """
+    def should_stop():
+        return (cancel_event is not None and cancel_event.is_set()) or (
+            deadline is not None and time.perf_counter() > deadline
+        )
+
+    with tracer.trace('query', is_image=is_image, stream=True) as root:
+        started_at = time.perf_counter()
+        docs, query, query_embedding = retrieve_documents(query, retriever, is_image)
+        pack_stats = {}
+        docs, elements = pack_documents(query, docs, pack_stats)
+        doc_ids = get_doc_ids(docs)
+        answer, cache_level = _lookup_answer(query, query_embedding, doc_ids, is_image)
+    
+        generation_started_at = time.perf_counter()
+        first_visible_at = None
+        n_tokens = 0
+        stopped = False
+        if answer is not None:
+            first_visible_at = time.perf_counter()
+            yield answer
+        elif should_stop():
+            stopped = True
+        else:
+            stream = chat_completion(
+                build_answer_messages(query, elements),
+                static_prefix=ANSWER_STATIC_PREFIX,
+                llm=llm,
+                stream=True
+            )
+        
+            think_filter = ThinkFilter()
+            parts = []
+            try:
+                for chunk in stream:
+                    if should_stop():
+                        stopped = True
+                        break
+                    text = chunk['choices'][0]['delta'].get('content')
+                    if not text:
+                        continue
+                    n_tokens += 1
+                    visible = think_filter.feed(text)
+                    if visible:
+                        if first_visible_at is None:
+                            first_visible_at = time.perf_counter()
+                        parts.append(visible)
+                        yield visible
+            finally:
+                # Закрытие генератора останавливает генерацию и освобождает модель
+                stream.close()
+            if not stopped:
+                visible = think_filter.flush()
+                if visible:
+                    if first_visible_at is None:
+                        first_visible_at = time.perf_counter()
+                    parts.append(visible)
+                    yield visible
+                _remember_answer(query, query_embedding, doc_ids, is_image, ''.join(parts).strip())
+    
+        finished_at = time.perf_counter()
+        generation_seconds = finished_at - generation_started_at
+        prefix_cache = (
+            get_prefix_cache(llm or get_llm(), create=False)
+            if answer is None and PREFIX_CACHE_ENABLED else None
+        )
+        result = {
+            'time_to_first_token': (first_visible_at or finished_at) - started_at,
+            'completion_tokens': n_tokens,
+            'tokens_per_sec': n_tokens / generation_seconds if generation_seconds else 0.0,
+            'total_seconds': finished_at - started_at,
+            'prefill_tokens_saved': prefix_cache.last_saved_tokens if prefix_cache is not None else 0,
+            'answer_cache': cache_level,
+            'context_tokens': pack_stats.get('context_tokens', 0) if CONTEXT_PACKING_ENABLED else None,
+            'context_documents': len(docs),
+            'step_seconds': _step_seconds(root.trace),
+            'stopped': stopped,
+        }
+        if stats is not None:
+            stats.update(result)
+        print(f"Ответ{' (остановлен)' if stopped else ''}: первый токен через {result['time_to_first_token']:.2f} с, "
+              f"{n_tokens} токенов, {result['tokens_per_sec']:.1f} ток./с, "
+              f"prefill сэкономлен на {result['prefill_tokens_saved']} токенов, "
+              f"кеш ответов: {cache_level}, материалы: {len(docs)} док., "
+              f"декодирование {result['step_seconds']['decode']:.3f} с, встраивание "
+              f"{result['step_seconds']['embed']:.3f} с, поиск {result['step_seconds']['search']:.3f} с")
+
+def multi_modal_rag_batch(queries, retriever, llms=None, stats=None, block_size=BATCH_QUERY_BLOCK):
+    """
+    Пакетный вариант multi_modal_rag для текстовых запросов: одинаковые
+    запросы объединяются, уникальные запросы встраиваются и ищутся в индексе
+    блоками по block_size векторизованным поиском, генерации распределяются
+    по доступным экземплярам модели и начинаются, не дожидаясь следующих
+    блоков. Ответы выдаются по мере готовности (порядок завершения, а не
+    порядок запросов).
+    
+    Параметры:
+    queries (list): Текстовые запросы.
+    retriever (MultiVectorRetriever): Ретривер для поиска.
+    llms (list): Экземпляры модели для параллельной генерации
+    (по умолчанию - общий из реестра).
+    stats (dict): Словарь, в который по окончании записываются число запросов,
+    уникальных запросов, попаданий в кеш ответов, ошибок, время и запросов в секунду.
+    block_size (int): Число уникальных запросов, встраиваемых и ищущихся за один раз.
+    
+    Возвращает:
+    generator: Пары (номер запроса в queries, ответ); если генерация ответа
+    завершилась ошибкой, вместо ответа выдается исключение, остальные
+    запросы пакета продолжают обрабатываться.
+    """
+    started_at = time.perf_counter()
+    llms = list(llms) if llms else [get_llm()]
+    positions = {}
+    for i, query in enumerate(queries):
+        positions.setdefault(query, []).append(i)
+    unique = list(positions)
+    k = CONTEXT_CANDIDATES if CONTEXT_PACKING_ENABLED else 5
+    cache_hits = 0
+    failed = 0
+    futures = {}
+
+    free_llms = queue.Queue()
+    for llm in llms:
+        free_llms.put(llm)
+
+    def generate(query, query_embedding, doc_ids, elements):
+        llm = free_llms.get()
+        try:
+            response = chat_completion(
+                build_answer_messages(query, elements), static_prefix=ANSWER_STATIC_PREFIX, llm=llm
+            )
+        finally:
+            free_llms.put(llm)
+        answer = _answer_text(response)
+        _remember_answer(query, query_embedding, doc_ids, False, answer)
+        return answer
+
+    with tracer.trace('query_batch', queries=len(queries), unique=len(unique)), \
+            ThreadPoolExecutor(max_workers=len(llms), thread_name_prefix='rag-batch') as executor:
+        try:
+            for start in range(0, len(unique), block_size):
+                block = unique[start:start + block_size]
+                with tracer.span('embed.query', items=len(block)):
+                    embeddings = retriever.vectorstore._embedding_function.embed_documents(block)
+                with tracer.span('vector.search', k=k, queries=len(block)):
+                    found = search_by_vectors(retriever.vectorstore, embeddings, k)
+
+                # Упаковка контекста использует общий упаковщик - выполняется до распределения генераций
+                for query, query_embedding, docs in zip(block, embeddings, found):
+                    docs, elements = pack_documents(query, docs)
+                    doc_ids = get_doc_ids(docs)
+                    answer, _ = _lookup_answer(query, query_embedding, doc_ids, False)
+                    if answer is not None:
+                        cache_hits += 1
+                        for i in positions[query]:
+                            yield i, answer
+                    else:
+                        # Отрезки генераций попадают в трассу пакета
+                        future = executor.submit(
+                            contextvars.copy_context().run, generate, query, query_embedding, doc_ids, elements
+                        )
+                        futures[future] = query
+
+            for future in as_completed(futures):
+                query = futures[future]
+                try:
+                    answer = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"Ошибка при генерации ответа на запрос {query!r}: {e}")
+                    answer = e
+                for i in positions[query]:
+                    yield i, answer
+        finally:
+            # Если ответы больше не читают, еще не начатые генерации отменяются
+            for future in futures:
+                future.cancel()
+
+    seconds = time.perf_counter() - started_at
+    result = {
+        'queries': len(queries),
+        'unique_queries': len(unique),
+        'answer_cache_hits': cache_hits,
+        'generated': len(futures) - failed,
+        'failed': failed,
+        'llm_instances': len(llms),
+        'seconds': seconds,
+        'queries_per_sec': len(queries) / seconds if seconds else 0.0,
+    }
+    tracer.count('batch_queries', len(queries))
+    if stats is not None:
+        stats.update(result)
+    print(f"Пакет: {len(queries)} запросов ({len(unique)} уникальных, {cache_hits} из кеша ответов, "
+          f"{failed} с ошибкой) за {seconds:.1f} с, {result['queries_per_sec']:.2f} запросов/с")
@@ -0,0 +1,62 @@
+class ThinkFilter:
+    """
+    Потоковый фильтр, скрывающий блок рассуждений <think>...</think>
+    в начале ответа модели. Текст без такого блока пропускается как есть.
+    """
+
+    OPEN_TAG = '<think>'
+    CLOSE_TAG = '</think>'
+
+    def __init__(self):
+        self._buffer = ''
+        self._state = 'start'
+
+    def feed(self, text):
+        """
+        Принимает очередной фрагмент вывода модели.
+
+        Параметры:
+        text (str): Фрагмент сгенерированного текста.
+
+        Возвращает:
+        str: Видимая пользователю часть (может быть пустой).
+        """
+        self._buffer += text
+
+        if self._state == 'start':
+            stripped = self._buffer.lstrip()
+            if self.OPEN_TAG.startswith(stripped):
+                # Еще неизвестно, начинается ли ответ с блока рассуждений
+                return ''
+            if stripped.startswith(self.OPEN_TAG):
+                self._buffer = stripped[len(self.OPEN_TAG):]
+                self._state = 'think'
+            else:
+                self._state = 'answer'
+
+        if self._state == 'think':
+            end = self._buffer.find(self.CLOSE_TAG)
+            if end == -1:
+                # Хвост буфера может оказаться началом закрывающего тега
+                self._buffer = self._buffer[-(len(self.CLOSE_TAG) - 1):]
+                return ''
+            self._buffer = self._buffer[end + len(self.CLOSE_TAG):]
+            self._state = 'answer_start'
+
+        if self._state == 'answer_start':
+            self._buffer = self._buffer.lstrip()
+            if not self._buffer:
+                return ''
+            self._state = 'answer'
+
+        visible, self._buffer = self._buffer, ''
+        return visible
+
+    def flush(self):
+        """
+        Возвращает:
+        str: Оставшийся в буфере видимый текст после окончания генерации.
+        """
+        visible = self._buffer if self._state in ('start', 'answer') else ''
+        self._buffer = ''
+        return visible
@@ -0,0 +1,239 @@
+import os
+import time
+import queue
+import signal
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# Экземпляр модели, кеш префиксов и очередь отметок о начале работы внутри процесса-исполнителя
+_worker_llm = None
+_worker_prefix_cache = None
+_worker_started = None
+
+def _init_worker(model_path, n_threads, n_ctx, prefix_cache_dir, started):
+    """
+    Загружает собственный экземпляр llama.cpp в процессе-исполнителе.
+    """
+    global _worker_llm, _worker_prefix_cache, _worker_started
+    _worker_started = started
+    from llama_cpp import Llama
+    from retrieval.prefix_cache import PrefixCache
+    _worker_llm = Llama(
+        model_path,
+        n_gpu_layers=-1,
+        n_threads=n_threads,
+        verbose=False,
+        n_ctx=n_ctx
+    )
+    if prefix_cache_dir:
+        _worker_prefix_cache = PrefixCache(_worker_llm, max_entries=1, disk_dir=prefix_cache_dir)
+
+def _summarize_in_worker(job_id, content, prompt, params):
+    # Время ожидания отсчитывается с момента, когда исполнитель взял фрагмент:
+    # до этого задача может стоять в очереди пула за медленным фрагментом
+    _worker_started.put((job_id, os.getpid(), time.monotonic()))
+    messages = [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": content}
+    ]
+    if _worker_prefix_cache is not None:
+        _worker_prefix_cache.prepare(messages, prompt)
+    response = _worker_llm.create_chat_completion(messages=messages, **params)
+    return response['choices'][0]['message']['content'].split('</think>')[-1].strip()
+
+class SummarizationEngine:
+    """
+    Параллельная суммаризация: пул процессов, в каждом из которых работает
+    свой экземпляр llama.cpp с заданным числом потоков. При одном исполнителе
+    фрагменты обрабатываются в текущем процессе с теми же ограничением
+    времени, повторными попытками и отчетом о скорости.
+    """
+
+    def __init__(self, model_path, n_workers, n_threads=None, n_ctx=4096,
+                 timeout=None, retries=1, generation_params=None, prefix_cache_dir=None,
+                 local_summarize=None):
+        """
+        Параметры:
+        model_path (str): Путь к GGUF-файлу модели.
+        n_workers (int): Число процессов-исполнителей.
+        n_threads (int): Число потоков llama.cpp в каждом исполнителе.
+        n_ctx (int): Размер контекста модели.
+        timeout (float): Ограничение времени на один фрагмент в секундах.
+        retries (int): Число повторных попыток для фрагмента.
+        generation_params (dict): Параметры генерации.
+        prefix_cache_dir (str): Директория кеша KV-состояний системного промпта
+        (None - кеш префиксов в исполнителях не используется).
+        local_summarize (callable): Функция (фрагмент, промпт, срок) для
+        суммаризации в текущем процессе при n_workers = 1; по истечении
+        срока (time.monotonic()) она должна выбросить TimeoutError.
+        """
+        self.model_path = model_path
+        self.n_workers = n_workers
+        self.n_threads = n_threads
+        self.n_ctx = n_ctx
+        self.timeout = timeout
+        self.retries = retries
+        self.generation_params = generation_params or {}
+        self.prefix_cache_dir = prefix_cache_dir
+        self.local_summarize = local_summarize
+        self.last_stats = {}
+        self._pool = None
+        self._started = None
+        self._job_ids = itertools.count()
+
+    def _start_pool(self):
+        context = multiprocessing.get_context('spawn')
+        # Очередь создается заново с пулом: завершенный исполнитель мог оставить ее в плохом состоянии
+        self._started = context.Queue()
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.n_workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.model_path, self.n_threads, self.n_ctx, self.prefix_cache_dir, self._started),
+        )
+
+    def _restart_pool(self, pids):
+        # Зависший исполнитель нельзя отменить: он завершается, пул после этого
+        # считается сломанным, останавливает остальные исполнители и пересоздается
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._started.close()
+        self._start_pool()
+
+    def _drain_started(self, started_at, pending_ids):
+        while True:
+            try:
+                job_id, pid, timestamp = self._started.get_nowait()
+            except queue.Empty:
+                return
+            # Отметка могла прийти уже после результата задачи
+            if job_id in pending_ids:
+                started_at[job_id] = (pid, timestamp)
+
+    def summarize(self, jobs):
+        """
+        Создает резюме для списка фрагментов, сохраняя порядок входных данных.
+
+        Параметры:
+        jobs (list): Список пар (фрагмент, системный промпт).
+
+        Возвращает:
+        list: Резюме в порядке входных фрагментов; None для фрагментов,
+        которые не удалось обработать после всех попыток.
+        """
+        if not jobs:
+            return []
+        if self.n_workers <= 1 and self.local_summarize is not None:
+            return self._summarize_in_process(jobs)
+        if self._pool is None:
+            self._start_pool()
+
+        results = [None] * len(jobs)
+        attempts = [0] * len(jobs)
+        failed = 0
+        started_at = time.perf_counter()
+
+        def submit(index):
+            attempts[index] += 1
+            content, prompt = jobs[index]
+            job_id = next(self._job_ids)
+            future = self._pool.submit(_summarize_in_worker, job_id, content, prompt, self.generation_params)
+            pending[future] = (index, job_id)
+
+        def retry_or_fail(index, reason):
+            nonlocal failed
+            if attempts[index] <= self.retries:
+                submit(index)
+            else:
+                failed += 1
+                print(f"Ошибка при суммаризации фрагмента {index}: {reason}")
+
+        pending = {}
+        # Идентификатор задачи -> (pid исполнителя, время начала работы над ней)
+        running_since = {}
+        for index in range(len(jobs)):
+            submit(index)
+
+        while pending:
+            done, _ = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, job_id = pending.pop(future)
+                running_since.pop(job_id, None)
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    retry_or_fail(index, e)
+
+            self._drain_started(running_since, {job_id for _, job_id in pending.values()})
+            if self.timeout is None:
+                continue
+
+            now = time.monotonic()
+            expired = {
+                future: running_since[job_id][0]
+                for future, (_, job_id) in pending.items()
+                if job_id in running_since and now - running_since[job_id][1] > self.timeout
+            }
+            if expired:
+                interrupted = list(pending.items())
+                pending.clear()
+                running_since.clear()
+                self._restart_pool(set(expired.values()))
+                for future, (index, _) in interrupted:
+                    if future in expired:
+                        retry_or_fail(index, 'превышено время ожидания')
+                    elif future.done() and not future.cancelled() and future.exception() is None:
+                        results[index] = future.result()
+                    else:
+                        # Прерванный перезапуском фрагмент не считается попыткой
+                        attempts[index] -= 1
+                        submit(index)
+
+        self._report(len(jobs), failed, sum(attempts) - len(jobs), time.perf_counter() - started_at)
+        return results
+
+    def _summarize_in_process(self, jobs):
+        # Исключение одного фрагмента не прерывает остальные
+        results = [None] * len(jobs)
+        failed = retries = 0
+        started_at = time.perf_counter()
+        for index, (content, prompt) in enumerate(jobs):
+            for attempt in range(self.retries + 1):
+                deadline = time.monotonic() + self.timeout if self.timeout is not None else None
+                try:
+                    results[index] = self.local_summarize(content, prompt, deadline)
+                    break
+                except TimeoutError:
+                    reason = 'превышено время ожидания'
+                except Exception as e:
+                    reason = e
+                if attempt < self.retries:
+                    retries += 1
+                else:
+                    failed += 1
+                    print(f"Ошибка при суммаризации фрагмента {index}: {reason}")
+        self._report(len(jobs), failed, retries, time.perf_counter() - started_at)
+        return results
+
+    def _report(self, chunks, failed, retries, elapsed):
+        self.last_stats = {
+            'chunks': chunks,
+            'failed': failed,
+            'retries': retries,
+            'seconds': elapsed,
+            'chunks_per_sec': chunks / elapsed if elapsed else 0.0,
+        }
+        print(f"Суммаризация: {chunks} фрагментов за {elapsed:.1f} с "
+              f"({self.last_stats['chunks_per_sec']:.2f} фрагм./с, воркеров: {self.n_workers})")
+
+    def close(self):
+        """Останавливает пул исполнителей."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._started.close()
+            self._pool = None
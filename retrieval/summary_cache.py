@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class SummaryCache:
+    """
+    Дисковый кеш резюме, сгенерированных языковой моделью.
+    Ограничен по суммарному размеру, вытесняет давно не использованные записи (LRU).
+    """
+
+    def __init__(self, path, max_bytes):
+        """
+        Параметры:
+        path (str): Путь к файлу SQLite.
+        max_bytes (int): Максимальный суммарный размер хранимых резюме в байтах.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "key TEXT PRIMARY KEY, summary TEXT, size INTEGER, last_access REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS summaries_last_access ON summaries (last_access)"
+        )
+        # Суммарный размер хранится отдельной строкой и меняется в тех же транзакциях,
+        # что и записи: иначе каждая запись требовала бы полного прохода по таблице
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        if self._conn.execute("SELECT 1 FROM meta WHERE key = 'total_bytes'").fetchone() is None:
+            # Кеш, созданный до появления счетчика, просматривается один раз
+            self._conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value) "
+                "SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM summaries"
+            )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(text, prompt, model_file, params):
+        """
+        Формирует ключ кеша по фрагменту, системному промпту, файлу модели
+        и параметрам генерации.
+
+        Возвращает:
+        str: Ключ записи.
+        """
+        parts = [
+            hashlib.sha256(text.encode('utf-8')).hexdigest(),
+            hashlib.sha256(prompt.encode('utf-8')).hexdigest(),
+            model_file,
+            json.dumps(params, sort_keys=True),
+        ]
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Возвращает резюме из кеша или None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary FROM summaries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE summaries SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, summary):
+        """
+        Сохраняет резюме и при необходимости вытесняет старые записи.
+        """
+        size = len(summary.encode('utf-8'))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM summaries WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, summary, size, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, summary, size, time.time()),
+            )
+            self._add_bytes(size - (old[0] if old else 0))
+            self._evict()
+            self._conn.commit()
+
+    def _add_bytes(self, delta):
+        self._conn.execute("UPDATE meta SET value = value + ? WHERE key = 'total_bytes'", (delta,))
+
+    def _total_bytes(self):
+        return self._conn.execute("SELECT value FROM meta WHERE key = 'total_bytes'").fetchone()[0]
+
+    def _evict(self):
+        total = self._total_bytes()
+        if total <= self.max_bytes:
+            return
+        victims = []
+        freed = 0
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM summaries ORDER BY last_access"
+        ):
+            if total - freed <= self.max_bytes:
+                break
+            victims.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM summaries WHERE key = ?", victims)
+        self._add_bytes(-freed)
+
+    def stats(self):
+        """
+        Возвращает:
+        dict: Попадания, промахи, доля попаданий, число записей и размер кеша.
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+            size = self._total_bytes()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'bytes': size,
+        }
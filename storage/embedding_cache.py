@@ -0,0 +1,333 @@
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from utils.helpers import file_sha256
+from utils.tracing import tracer
+
+# Максимальное число параметров в одном запросе SQLite
+_SQL_BATCH = 500
+
+class EmbeddingCache:
+    """
+    Дисковый кеш векторов: векторы float32 хранятся в файле, отображаемом
+    в память (np.memmap), ключи и время последнего обращения - в SQLite.
+    Число записей ограничено; при переполнении строки давно не использованных
+    записей (LRU) переиспользуются для новых, так что файл не растет
+    больше max_bytes. Кеш могут одновременно использовать несколько
+    процессов: выделение строк, запись векторов и ключей выполняются в одной
+    транзакции BEGIN IMMEDIATE. У каждой записи хранится контрольная сумма
+    вектора, поэтому строка, перезаписанная транзакцией, которая не успела
+    завершиться (сбой процесса), считается промахом, а не попаданием.
+    """
+
+    def __init__(self, directory, max_bytes):
+        """
+        Параметры:
+        directory (str): Директория кеша.
+        max_bytes (int): Максимальный размер файла векторов в байтах.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._vectors_path = os.path.join(directory, 'vectors.f32')
+        self._vectors = None
+        self._lock = threading.Lock()
+        # Транзакции открываются явно (isolation_level=None)
+        self._conn = sqlite3.connect(
+            os.path.join(directory, 'keys.sqlite'), check_same_thread=False, isolation_level=None, timeout=60
+        )
+        with self._transaction():
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, row INTEGER UNIQUE, last_access REAL, checksum INTEGER)"
+            )
+            if 'checksum' not in [column[1] for column in self._conn.execute("PRAGMA table_info(entries)")]:
+                # Записи кеша без контрольной суммы считаются промахами и перезаписываются
+                self._conn.execute("ALTER TABLE entries ADD COLUMN checksum INTEGER")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        self.dim = self._meta('dim')
+
+    @staticmethod
+    def make_key(model, modality, content_hash):
+        """
+        Формирует ключ записи по модели (имя и веса), модальности
+        ('text', 'image', 'image_file', 'image_bytes') и хешу содержимого.
+
+        Возвращает:
+        str: Ключ записи.
+        """
+        return hashlib.sha256(f'{model}|{modality}|{content_hash}'.encode('utf-8')).hexdigest()
+
+    # --- Хранение -------------------------------------------------------
+
+    @contextmanager
+    def _transaction(self):
+        """Транзакция с блокировкой записи базы для всех процессов сразу при открытии."""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _meta(self, name, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_meta(self, name, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    @property
+    def max_entries(self):
+        return max(self.max_bytes // (4 * self.dim), 1) if self.dim else 0
+
+    def _mapped_rows(self):
+        return 0 if self._vectors is None else self._vectors.shape[0]
+
+    def _map(self, rows, grow=False):
+        """
+        Отображает файл векторов так, чтобы в нем было не меньше rows строк.
+        Файл увеличивается (grow=True) только внутри транзакции записи, поэтому
+        процессы не укорачивают файл, выросший в другом процессе.
+        """
+        if rows <= self._mapped_rows():
+            return
+        row_bytes = 4 * self.dim
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        if size < rows * row_bytes:
+            if not grow:
+                raise ValueError(f"Файл векторов кеша короче {rows} строк")
+            capacity = min(max(rows, 2 * (size // row_bytes), 1024), max(self.max_entries, rows))
+            self._vectors = None
+            with open(self._vectors_path, 'ab') as f:
+                f.truncate(capacity * row_bytes)
+            size = capacity * row_bytes
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r+', shape=(size // row_bytes, self.dim))
+
+    @staticmethod
+    def _checksum(vector):
+        return zlib.crc32(np.ascontiguousarray(vector, dtype=np.float32).tobytes())
+
+    # --- Чтение и запись -------------------------------------------------
+
+    def get_many(self, keys):
+        """
+        Достает векторы одним проходом по индексу ключей.
+
+        Параметры:
+        keys (list): Ключи записей.
+
+        Возвращает:
+        list: Векторы (np.ndarray) или None для отсутствующих ключей.
+        """
+        with self._lock:
+            rows = {key: (row, checksum) for key, row, checksum in self._rows(keys)}
+            if rows and self.dim is None:
+                # Первые векторы записал другой процесс
+                self.dim = self._meta('dim')
+            vectors = {}
+            if rows:
+                self._map(max(row for row, _ in rows.values()) + 1)
+                for key, (row, checksum) in rows.items():
+                    vector = np.array(self._vectors[row])
+                    if checksum is not None and self._checksum(vector) == checksum:
+                        vectors[key] = vector
+            if vectors:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE entries SET last_access = ? WHERE key = ?", [(now, key) for key in vectors]
+                )
+            result = [vectors.get(key) for key in keys]
+            hits = sum(vector is not None for vector in result)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return result
+
+    def put_many(self, keys, vectors):
+        """
+        Сохраняет векторы и при необходимости вытесняет старые записи.
+
+        Параметры:
+        keys (list): Ключи записей (без повторов).
+        vectors (list): Векторы одинаковой размерности.
+        """
+        if not keys:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._transaction():
+            # Размерность и число строк перечитываются: их мог изменить другой процесс
+            self.dim = self._meta('dim')
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self._set_meta('dim', self.dim)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Размерность вектора {vectors.shape[1]} не совпадает с размерностью кеша {self.dim}")
+            keys, vectors = keys[-self.max_entries:], vectors[-self.max_entries:]
+
+            existing = {key: row for key, row, _ in self._rows(keys)}
+            new_keys = [key for key in keys if key not in existing]
+            count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            overflow = count + len(new_keys) - self.max_entries
+            free_rows = []
+            if overflow > 0:
+                # Записи текущего пакета не вытесняются
+                victims = [
+                    (key, row) for key, row in self._conn.execute(
+                        "SELECT key, row FROM entries ORDER BY last_access LIMIT ?", (overflow + len(existing),)
+                    )
+                    if key not in existing
+                ][:overflow]
+                # Строки вытесненных записей переходят новым ключам в той же транзакции:
+                # при сбое до ее фиксации старые ключи вернутся, но их векторы
+                # не пройдут проверку контрольной суммы
+                self._conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in victims])
+                free_rows = [row for _, row in victims]
+            high_water = self._meta('rows', 0)
+            for key in new_keys:
+                if free_rows:
+                    existing[key] = free_rows.pop()
+                else:
+                    existing[key] = high_water
+                    high_water += 1
+
+            self._map(high_water, grow=True)
+            rows = np.asarray([existing[key] for key in keys])
+            self._vectors[rows] = vectors
+            self._vectors.flush()
+            now = time.time()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, row, last_access, checksum) VALUES (?, ?, ?, ?)",
+                [(key, existing[key], now, self._checksum(vector)) for key, vector in zip(keys, vectors)],
+            )
+            self._set_meta('rows', high_water)
+
+    def _rows(self, keys):
+        rows = []
+        for start in range(0, len(keys), _SQL_BATCH):
+            batch = keys[start:start + _SQL_BATCH]
+            rows.extend(self._conn.execute(
+                f"SELECT key, row, checksum FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall())
+        return rows
+
+    def stats(self):
+        """
+        Возвращает:
+        dict: Попадания, промахи, доля попаданий, число записей и размер файла векторов.
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'bytes': os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0,
+        }
+
+def _image_hash(image):
+    digest = hashlib.sha256(f'{image.mode}|{image.size}|'.encode('utf-8'))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Обертка модели встраивания с дисковым кешем EmbeddingCache: векторы
+    пакета достаются из кеша одним запросом, модель вычисляет только
+    промахи - одним пакетом. Повторная сборка индекса и повторные запросы
+    почти не требуют вычислений модели.
+    """
+
+    def __init__(self, embeddings, cache, model_id=None):
+        """
+        Параметры:
+        embeddings (BatchedOpenCLIPEmbeddings): Модель встраивания.
+        cache (EmbeddingCache): Кеш векторов.
+        model_id (str): Идентификатор модели в ключе кеша
+        (по умолчанию - имя модели, веса и режим вывода).
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_id = model_id or '/'.join(
+            str(getattr(embeddings, name, '')) for name in ('model_name', 'checkpoint', 'inference_mode')
+        )
+
+    def __getattr__(self, name):
+        # Остальные атрибуты (model, preprocess, batch_size, ...) - у обернутой модели
+        if name in ('embeddings', 'cache', 'model_id'):
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def _cached(self, modality, items, hashes, compute):
+        keys = [EmbeddingCache.make_key(self.model_id, modality, h) for h in hashes]
+        # Одинаковое содержимое внутри пакета вычисляется один раз
+        first = {}
+        for i, key in enumerate(keys):
+            first.setdefault(key, i)
+        unique_keys = list(first)
+        found = dict(zip(unique_keys, self.cache.get_many(unique_keys)))
+        missing = [key for key in unique_keys if found[key] is None]
+        tracer.count('embedding_cache_hits', len(unique_keys) - len(missing), modality=modality)
+        tracer.count('embedding_cache_misses', len(missing), modality=modality)
+        if missing:
+            computed = compute([items[first[key]] for key in missing])
+            self.cache.put_many(missing, computed)
+            found.update(zip(missing, computed))
+        return [np.asarray(found[key], dtype=np.float32).tolist() for key in keys]
+
+    def embed_documents(self, texts):
+        """
+        Параметры:
+        texts (list): Список текстов.
+
+        Возвращает:
+        list: Векторы текстов.
+        """
+        hashes = [hashlib.sha256(text.encode('utf-8')).hexdigest() for text in texts]
+        return self._cached('text', texts, hashes, self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def embed_pil_images(self, images):
+        """
+        Параметры:
+        images (list): Список изображений PIL (ключ - хеш пикселей).
+
+        Возвращает:
+        list: Векторы изображений.
+        """
+        return self._cached('image', images, [_image_hash(image) for image in images], self.embeddings.embed_pil_images)
+
+    def embed_image_bytes(self, datas):
+        """
+        Параметры:
+        datas (list): Закодированные файлы изображений (ключ - хеш байтов,
+        при попадании изображение не декодируется).
+
+        Возвращает:
+        list: Векторы изображений.
+        """
+        hashes = [hashlib.sha256(data).hexdigest() for data in datas]
+        return self._cached('image_bytes', datas, hashes, self.embeddings.embed_image_bytes)
+
+    def embed_image(self, uris):
+        """
+        Параметры:
+        uris (list): Пути к файлам изображений (ключ - хеш файла,
+        при попадании изображение не декодируется).
+
+        Возвращает:
+        list: Векторы изображений.
+        """
+        return self._cached('image_file', uris, [file_sha256(uri) for uri in uris], self.embeddings.embed_image)
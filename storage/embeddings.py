@@ -0,0 +1,136 @@
+import io
+import torch
+import numpy as np
+from PIL import Image
+from langchain_experimental.open_clip.open_clip import OpenCLIPEmbeddings
+from utils.tracing import tracer
+
+# Режимы вывода OpenCLIP на CPU
+INFERENCE_MODES = ('fp32', 'int8', 'bf16')
+
+def tune_threads(num_threads=None, interop_threads=None):
+    """
+    Настраивает число потоков PyTorch для вычислений на CPU.
+
+    Параметры:
+    num_threads (int): Потоки внутри операции (None - не менять).
+    interop_threads (int): Потоки между операциями (задается только
+    до первых параллельных вычислений в процессе).
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # Пул уже создан - оставляем текущее значение
+            pass
+
+def decode_image(image):
+    """
+    Приводит изображение запроса к PIL.Image без временных файлов.
+
+    Параметры:
+    image (bytes | np.ndarray | PIL.Image): Закодированный файл изображения,
+    декодированный массив (H, W, C) или изображение PIL.
+
+    Возвращает:
+    PIL.Image: Изображение RGB.
+    """
+    with tracer.span('image.decode'):
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            with Image.open(io.BytesIO(image)) as decoded:
+                return decoded.convert('RGB')
+        if isinstance(image, np.ndarray):
+            return Image.fromarray(image).convert('RGB')
+        return image.convert('RGB')
+
+class BatchedOpenCLIPEmbeddings(OpenCLIPEmbeddings):
+    """
+    OpenCLIPEmbeddings с пакетным вычислением векторов: тексты и изображения
+    проходят через модель мини-пакетами, изображения принимаются прямо из памяти.
+    Поддерживает режимы вывода на CPU: fp32, int8 (динамическое квантование
+    линейных слоев обеих башен) и bf16.
+    """
+
+    batch_size: int = 32
+    inference_mode: str = 'fp32'
+
+    def set_inference_mode(self, mode):
+        """
+        Переводит загруженную fp32-модель в режим вывода.
+
+        Параметры:
+        mode (str): 'fp32', 'int8' или 'bf16'.
+        """
+        if mode not in INFERENCE_MODES:
+            raise ValueError(f"Неизвестный режим вывода OpenCLIP: {mode}")
+        if self.inference_mode != 'fp32':
+            raise ValueError("Режим вывода задается один раз для fp32-модели")
+        if mode == 'int8':
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif mode == 'bf16':
+            self.model = self.model.to(torch.bfloat16)
+        self.model.eval()
+        self.inference_mode = mode
+        return self
+
+    def _input_dtype(self):
+        return torch.bfloat16 if self.inference_mode == 'bf16' else torch.float32
+
+    def _normalize(self, features):
+        features = features.float()
+        return (features / features.norm(dim=-1, keepdim=True)).tolist()
+
+    def embed_documents(self, texts):
+        """
+        Параметры:
+        texts (list): Список текстов.
+
+        Возвращает:
+        list: Нормированные векторы текстов.
+        """
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            tokens = self.tokenizer(texts[start:start + self.batch_size])
+            with torch.no_grad():
+                vectors.extend(self._normalize(self.model.encode_text(tokens)))
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def embed_pil_images(self, images):
+        """
+        Параметры:
+        images (list): Список изображений PIL.
+
+        Возвращает:
+        list: Нормированные векторы изображений.
+        """
+        vectors = []
+        for start in range(0, len(images), self.batch_size):
+            batch = torch.stack([
+                self.preprocess(image.convert('RGB'))
+                for image in images[start:start + self.batch_size]
+            ])
+            with torch.no_grad():
+                vectors.extend(self._normalize(self.model.encode_image(batch.to(self._input_dtype()))))
+        return vectors
+
+    def embed_image_bytes(self, datas):
+        """
+        Параметры:
+        datas (list): Закодированные файлы изображений (bytes).
+
+        Возвращает:
+        list: Нормированные векторы изображений.
+        """
+        return self.embed_pil_images([decode_image(data) for data in datas])
+
+    def embed_image(self, uris):
+        vectors = []
+        for start in range(0, len(uris), self.batch_size):
+            images = [Image.open(uri) for uri in uris[start:start + self.batch_size]]
+            vectors.extend(self.embed_pil_images(images))
+        return vectors
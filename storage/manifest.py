@@ -0,0 +1,221 @@
+import os
+import json
+import time
+from utils.helpers import file_sha256
+
+
+class IngestionManifest:
+    """
+    Манифест инкрементальной загрузки: для каждого исходного файла хранит
+    хеш содержимого, версию конвейера и идентификаторы документов в индексе.
+    """
+
+    def __init__(self, manifest_path, pipeline_version):
+        """
+        Параметры:
+        manifest_path (str): Путь к JSON-файлу манифеста.
+        pipeline_version (str): Версия конвейера обработки и моделей.
+        """
+        self.manifest_path = manifest_path
+        self.pipeline_version = pipeline_version
+        self.files = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                self.files = json.load(f).get('files', {})
+
+    def plan(self, paths):
+        """
+        Сравнивает текущий набор файлов с манифестом.
+
+        Параметры:
+        paths (list): Пути ко всем файлам корпуса.
+
+        Возвращает:
+        tuple: Словарь {путь: хеш} файлов для (пере)индексации и
+        список идентификаторов документов, которые нужно удалить из индекса.
+        Файлы, фрагменты которых были объединены с записями удаляемых
+        или неизвестных манифесту документов, тоже индексируются заново.
+        """
+        to_index = {}
+        stale_ids = []
+        current = {}
+
+        for path in paths:
+            key = os.path.abspath(path)
+            content_hash = file_sha256(path)
+            current[key] = (path, content_hash)
+            entry = self.files.get(key)
+            if (entry and entry['hash'] == content_hash
+                    and entry['version'] == self.pipeline_version):
+                continue
+            if entry:
+                stale_ids.extend(entry['doc_ids'])
+            to_index[path] = content_hash
+
+        for key in list(self.files):
+            if key not in current:
+                stale_ids.extend(self.files[key]['doc_ids'])
+
+        # Повторная индексация файла делает устаревшими и его записи, поэтому
+        # зависимые файлы ищутся, пока цепочка дубликатов не исчерпается
+        added = True
+        while added:
+            added = False
+            kept_ids = {
+                doc_id
+                for key, entry in self.files.items()
+                if key in current and current[key][0] not in to_index
+                for doc_id in entry['doc_ids']
+            }
+            for key, (path, content_hash) in current.items():
+                entry = self.files.get(key)
+                if path in to_index or not entry:
+                    continue
+                if any(doc_id not in kept_ids for doc_id in entry.get('shared_doc_ids', [])):
+                    stale_ids.extend(entry['doc_ids'])
+                    to_index[path] = content_hash
+                    added = True
+
+        return to_index, stale_ids
+
+    def record(self, path, content_hash, doc_ids, shared_doc_ids=()):
+        """
+        Запоминает результат индексации файла.
+
+        Параметры:
+        path (str): Путь к файлу.
+        content_hash (str): Хеш содержимого файла.
+        doc_ids (list): Идентификаторы документов, созданных для файла.
+        shared_doc_ids (list): Идентификаторы документов других файлов,
+        с которыми объединены дубликаты фрагментов файла.
+        """
+        self.files[os.path.abspath(path)] = {
+            'hash': content_hash,
+            'version': self.pipeline_version,
+            'doc_ids': list(doc_ids),
+            'shared_doc_ids': list(shared_doc_ids),
+        }
+
+    def prune(self, paths):
+        """
+        Удаляет из манифеста файлы, отсутствующие в корпусе.
+
+        Параметры:
+        paths (list): Пути ко всем файлам корпуса.
+        """
+        current = {os.path.abspath(path) for path in paths}
+        for key in list(self.files):
+            if key not in current:
+                del self.files[key]
+
+    def save(self):
+        """Атомарно сохраняет манифест на диск."""
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+# Версия формата индекса (увеличивается при несовместимых изменениях схемы хранения)
+INDEX_FORMAT_VERSION = 1
+
+class IndexManifest:
+    """
+    Манифест сохраненного индекса: формат, тип хранилища, модель встраивания,
+    коллекция, режимы вывода модели, в которых записаны векторы, и число
+    векторов и документов на момент последней записи.
+    По нему при запуске проверяется, что индекс на диске можно открыть
+    без повторной загрузки данных.
+    """
+
+    def __init__(self, manifest_path):
+        """
+        Параметры:
+        manifest_path (str): Путь к JSON-файлу манифеста индекса.
+        """
+        self.manifest_path = manifest_path
+        self.data = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+
+    @staticmethod
+    def describe(backend, embedding_model, checkpoint, collection):
+        """
+        Возвращает:
+        dict: Параметры, которые должны совпадать у индекса и текущей конфигурации.
+        """
+        return {
+            'format_version': INDEX_FORMAT_VERSION,
+            'backend': backend,
+            'embedding_model': embedding_model,
+            'checkpoint': checkpoint,
+            'collection': collection,
+        }
+
+    def check(self, expected):
+        """
+        Сравнивает манифест с текущей конфигурацией.
+
+        Параметры:
+        expected (dict): Результат describe для текущей конфигурации.
+
+        Возвращает:
+        list: Описания несовпадений (пустой список - индекс совместим).
+        """
+        if self.data is None:
+            return ['манифест индекса отсутствует']
+        return [
+            f"{key}: в индексе {self.data.get(key)!r}, в конфигурации {value!r}"
+            for key, value in expected.items()
+            if self.data.get(key) != value
+        ]
+
+    def inference_modes(self):
+        """
+        Возвращает:
+        list: Режимы вывода модели встраивания, в которых записаны векторы индекса.
+        """
+        if self.data is None:
+            return []
+        # Манифесты, записанные до появления режимов вывода, описывают индексы в fp32
+        return list(self.data.get('inference_modes', ['fp32']))
+
+    def check_inference_mode(self, inference_mode):
+        """
+        Проверяет, что векторы индекса записаны в текущем режиме вывода.
+        Векторы разных режимов сравнимы, но немного отличаются, поэтому
+        смешанный индекс не запрещен, а только отмечается.
+
+        Возвращает:
+        list: Описание несовпадения (пустой список - все векторы в текущем режиме).
+        """
+        modes = self.inference_modes()
+        if not modes or modes == [inference_mode]:
+            return []
+        return [f"inference_mode: векторы индекса записаны в режимах {modes!r}, в конфигурации {inference_mode!r}"]
+
+    def update(self, expected, vector_count, document_count, inference_mode=None):
+        """
+        Атомарно записывает манифест после изменения индекса. Манифест
+        несовместимого индекса не перезаписывается: иначе индекс, в котором
+        смешаны векторы разных моделей, выглядел бы совместимым.
+        Режим вывода добавляется к уже записанным.
+        """
+        if self.data is not None:
+            problems = self.check(expected)
+            if problems:
+                raise ValueError(f"Индекс несовместим с конфигурацией: {'; '.join(problems)}")
+        modes = self.inference_modes()
+        if inference_mode is not None and inference_mode not in modes:
+            modes.append(inference_mode)
+        self.data = dict(
+            expected,
+            inference_modes=modes,
+            vector_count=vector_count,
+            document_count=document_count,
+            updated_at=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        )
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.manifest_path)
@@ -0,0 +1,596 @@
+import os
+import json
+import sqlite3
+import threading
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from utils.helpers import acquire_write_lock
+
+# Число строк матрицы, обрабатываемых за один шаг точного поиска
+_SEARCH_BLOCK_ROWS = 65536
+# Число запросов пакета, обрабатываемых за один шаг: оценки шага занимают
+# не больше _SEARCH_BLOCK_QUERIES x _SEARCH_BLOCK_ROWS значений float32
+_SEARCH_BLOCK_QUERIES = 256
+
+def _top_k(rows, scores, k):
+    """Возвращает пары (строка, оценка) лучших k результатов по убыванию оценки."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(rows[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+class MemmapVectorStore(VectorStore):
+    """
+    Встроенный векторный индекс: векторы float16 хранятся в файле, отображаемом
+    в память (np.memmap), метаданные - в компактной таблице SQLite.
+    Поиск - точное скалярное произведение NumPy с выбором top-k, для больших
+    коллекций - необязательный режим IVF (грубое квантование k-means).
+    Несколько процессов могут открыть один индекс: страницы файла разделяются
+    через кеш ОС, копия в памяти каждого процесса не создается.
+    Запись допускается только из одного процесса (открытие на запись берет
+    блокировку файла). Удаленные строки только помечаются; compact() пишет
+    файлы без них как новое поколение индекса. Номера строк поколения хранятся
+    в своем столбце SQLite (четные поколения - row, нечетные - row_alt), поэтому
+    нумерация предыдущего поколения остается верной, пока читатели на него не перейдут.
+    """
+
+    def __init__(self, index_dir, embedding_function, dim=None, nprobe=8, read_only=False,
+                 compact_ratio=0.3, compact_min_rows=4096):
+        """
+        Параметры:
+        index_dir (str): Директория индекса.
+        embedding_function (Embeddings): Модель встраивания (OpenCLIP).
+        dim (int): Размерность векторов (определяется при первой записи).
+        nprobe (int): Число просматриваемых кластеров в режиме IVF.
+        read_only (bool): Открыть индекс только для чтения.
+        compact_ratio (float): Доля удаленных строк, при которой maybe_compact() уплотняет индекс.
+        compact_min_rows (int): Минимальное число удаленных строк для уплотнения.
+
+        Исключения:
+        BlockingIOError: Индекс уже открыт на запись другим процессом.
+        """
+        self.index_dir = index_dir
+        self._embedding_function = embedding_function
+        self.nprobe = nprobe
+        self.read_only = read_only
+        self.compact_ratio = compact_ratio
+        self.compact_min_rows = compact_min_rows
+        self._lock = threading.RLock()
+        self._header_path = os.path.join(index_dir, 'header.json')
+        self._header_mtime = None
+        self._vectors = None
+        self._alive = None
+        self._ivf = None
+        self._lock_fd = None
+
+        if not read_only:
+            os.makedirs(index_dir, exist_ok=True)
+            self._lock_fd = acquire_write_lock(os.path.join(index_dir, 'index.lock'))
+        self._conn = sqlite3.connect(
+            f"file:{os.path.join(index_dir, 'meta.sqlite')}{'?mode=ro' if read_only else ''}",
+            uri=True, check_same_thread=False,
+        )
+        if not read_only:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                "row INTEGER PRIMARY KEY, id TEXT UNIQUE, doc_id TEXT, metadata TEXT, document TEXT, row_alt INTEGER)"
+            )
+            columns = [name for _, name, *_ in self._conn.execute("PRAGMA table_info(items)")]
+            if 'row_alt' not in columns:
+                self._conn.execute("ALTER TABLE items ADD COLUMN row_alt INTEGER")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS items_doc_id ON items (doc_id)")
+            self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS items_row_alt ON items (row_alt)")
+            self._conn.commit()
+
+        self.header = {'dim': dim, 'count': 0, 'capacity': 0, 'ivf_count': 0, 'n_lists': 0, 'generation': 0}
+        self._refresh()
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    # --- Хранение -------------------------------------------------------
+
+    @staticmethod
+    def _row_column(generation):
+        """Столбец SQLite с номерами строк поколения."""
+        return 'row_alt' if generation % 2 else 'row'
+
+    def _generation_path(self, name, extension, generation):
+        # Файлы поколения 0 сохраняют имена, которые были до появления поколений
+        suffix = f'.{generation}' if generation else ''
+        return os.path.join(self.index_dir, f'{name}{suffix}.{extension}')
+
+    def _array_paths(self, generation):
+        return self._generation_path('vectors', 'f16', generation), self._generation_path('alive', 'u1', generation)
+
+    def _read_header(self):
+        with open(self._header_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _refresh(self):
+        """Перечитывает заголовок и отображения, если индекс изменил другой процесс."""
+        while os.path.exists(self._header_path):
+            mtime = os.stat(self._header_path).st_mtime_ns
+            if mtime == self._header_mtime:
+                return
+            self.header = self._read_header()
+            self.header.setdefault('generation', 0)
+            try:
+                self._open_arrays()
+                self._load_ivf()
+            except FileNotFoundError:
+                # Файлы прочитанного поколения уже удалены следующим уплотнением - читаем заголовок снова
+                if self._read_header().get('generation', 0) == self.header['generation']:
+                    raise
+                continue
+            self._header_mtime = mtime
+            return
+
+    def _open_arrays(self):
+        capacity, dim = self.header['capacity'], self.header['dim']
+        if not capacity:
+            self._vectors = self._alive = None
+            return
+        mode = 'r' if self.read_only else 'r+'
+        vectors_path, alive_path = self._array_paths(self.header['generation'])
+        self._vectors = np.memmap(vectors_path, dtype=np.float16, mode=mode, shape=(capacity, dim))
+        self._alive = np.memmap(alive_path, dtype=np.uint8, mode=mode, shape=(capacity,))
+
+    def _write_header(self):
+        tmp_path = self._header_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.header, f)
+        os.replace(tmp_path, self._header_path)
+        self._header_mtime = os.stat(self._header_path).st_mtime_ns
+
+    def _reserve(self, n_rows):
+        needed = self.header['count'] + n_rows
+        if needed <= self.header['capacity']:
+            return
+        capacity = max(needed, 2 * self.header['capacity'], 1024)
+        dim = self.header['dim']
+        self._vectors = self._alive = None
+        for path, row_bytes in zip(self._array_paths(self.header['generation']), (2 * dim, 1)):
+            with open(path, 'ab') as f:
+                f.truncate(capacity * row_bytes)
+        self.header['capacity'] = capacity
+        self._open_arrays()
+
+    def upsert(self, ids, embeddings, metadatas=None, documents=None):
+        """
+        Добавляет или заменяет векторы.
+
+        Параметры:
+        ids (list): Идентификаторы векторов.
+        embeddings (list): Векторы.
+        metadatas (list): Метаданные (должны содержать 'doc_id').
+        documents (list): Тексты документов.
+        """
+        if self.read_only:
+            raise PermissionError("Индекс открыт только для чтения")
+        if not ids:
+            return
+        metadatas = metadatas or [{} for _ in ids]
+        documents = documents or ['' for _ in ids]
+        vectors = np.asarray(embeddings, dtype=np.float32)
+
+        with self._lock:
+            self._refresh()
+            if self.header['dim'] is None:
+                self.header['dim'] = int(vectors.shape[1])
+            self._delete_where("id", ids)
+            self._reserve(len(ids))
+
+            first_row = self.header['count']
+            rows = range(first_row, first_row + len(ids))
+            self._vectors[first_row:first_row + len(ids)] = vectors.astype(np.float16)
+            self._alive[first_row:first_row + len(ids)] = 1
+            column = self._row_column(self.header['generation'])
+            self._conn.executemany(
+                f"INSERT INTO items ({column}, id, doc_id, metadata, document) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (row, id, metadata.get('doc_id'), json.dumps(metadata, ensure_ascii=False), document)
+                    for row, id, metadata, document in zip(rows, ids, metadatas, documents)
+                ],
+            )
+            self._conn.commit()
+            self._vectors.flush()
+            self._alive.flush()
+            self.header['count'] += len(ids)
+            self._write_header()
+
+    def _delete_where(self, column, values):
+        values = list(values)
+        rows = []
+        row_column = self._row_column(self.header['generation'])
+        for start in range(0, len(values), 500):
+            chunk = values[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows += [row for (row,) in self._conn.execute(
+                f"SELECT {row_column} FROM items WHERE {column} IN ({placeholders})", chunk
+            )]
+            self._conn.execute(f"DELETE FROM items WHERE {column} IN ({placeholders})", chunk)
+        if rows and self._alive is not None:
+            self._alive[rows] = 0
+        return len(rows)
+
+    def delete_documents(self, doc_ids):
+        """
+        Удаляет все векторы, относящиеся к указанным документам.
+        """
+        if self.read_only:
+            raise PermissionError("Индекс открыт только для чтения")
+        with self._lock:
+            self._refresh()
+            deleted = self._delete_where("doc_id", doc_ids)
+            self._conn.commit()
+            if self._alive is not None:
+                self._alive.flush()
+            self._write_header()
+            return deleted
+
+    def update_metadata(self, updates):
+        """
+        Дополняет метаданные всех векторов указанных документов.
+
+        Параметры:
+        updates (dict): Новые значения полей метаданных по идентификаторам документов.
+        """
+        if self.read_only:
+            raise PermissionError("Индекс открыт только для чтения")
+        with self._lock:
+            rows = [
+                (json.dumps({**json.loads(metadata), **fields}, ensure_ascii=False), row)
+                for doc_id, fields in updates.items()
+                for row, metadata in self._conn.execute(
+                    "SELECT row, metadata FROM items WHERE doc_id = ?", (doc_id,)
+                ).fetchall()
+            ]
+            self._conn.executemany("UPDATE items SET metadata = ? WHERE row = ?", rows)
+            self._conn.commit()
+
+    def delete(self, ids=None, **kwargs):
+        if self.read_only:
+            raise PermissionError("Индекс открыт только для чтения")
+        with self._lock:
+            self._refresh()
+            self._delete_where("id", ids or [])
+            self._conn.commit()
+            if self._alive is not None:
+                self._alive.flush()
+            self._write_header()
+        return True
+
+    def count(self):
+        """Возвращает число действующих векторов."""
+        return self._conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def dead_rows(self):
+        """Возвращает число удаленных строк, еще занимающих место в файле векторов."""
+        with self._lock:
+            self._refresh()
+            count = self.header['count']
+            return count - int(np.count_nonzero(self._alive[:count])) if count else 0
+
+    def maybe_compact(self):
+        """
+        Уплотняет индекс, если удаленных строк не меньше compact_min_rows
+        и их доля не меньше compact_ratio.
+
+        Возвращает:
+        int: Число освобожденных строк.
+        """
+        if self.read_only:
+            return 0
+        dead = self.dead_rows()
+        if dead >= self.compact_min_rows and dead >= self.header['count'] * self.compact_ratio:
+            return self.compact()
+        return 0
+
+    def compact(self):
+        """
+        Записывает векторы без удаленных строк как новое поколение индекса:
+        новые файлы, номера строк в столбце SQLite нового поколения и списки
+        IVF по новым номерам (без повторного обучения центроидов). Поколение
+        переключается записью заголовка; до этого момента читатели (в том
+        числе в других процессах) пользуются прежними файлами и нумерацией,
+        а поиск, заставший переключение, повторяется по новому поколению.
+        Сбой до записи заголовка оставляет прежнее поколение целым.
+
+        Возвращает:
+        int: Число освобожденных строк.
+        """
+        if self.read_only:
+            raise PermissionError("Индекс открыт только для чтения")
+        with self._lock:
+            self._refresh()
+            generation = self.header['generation']
+            count, dim = self.header['count'], self.header['dim']
+            if not count:
+                return 0
+            live = np.flatnonzero(np.asarray(self._alive[:count])).astype(np.int64)
+            removed = count - len(live)
+            if not removed:
+                return 0
+
+            next_generation = generation + 1
+            capacity = max(len(live), 1024)
+            vectors_path, alive_path = self._array_paths(next_generation)
+            vectors = np.memmap(vectors_path, dtype=np.float16, mode='w+', shape=(capacity, dim))
+            for start in range(0, len(live), _SEARCH_BLOCK_ROWS):
+                block = live[start:start + _SEARCH_BLOCK_ROWS]
+                vectors[start:start + len(block)] = self._vectors[block]
+            vectors.flush()
+            del vectors
+            alive = np.memmap(alive_path, dtype=np.uint8, mode='w+', shape=(capacity,))
+            alive[:len(live)] = 1
+            alive.flush()
+            del alive
+
+            self._renumber(generation, next_generation, live)
+
+            ivf_count = self.header['ivf_count']
+            if self._ivf is not None:
+                new_rows = np.full(count, -1, dtype=np.int64)
+                new_rows[live] = np.arange(len(live), dtype=np.int64)
+                order, offsets = np.asarray(self._ivf['order']), self._ivf['offsets']
+                lists = [new_rows[order[offsets[i]:offsets[i + 1]]] for i in range(self.header['n_lists'])]
+                lists = [rows[rows >= 0] for rows in lists]
+                offsets = np.concatenate([[0], np.cumsum([len(rows) for rows in lists])]).astype(np.int64)
+                self._save_ivf(self._ivf['centroids'], np.concatenate(lists), offsets, next_generation)
+                ivf_count = int(np.count_nonzero(live < ivf_count))
+
+            # Переключение поколения
+            self.header.update(generation=next_generation, count=len(live), capacity=capacity, ivf_count=ivf_count)
+            self._vectors = self._alive = None
+            self._write_header()
+            self._open_arrays()
+            self._load_ivf()
+            # Отображения прежнего поколения у идущих поисков остаются действительными после удаления файлов
+            for path in self._array_paths(generation) + self._ivf_paths(generation):
+                if os.path.exists(path):
+                    os.remove(path)
+            return removed
+
+    def _renumber(self, generation, next_generation, live):
+        """
+        Записывает номера строк нового поколения в его столбец, не трогая
+        столбец текущего поколения.
+        """
+        current, target = self._row_column(generation), self._row_column(next_generation)
+        mapping = [(new_row, int(old_row)) for new_row, old_row in enumerate(live)]
+        if target == 'row_alt':
+            self._conn.execute("UPDATE items SET row_alt = NULL")
+            self._conn.executemany(f"UPDATE items SET row_alt = ? WHERE {current} = ?", mapping)
+        else:
+            # row - первичный ключ и не бывает NULL: устаревшие значения сначала
+            # заменяются отрицательными, чтобы новые номера ни с чем не совпали
+            self._conn.executemany(
+                f"UPDATE items SET row = -1 - ? WHERE {current} = ?", mapping
+            )
+            self._conn.execute("UPDATE items SET row = -1 - row WHERE row < 0")
+        self._conn.commit()
+
+    def close(self):
+        """Закрывает соединение SQLite и снимает блокировку записи."""
+        with self._lock:
+            self._conn.close()
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    # --- IVF ------------------------------------------------------------
+
+    def build_ivf(self, n_lists, n_iter=10, sample_size=65536, seed=0):
+        """
+        Строит грубый квантизатор (k-means) для поиска по n_lists кластерам.
+        Векторы, добавленные после построения, просматриваются точным поиском
+        до следующего вызова build_ivf.
+
+        Параметры:
+        n_lists (int): Число кластеров.
+        n_iter (int): Число итераций k-means.
+        sample_size (int): Размер выборки для обучения центроидов.
+        seed (int): Начальное значение генератора случайных чисел.
+        """
+        with self._lock:
+            self._refresh()
+            count = self.header['count']
+            if count < n_lists:
+                return
+            rng = np.random.default_rng(seed)
+            sample = np.asarray(
+                self._vectors[np.sort(rng.choice(count, min(sample_size, count), replace=False))],
+                dtype=np.float32,
+            )
+            centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+            for _ in range(n_iter):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                for list_id in range(n_lists):
+                    members = sample[labels == list_id]
+                    if len(members):
+                        centroid = members.mean(axis=0)
+                        centroids[list_id] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+            labels = np.empty(count, dtype=np.int32)
+            for start in range(0, count, _SEARCH_BLOCK_ROWS):
+                block = np.asarray(self._vectors[start:start + _SEARCH_BLOCK_ROWS], dtype=np.float32)
+                labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+            order = np.argsort(labels, kind='stable').astype(np.int64)
+            offsets = np.searchsorted(labels[order], np.arange(n_lists + 1)).astype(np.int64)
+
+            self._save_ivf(centroids, order, offsets, self.header['generation'])
+            self.header['ivf_count'] = count
+            self.header['n_lists'] = n_lists
+            self._write_header()
+            self._load_ivf()
+
+    def _ivf_paths(self, generation):
+        return tuple(self._generation_path(name, 'npy', generation) for name in ('ivf_centroids', 'ivf_order', 'ivf_offsets'))
+
+    def _save_ivf(self, centroids, order, offsets, generation):
+        # Файлы могут быть отображены в память читателями - заменяем их атомарно
+        for path, array in zip(self._ivf_paths(generation), (centroids, order, offsets)):
+            tmp_path = path[:-len('.npy')] + '.tmp.npy'
+            np.save(tmp_path, array)
+            os.replace(tmp_path, path)
+
+    def _load_ivf(self):
+        self._ivf = None
+        if not self.header.get('n_lists'):
+            return
+        centroids, order, offsets = (
+            np.load(path, mmap_mode='r') for path in self._ivf_paths(self.header['generation'])
+        )
+        self._ivf = {'centroids': np.asarray(centroids), 'order': order, 'offsets': np.asarray(offsets)}
+
+    # --- Поиск ----------------------------------------------------------
+
+    def _snapshot(self):
+        """
+        Снимок индекса для поиска: заголовок и отображения фиксируются под
+        блокировкой, сам просмотр матрицы идет без нее, поэтому поиски из
+        разных потоков выполняются параллельно.
+
+        Возвращает:
+        tuple: Векторы, признаки живых строк, IVF, число строк, число строк в IVF и поколение.
+        """
+        with self._lock:
+            self._refresh()
+            return (self._vectors, self._alive, self._ivf, self.header['count'],
+                    self.header['ivf_count'], self.header['generation'])
+
+    def _candidate_rows(self, query, ivf, ivf_count, count):
+        """Возвращает набор строк для просмотра (None - все строки)."""
+        if ivf is None:
+            return None
+        centroids, order, offsets = ivf['centroids'], ivf['order'], ivf['offsets']
+        probe = np.argsort(-(centroids @ query))[:self.nprobe]
+        rows = [np.asarray(order[offsets[list_id]:offsets[list_id + 1]]) for list_id in probe]
+        tail = np.arange(ivf_count, count, dtype=np.int64)
+        return np.sort(np.concatenate(rows + [tail]))
+
+    def search_vectors(self, queries, k, snapshot=None):
+        """
+        Векторизованный поиск top-k для пакета запросов. Запросы обрабатываются
+        блоками по _SEARCH_BLOCK_QUERIES; в режиме IVF каждый запрос просматривает
+        только строки своих кластеров, при точном поиске матрица читается блоками
+        строк, а для каждого запроса хранятся только текущие лучшие k результатов.
+
+        Параметры:
+        queries (array): Матрица запросов (n, dim).
+        k (int): Число результатов на запрос.
+        snapshot (tuple): Снимок индекса (по умолчанию - текущий); номера строк
+        действительны только в поколении снимка.
+
+        Возвращает:
+        list: Для каждого запроса - список пар (номер строки, оценка) по убыванию оценки.
+        """
+        vectors, alive, ivf, count, ivf_count, _ = snapshot or self._snapshot()
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if not count or k <= 0:
+            return [[] for _ in queries]
+        results = []
+        for start in range(0, len(queries), _SEARCH_BLOCK_QUERIES):
+            block = queries[start:start + _SEARCH_BLOCK_QUERIES]
+            if ivf is not None:
+                for query in block:
+                    rows = self._candidate_rows(query, ivf, ivf_count, count)
+                    scores = np.asarray(vectors[rows], dtype=np.float32) @ query
+                    scores[np.asarray(alive[rows]) == 0] = -np.inf
+                    results.append(_top_k(rows, scores, k))
+            else:
+                results.extend(self._search_exact(block, k, vectors, alive, count))
+        return results
+
+    @staticmethod
+    def _search_exact(queries, k, vectors, alive, count):
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, count, _SEARCH_BLOCK_ROWS):
+            block = np.asarray(vectors[start:min(start + _SEARCH_BLOCK_ROWS, count)], dtype=np.float32)
+            block_scores = queries @ block.T
+            block_scores[:, np.asarray(alive[start:start + len(block)]) == 0] = -np.inf
+            block_rows = np.broadcast_to(np.arange(start, start + len(block), dtype=np.int64), block_scores.shape)
+            # Текущие лучшие k каждого запроса объединяются с оценками нового блока строк
+            scores = np.concatenate([best_scores, block_scores], axis=1)
+            rows = np.concatenate([best_rows, block_rows], axis=1)
+            if scores.shape[1] > k:
+                keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                rows = np.take_along_axis(rows, keep, axis=1)
+            best_scores, best_rows = scores, rows
+        return [_top_k(rows, scores, k) for rows, scores in zip(best_rows, best_scores)]
+
+    def _documents_for_rows(self, hits, generation):
+        if not hits:
+            return []
+        column = self._row_column(generation)
+        placeholders = ','.join('?' * len(hits))
+        found = {
+            row: (metadata, document)
+            for row, metadata, document in self._conn.execute(
+                f"SELECT {column}, metadata, document FROM items WHERE {column} IN ({placeholders})",
+                [row for row, _ in hits],
+            )
+        }
+        return [
+            (Document(page_content=found[row][1], metadata=json.loads(found[row][0])), score)
+            for row, score in hits if row in found
+        ]
+
+    def _search_documents(self, embeddings, k):
+        """
+        Поиск с сопоставлением строк документам. Номера строк действительны
+        только в поколении снимка: если поколение сменилось до окончания чтения
+        SQLite (уплотнение в этом или другом процессе), поиск повторяется.
+        """
+        while True:
+            snapshot = self._snapshot()
+            generation = snapshot[-1]
+            hits = self.search_vectors(embeddings, k, snapshot)
+            results = [self._documents_for_rows(query_hits, generation) for query_hits in hits]
+            if not any(hits) or self._read_header().get('generation', 0) == generation:
+                return results
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4):
+        return self._search_documents([embedding], k)[0]
+
+    def similarity_search_by_vectors(self, embeddings, k=4):
+        """
+        Пакетный поиск: один векторизованный проход по матрице для всех запросов.
+
+        Возвращает:
+        list: Для каждого запроса - список документов по убыванию оценки.
+        """
+        return [[doc for doc, _ in results] for results in self._search_documents(embeddings, k)]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_score(self._embedding_function.embed_query(query), k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def similarity_search_by_image(self, uri, k=4, **kwargs):
+        embedding = self._embedding_function.embed_image([uri])[0]
+        return self.similarity_search_by_vector(embedding, k)
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        import uuid
+        texts = list(texts)
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        self.upsert(ids, self._embedding_function.embed_documents(texts), metadatas, texts)
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, index_dir=None, **kwargs):
+        store = cls(index_dir, embedding)
+        store.add_texts(texts, metadatas)
+        return store
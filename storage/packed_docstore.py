@@ -0,0 +1,227 @@
+import os
+import re
+import struct
+import threading
+from langchain_core.stores import BaseStore
+from utils.helpers import acquire_write_lock
+
+# Заголовок записи журнала: операция, длина ключа, длина значения
+_HEADER = struct.Struct('<BII')
+_PUT, _DELETE = 1, 0
+LOG_NAME = 'docstore.log'
+LOCK_NAME = 'docstore.lock'
+# Ключи LocalFileStore - идентификаторы документов uuid4, по файлу на ключ в корне директории
+_FILE_KEY = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+class PackedDocStore(BaseStore[str, bytes]):
+    """
+    Хранилище документов в одном файле-журнале (только дозапись) с индексом
+    смещений в памяти. Интерфейс совпадает с LocalFileStore (mset / mget /
+    mdelete / yield_keys), но вместо файла на каждый ключ все значения
+    лежат в одном файле и читаются через pread без открытия файлов.
+    Журнал периодически уплотняется: живые записи переписываются в новый файл.
+    Запись допускается только из одного процесса (открытие на запись берет
+    блокировку файла); читатели в других процессах подхватывают дописанные
+    записи и замену файла после уплотнения.
+    """
+
+    def __init__(self, directory, compact_ratio=0.5, compact_min_bytes=16 << 20, fsync=False, read_only=False):
+        """
+        Параметры:
+        directory (str): Директория хранилища.
+        compact_ratio (float): Доля устаревших данных, при которой журнал уплотняется.
+        compact_min_bytes (int): Минимальный объем устаревших данных для уплотнения.
+        fsync (bool): Вызывать fsync после каждой пакетной записи.
+        read_only (bool): Открыть существующий журнал только для чтения.
+
+        Исключения:
+        BlockingIOError: Хранилище уже открыто на запись другим процессом.
+        """
+        self._lock_fd = None
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+            self._lock_fd = acquire_write_lock(os.path.join(directory, LOCK_NAME))
+        self.read_only = read_only
+        self.directory = directory
+        self.path = os.path.join(directory, LOG_NAME)
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        self._fd = None
+        self._open()
+
+    # --- Журнал ---------------------------------------------------------
+
+    def _open(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        flags = os.O_RDONLY if self.read_only else os.O_RDWR | os.O_CREAT
+        self._fd = os.open(self.path, flags, 0o644)
+        self._index = {}
+        self._scanned = 0
+        self._dead_bytes = 0
+        self._scan()
+
+    def _scan(self):
+        """Дочитывает журнал с последней просмотренной позиции."""
+        size = os.fstat(self._fd).st_size
+        offset = self._scanned
+        while offset + _HEADER.size <= size:
+            op, key_len, value_len = _HEADER.unpack(os.pread(self._fd, _HEADER.size, offset))
+            end = offset + _HEADER.size + key_len + value_len
+            if end > size:
+                break
+            key = os.pread(self._fd, key_len, offset + _HEADER.size).decode('utf-8')
+            previous = self._index.pop(key, None)
+            if previous is not None:
+                self._dead_bytes += _HEADER.size + len(key.encode('utf-8')) + previous[1]
+            if op == _PUT:
+                self._index[key] = (offset + _HEADER.size + key_len, value_len)
+            else:
+                self._dead_bytes += end - offset
+            offset = end
+        self._scanned = offset
+
+    def _sync(self):
+        """Подхватывает изменения, сделанные другим процессом."""
+        try:
+            replaced = os.stat(self.path).st_ino != os.fstat(self._fd).st_ino
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            self._open()
+        elif os.fstat(self._fd).st_size > self._scanned:
+            self._scan()
+
+    def _check_writable(self):
+        if self.read_only:
+            raise PermissionError("Хранилище документов открыто только для чтения")
+
+    def _append(self, records):
+        self._check_writable()
+        size = os.fstat(self._fd).st_size
+        if size > self._scanned:
+            # Отбрасываем недописанный хвост (например, после аварийного завершения)
+            os.ftruncate(self._fd, self._scanned)
+        os.pwrite(self._fd, b''.join(records), self._scanned)
+        if self.fsync:
+            os.fsync(self._fd)
+        self._scan()
+
+    @staticmethod
+    def _record(op, key, value=b''):
+        key = key.encode('utf-8')
+        return _HEADER.pack(op, len(key), len(value)) + key + value
+
+    # --- Интерфейс BaseStore -------------------------------------------
+
+    def mget(self, keys):
+        with self._lock:
+            self._sync()
+            values = []
+            for key in keys:
+                location = self._index.get(key)
+                values.append(None if location is None else os.pread(self._fd, location[1], location[0]))
+            return values
+
+    def mset(self, key_value_pairs):
+        with self._lock:
+            self._sync()
+            records = [self._record(_PUT, key, bytes(value)) for key, value in key_value_pairs]
+            if records:
+                self._append(records)
+                self._maybe_compact()
+
+    def mdelete(self, keys):
+        with self._lock:
+            self._sync()
+            records = [self._record(_DELETE, key) for key in keys if key in self._index]
+            if records:
+                self._append(records)
+                self._maybe_compact()
+
+    def yield_keys(self, prefix=None):
+        with self._lock:
+            self._sync()
+            keys = list(self._index)
+        for key in keys:
+            if prefix is None or key.startswith(prefix):
+                yield key
+
+    # --- Уплотнение -----------------------------------------------------
+
+    def _maybe_compact(self):
+        size = self._scanned
+        if self._dead_bytes >= self.compact_min_bytes and self._dead_bytes >= size * self.compact_ratio:
+            self.compact()
+
+    def compact(self):
+        """
+        Переписывает живые записи в новый журнал и атомарно заменяет им старый.
+        """
+        self._check_writable()
+        with self._lock:
+            self._sync()
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                for key, (offset, length) in self._index.items():
+                    f.write(self._record(_PUT, key, os.pread(self._fd, length, offset)))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._open()
+
+    def stats(self):
+        """
+        Возвращает:
+        dict: Число ключей, размер журнала и объем устаревших данных.
+        """
+        with self._lock:
+            return {'keys': len(self._index), 'bytes': self._scanned, 'dead_bytes': self._dead_bytes}
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    # --- Перенос из LocalFileStore --------------------------------------
+
+    def import_files(self, remove=True, batch_size=1024):
+        """
+        Переносит в журнал значения, сохраненные LocalFileStore
+        (по файлу на ключ) в той же директории. Переносятся только файлы
+        с именами-идентификаторами документов; остальные файлы
+        (например, .DS_Store) не трогаются.
+
+        Параметры:
+        remove (bool): Удалить перенесенные файлы.
+        batch_size (int): Число ключей в одной пакетной записи.
+
+        Возвращает:
+        int: Число перенесенных ключей.
+        """
+        self._check_writable()
+        paths = [
+            entry.path for entry in os.scandir(self.directory)
+            if entry.is_file() and _FILE_KEY.match(entry.name)
+        ]
+
+        for start in range(0, len(paths), batch_size):
+            batch = paths[start:start + batch_size]
+            pairs = []
+            for path in batch:
+                with open(path, 'rb') as f:
+                    pairs.append((os.path.basename(path), f.read()))
+            with self._lock:
+                self._sync()
+                self._append([self._record(_PUT, key, value) for key, value in pairs])
+                os.fsync(self._fd)
+            if remove:
+                for path in batch:
+                    os.unlink(path)
+        return len(paths)
@@ -1,12 +1,50 @@
+import io
+import os
+import time
 import uuid
+import base64
 import chromadb
-from chromadb.utils.embedding_functions import OpenCLIPEmbeddingFunction
 from chromadb.utils.data_loaders import ImageLoader
 from langchain.storage import LocalFileStore
 from langchain_community.vectorstores import Chroma
-from langchain_experimental.open_clip.open_clip import OpenCLIPEmbeddings
 from langchain.retrievers.multi_vector import MultiVectorRetriever
 from langchain_core.documents import Document
+from config import (
+    EMBED_BATCH_SIZE, CLIP_INFERENCE_MODE, CLIP_NUM_THREADS, CLIP_INTEROP_THREADS, EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_BYTES, VECTOR_BACKEND, MMAP_INDEX_PATH, MMAP_IVF_NPROBE,
+    MMAP_COMPACT_RATIO, MMAP_COMPACT_MIN_ROWS,
+    DOCSTORE_BACKEND, DOCSTORE_COMPACT_RATIO, DOCSTORE_COMPACT_MIN_BYTES,
+)
+from storage.embeddings import BatchedOpenCLIPEmbeddings, tune_threads
+from storage.embedding_cache import EmbeddingCache, CachedEmbeddings
+from storage.mmap_index import MemmapVectorStore
+from storage.packed_docstore import PackedDocStore, LOG_NAME
+from storage.manifest import IndexManifest
+from utils.model_registry import registry
+from utils.tracing import tracer
+
+CLIP_MODEL_NAME = "ViT-B-32"
+CLIP_CHECKPOINT = "laion2b_s34b_b79k"
+COLLECTION_NAME = "mm_rag"
+
+def load_clip_model(inference_mode=CLIP_INFERENCE_MODE):
+    """
+    Загружает OpenCLIP в заданном режиме вывода (без кеша встраиваний).
+    """
+    tune_threads(CLIP_NUM_THREADS, CLIP_INTEROP_THREADS)
+    embeddings = BatchedOpenCLIPEmbeddings(
+        model_name=CLIP_MODEL_NAME, 
+        checkpoint=CLIP_CHECKPOINT,
+        batch_size=EMBED_BATCH_SIZE
+    )
+    return embeddings.set_inference_mode(inference_mode)
+
+def _load_clip():
+    embeddings = load_clip_model()
+    if EMBEDDING_CACHE_ENABLED:
+        embeddings = CachedEmbeddings(embeddings, EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_BYTES))
+    return embeddings
+
+registry.register('clip', _load_clip)
 
 def initialize_chroma_client(db_path):
     """
@@ -19,105 +57,372 @@ def initialize_chroma_client(db_path):
     chromadb.Client: Клиент Chroma DB.
     """
     client = chromadb.PersistentClient(path=db_path)
-    embedding_function = OpenCLIPEmbeddingFunction()
     image_loader = ImageLoader()
     
-    collection = client.create_collection(
+    # Векторы вычисляются общей моделью OpenCLIP из реестра,
+    # поэтому отдельная функция встраивания коллекции не создается
+    collection = client.get_or_create_collection(
         name='multimodal_collection2',
-        embedding_function=embedding_function,
+        embedding_function=None,
         data_loader=image_loader
     )
     return client
 
-def build_vectorstore(persist_directory):
+def build_vectorstore(persist_directory, backend=VECTOR_BACKEND, read_only=False):
     """
-    Создает векторное хранилище Chroma с функцией встраивания OpenCLIP.
+    Создает векторное хранилище с функцией встраивания OpenCLIP.
     
     Параметры:
-    persist_directory (str): Директория для сохранения данных.
+    persist_directory (str): Директория для сохранения данных Chroma.
+    backend (str): 'chroma' или 'mmap' (встроенный индекс в MMAP_INDEX_PATH).
+    read_only (bool): Открыть индекс только для чтения (Chroma открывается
+    обычным клиентом, запись в нее просто не выполняется).
     
     Возвращает:
-    Chroma: Объект векторного хранилища.
+    Chroma | MemmapVectorStore: Объект векторного хранилища.
     """
+    if backend == 'mmap':
+        return MemmapVectorStore(
+            MMAP_INDEX_PATH, registry.get('clip'), nprobe=MMAP_IVF_NPROBE, read_only=read_only,
+            compact_ratio=MMAP_COMPACT_RATIO, compact_min_rows=MMAP_COMPACT_MIN_ROWS,
+        )
+    if backend != 'chroma':
+        raise ValueError(f"Неизвестный тип векторного хранилища: {backend}")
+
     vectorstore = Chroma(
-        collection_name="mm_rag",
-        embedding_function=OpenCLIPEmbeddings(
-            model_name="ViT-B-32", 
-            checkpoint="laion2b_s34b_b79k"
-        ),
+        collection_name=COLLECTION_NAME,
+        embedding_function=registry.get('clip'),
         persist_directory=persist_directory
     )
     vectorstore._collection._data_loader = ImageLoader()
     return vectorstore
 
-def build_retriever(vectorstore, docstore, content_storage):
+def build_docstore(path, backend=DOCSTORE_BACKEND, read_only=False):
     """
-    Создает многофакторный ретривер для поиска по разнотипному контенту.
+    Создает хранилище документов для MultiVectorRetriever.
+    
+    Параметры:
+    path (str): Директория хранилища.
+    backend (str): 'packed' (один файл-журнал) или 'files' (LocalFileStore, файл на ключ).
+    Файлы, оставшиеся от LocalFileStore, переносятся в журнал один раз - при
+    создании журнала.
+    read_only (bool): Открыть существующее хранилище только для чтения.
+    
+    Возвращает:
+    PackedDocStore | LocalFileStore: Хранилище документов.
+    """
+    if backend == 'files':
+        return LocalFileStore(path)
+    if backend != 'packed':
+        raise ValueError(f"Неизвестный тип хранилища документов: {backend}")
+
+    migrate = not read_only and not os.path.exists(os.path.join(path, LOG_NAME))
+    docstore = PackedDocStore(
+        path,
+        compact_ratio=DOCSTORE_COMPACT_RATIO,
+        compact_min_bytes=DOCSTORE_COMPACT_MIN_BYTES,
+        read_only=read_only,
+    )
+    if not migrate:
+        return docstore
+    imported = docstore.import_files()
+    if imported:
+        print(f"Хранилище документов: перенесено {imported} записей из LocalFileStore")
+    return docstore
+
+def count_vectors(vectorstore):
+    """Возвращает число векторов в хранилище."""
+    if isinstance(vectorstore, MemmapVectorStore):
+        return vectorstore.count()
+    return vectorstore._collection.count()
+
+def count_documents(docstore):
+    """Возвращает число записей в хранилище документов."""
+    if isinstance(docstore, PackedDocStore):
+        return docstore.stats()['keys']
+    return sum(1 for _ in docstore.yield_keys())
+
+def describe_index(backend=VECTOR_BACKEND):
+    """
+    Возвращает:
+    dict: Параметры индекса для текущей конфигурации (для IndexManifest).
+    """
+    collection = MMAP_INDEX_PATH if backend == 'mmap' else COLLECTION_NAME
+    return IndexManifest.describe(backend, CLIP_MODEL_NAME, CLIP_CHECKPOINT, collection)
+
+def save_index_manifest(manifest_path, vectorstore, docstore, backend=VECTOR_BACKEND):
+    """
+    Записывает манифест индекса с текущим числом векторов и документов.
+    """
+    IndexManifest(manifest_path).update(
+        describe_index(backend), count_vectors(vectorstore), count_documents(docstore), CLIP_INFERENCE_MODE
+    )
+
+def open_index(persist_directory, docstore_path, manifest_path, backend=VECTOR_BACKEND, read_only=False):
+    """
+    Открывает сохраненный индекс без повторной загрузки данных: сверяет
+    манифест с текущей конфигурацией (формат, модель встраивания, коллекция)
+    и число векторов и документов с записанным в манифесте. Векторы
+    в другом режиме вывода CLIP не мешают открытию, но попадают в список проблем.
+    
+    Параметры:
+    persist_directory (str): Директория данных Chroma.
+    docstore_path (str): Директория хранилища документов.
+    manifest_path (str): Путь к манифесту индекса.
+    backend (str): Тип векторного хранилища.
+    read_only (bool): Открыть индекс только для чтения.
+    
+    Возвращает:
+    tuple: Ретривер (None, если индекс несовместим) и сведения об индексе:
+    число векторов и документов, время открытия, список проблем и признак
+    открытия только для чтения (индекс, который уже пополняет другой процесс,
+    открывается только для чтения).
+    """
+    started_at = time.perf_counter()
+    manifest = IndexManifest(manifest_path)
+    problems = manifest.check(describe_index(backend))
+    if (manifest.data is not None and problems) or (manifest.data is None and read_only):
+        # Индекс построен другой моделью или в другом формате - открывать его нельзя;
+        # без манифеста нет и гарантии, что индекс вообще существует
+        return None, {'problems': problems, 'vector_count': 0, 'document_count': 0, 'read_only': True,
+                      'open_seconds': time.perf_counter() - started_at}
+
+    try:
+        docstore = build_docstore(docstore_path, read_only=read_only)
+        try:
+            vectorstore = build_vectorstore(persist_directory, backend, read_only=read_only)
+        except BlockingIOError:
+            docstore.close()
+            raise
+    except BlockingIOError as e:
+        # Индекс уже пополняет другой процесс (например, main.py) - дописывать в него нельзя
+        problems.append(f"{e}: индекс открыт только для чтения")
+        read_only = True
+        docstore = build_docstore(docstore_path, read_only=True)
+        vectorstore = build_vectorstore(persist_directory, backend, read_only=True)
+    info = {
+        'vector_count': count_vectors(vectorstore),
+        'document_count': count_documents(docstore),
+        'problems': problems,
+        'read_only': read_only,
+    }
+    if manifest.data is not None:
+        for key in ('vector_count', 'document_count'):
+            if manifest.data.get(key) != info[key]:
+                # Например, загрузка была прервана: индекс пригоден, но манифест устарел
+                info['problems'].append(f"{key}: в манифесте {manifest.data.get(key)}, в индексе {info[key]}")
+        info['problems'] += manifest.check_inference_mode(CLIP_INFERENCE_MODE)
+    info['open_seconds'] = time.perf_counter() - started_at
+    return create_retriever(vectorstore, docstore), info
+
+def create_retriever(vectorstore, docstore):
+    """
+    Создает многофакторный ретривер поверх векторного хранилища и хранилища документов.
     
     Параметры:
     vectorstore (Chroma): Векторное хранилище.
-    docstore (LocalFileStore): Хранилище документов.
-    content_storage (list): Список обработанных элементов контента.
+    docstore (PackedDocStore): Хранилище документов.
     
     Возвращает:
     MultiVectorRetriever: Сконфигурированный ретривер.
     """
     id_key = "doc_id"
-    retriever = MultiVectorRetriever(
+    return MultiVectorRetriever(
         vectorstore=vectorstore,
         docstore=docstore,
         id_key=id_key,
     )
 
-    def store_document(retriever, item_type, elem, summary_text, ids, start, end, path):
-        """
-        Добавляет документ и его метаданные в ретривер.
-        
-        Параметры:
-        retriever (MultiVectorRetriever): Ретривер для добавления данных.
-        item_type (str): Тип элемента (pdf, image).
-        elem: Содержимое элемента.
-        summary_text (str): Текстовое описание/резюме.
-        ids (str): Уникальный идентификатор документа.
-        start (float): Временная метка начала (0 для статичных элементов).
-        end (float): Временная метка окончания (0 для статичных элементов).
-        path (str): Исходный путь к файлу.
-        """
-        if not isinstance(summary_text, str):
-            summary_text = summary_text[1]
-            
-        if item_type == 'image':
-            id = str(uuid.uuid4())
-            elem.save("cur_file.jpeg")
-            retriever.vectorstore.add_images(
-                ['cur_file.jpeg'], 
-                [{'id_key': id, 'start': start, 'end': end, 'path': path}], 
-                [ids,]
-            )
-            id = str(uuid.uuid4())
-            retriever.vectorstore.add_documents([
-                Document(page_content=summary_text, metadata={'id_key': id, 'start': start, 'end': end, 'path': path})
-            ])
-        else:
-            id = str(uuid.uuid4())
-            retriever.vectorstore.add_documents([
-                Document(page_content=summary_text, metadata={'id_key': id, 'start': start, 'end': end, 'path': path})
-            ])
-            
-        retriever.docstore.mset([(ids, bytearray(summary_text,'utf-8'))])
-
-    doc_ids = [str(uuid.uuid4()) for _ in content_storage]
-    for id, doc in zip(doc_ids, content_storage):
-        path = doc['path'] if 'path' in doc else doc['metadata']['path']
-        store_document(
-            retriever, 
-            doc['type'], 
-            doc['elem'], 
-            doc['sum'], 
-            id, 
-            doc['metadata']['start'], 
-            doc['metadata']['end'], 
-            path
+def build_retriever(vectorstore, docstore, content_storage):
+    """
+    Создает многофакторный ретривер для поиска по разнотипному контенту.
+    
+    Параметры:
+    vectorstore (Chroma): Векторное хранилище.
+    docstore (PackedDocStore): Хранилище документов.
+    content_storage (list): Список записей ContentRecord.
+    Каждой записи проставляется doc_id с идентификатором в индексе.
+    
+    Возвращает:
+    MultiVectorRetriever: Сконфигурированный ретривер.
+    """
+    retriever = create_retriever(vectorstore, docstore)
+    index_documents(vectorstore, docstore, content_storage)
+
+    return retriever
+
+def _image_to_base64(image):
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, format='JPEG')
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+def embed_batch(embeddings, batch):
+    """
+    Вычисляет векторы для пакета записей контента: по одному вектору резюме
+    на запись и дополнительно вектор самого изображения для изображений.
+    Пиксели изображений загружаются только на время обработки пакета.
+    Каждой записи проставляется doc_id.
+    
+    Параметры:
+    embeddings (BatchedOpenCLIPEmbeddings | CachedEmbeddings): Модель встраивания.
+    batch (list): Пакет записей ContentRecord.
+    
+    Возвращает:
+    dict: Подготовленные к записи идентификаторы, векторы, метаданные,
+    документы и записи хранилища документов.
+    """
+    for record in batch:
+        if record.doc_id is None:
+            record.doc_id = str(uuid.uuid4())
+
+    ids, vectors, metadatas, documents = [], [], [], []
+    for record in batch:
+        ids.append(str(uuid.uuid4()))
+        metadatas.append({'id_key': ids[-1], 'doc_id': record.doc_id, **record.metadata()})
+        documents.append(record.summary)
+    with tracer.span('embed.texts', items=len(batch)):
+        vectors.extend(embeddings.embed_documents([record.summary for record in batch]))
+
+    image_records = [record for record in batch if record.type == 'image']
+    if image_records:
+        images = [record.load_image() for record in image_records]
+        with tracer.span('embed.images', items=len(images)):
+            vectors.extend(embeddings.embed_pil_images(images))
+        for record, image in zip(image_records, images):
+            ids.append(record.doc_id)
+            metadatas.append({'id_key': str(uuid.uuid4()), 'doc_id': record.doc_id, **record.metadata()})
+            documents.append(_image_to_base64(image))
+
+    return {
+        'ids': ids,
+        'embeddings': vectors,
+        'metadatas': metadatas,
+        'documents': documents,
+        'docstore': [
+            (record.doc_id, bytearray(record.summary, 'utf-8'))
+            for record in batch
+        ],
+    }
+
+def write_batch(vectorstore, docstore, prepared):
+    """
+    Записывает подготовленный функцией embed_batch пакет в векторное хранилище
+    и хранилище документов одной операцией на каждое хранилище.
+    """
+    target = vectorstore if isinstance(vectorstore, MemmapVectorStore) else vectorstore._collection
+    with tracer.span('index.write', vectors=len(prepared['ids']), documents=len(prepared['docstore'])):
+        target.upsert(
+            ids=prepared['ids'],
+            embeddings=prepared['embeddings'],
+            metadatas=prepared['metadatas'],
+            documents=prepared['documents'],
         )
+        docstore.mset(prepared['docstore'])
+
+def index_documents(vectorstore, docstore, content_storage, batch_size=EMBED_BATCH_SIZE):
+    """
+    Пакетно индексирует записи контента: векторы резюме и изображений
+    вычисляются мини-пакетами и записываются в Chroma
+    и хранилище документов одной операцией на пакет.
+    
+    Параметры:
+    vectorstore (Chroma): Векторное хранилище.
+    docstore (PackedDocStore): Хранилище документов.
+    content_storage (list): Список записей ContentRecord.
+    Каждой записи проставляется doc_id с идентификатором в индексе.
+    batch_size (int): Размер мини-пакета.
+    
+    Возвращает:
+    list: Идентификаторы документов.
+    """
+    embeddings = vectorstore._embedding_function
+    started_at = time.perf_counter()
+
+    for start in range(0, len(content_storage), batch_size):
+        batch = content_storage[start:start + batch_size]
+        write_batch(vectorstore, docstore, embed_batch(embeddings, batch))
+
+    elapsed = time.perf_counter() - started_at
+    if content_storage:
+        print(f"Индексация: {len(content_storage)} элементов за {elapsed:.1f} с "
+              f"({len(content_storage) / elapsed:.2f} элем./с)")
+    return [record.doc_id for record in content_storage]
 
-    return retriever
\ No newline at end of file
+def search_by_vectors(vectorstore, embeddings, k):
+    """
+    Ищет ближайшие документы сразу для пакета векторов запросов
+    одним обращением к индексу.
+    
+    Параметры:
+    vectorstore (Chroma | MemmapVectorStore): Векторное хранилище.
+    embeddings (list): Векторы запросов.
+    k (int): Число результатов на запрос.
+    
+    Возвращает:
+    list: Для каждого запроса - список документов по убыванию релевантности.
+    """
+    if not embeddings:
+        return []
+    if isinstance(vectorstore, MemmapVectorStore):
+        return vectorstore.similarity_search_by_vectors(embeddings, k)
+    results = vectorstore._collection.query(
+        query_embeddings=[list(embedding) for embedding in embeddings],
+        n_results=k,
+        include=['documents', 'metadatas'],
+    )
+    return [
+        [Document(page_content=document, metadata=metadata or {}) for document, metadata in zip(documents, metadatas)]
+        for documents, metadatas in zip(results['documents'], results['metadatas'])
+    ]
+
+def compact_index(vectorstore):
+    """
+    Уплотняет встроенный индекс, если в нем накопилось много удаленных строк
+    (Chroma освобождает место сама).
+    
+    Параметры:
+    vectorstore (Chroma | MemmapVectorStore): Векторное хранилище.
+    """
+    if isinstance(vectorstore, MemmapVectorStore) and not vectorstore.read_only:
+        with tracer.span('index.compact') as span:
+            span.set(removed_rows=vectorstore.maybe_compact())
+
+def update_metadata(vectorstore, updates):
+    """
+    Дополняет метаданные уже записанных векторов документов.
+
+    Параметры:
+    vectorstore (Chroma | MemmapVectorStore): Векторное хранилище.
+    updates (dict): Новые значения полей метаданных по идентификаторам документов.
+    """
+    if not updates:
+        return
+    if isinstance(vectorstore, MemmapVectorStore):
+        vectorstore.update_metadata(updates)
+        return
+    collection = vectorstore._collection
+    for doc_id, fields in updates.items():
+        found = collection.get(where={"doc_id": doc_id}, include=['metadatas'])
+        if found['ids']:
+            collection.update(
+                ids=found['ids'],
+                metadatas=[{**(metadata or {}), **fields} for metadata in found['metadatas']],
+            )
+
+def remove_documents(vectorstore, docstore, doc_ids):
+    """
+    Удаляет из индекса все векторы и записи хранилища документов,
+    относящиеся к указанным документам.
+    
+    Параметры:
+    vectorstore (Chroma): Векторное хранилище.
+    docstore (PackedDocStore): Хранилище документов.
+    doc_ids (list): Идентификаторы документов.
+    """
+    if not doc_ids:
+        return
+    if isinstance(vectorstore, MemmapVectorStore):
+        vectorstore.delete_documents(doc_ids)
+    else:
+        vectorstore._collection.delete(where={"doc_id": {"$in": list(doc_ids)}})
+    docstore.mdelete(list(doc_ids))
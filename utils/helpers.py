@@ -1,5 +1,7 @@
 import os
 import glob
+import fcntl
+import hashlib
 from config import INPUT_DIR
 
 def get_file_list(directory, extension):
@@ -14,4 +16,44 @@ def get_file_list(directory, extension):
     list: Список путей к файлам.
     """
     dir_path = os.path.join(INPUT_DIR, directory)
-    return glob.glob(dir_path + '/' + extension)
\ No newline at end of file
+    return glob.glob(dir_path + '/' + extension)
+
+def file_sha256(path, block_size=1 << 20):
+    """
+    Вычисляет SHA-256 содержимого файла, читая его блоками.
+    
+    Параметры:
+    path (str): Путь к файлу.
+    block_size (int): Размер читаемого блока в байтах.
+    
+    Возвращает:
+    str: Шестнадцатеричный хеш содержимого.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def acquire_write_lock(path):
+    """
+    Берет исключительную блокировку файла (fcntl.flock) без ожидания:
+    так хранилище, допускающее одного писателя, не открывается на запись
+    из двух процессов.
+    
+    Параметры:
+    path (str): Путь к файлу блокировки (создается при необходимости).
+    
+    Возвращает:
+    int: Дескриптор файла; блокировка действует, пока он открыт.
+    
+    Исключения:
+    BlockingIOError: Блокировку уже держит другой процесс.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        raise BlockingIOError(f"{path} уже открыт на запись другим процессом")
+    return fd
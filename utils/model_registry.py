@@ -0,0 +1,119 @@
+import os
+import time
+import threading
+
+def current_rss_bytes():
+    """
+    Возвращает текущий резидентный объем памяти процесса в байтах.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        # На macOS ru_maxrss в байтах, на Linux - в килобайтах; это пиковое значение
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class ModelRegistry:
+    """
+    Общий для процесса реестр моделей: каждая модель загружается лениво
+    при первом обращении и разделяется между всеми вызывающими.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._stats = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader):
+        """
+        Регистрирует функцию загрузки модели.
+
+        Параметры:
+        name (str): Имя модели в реестре.
+        loader (callable): Функция без аргументов, возвращающая модель.
+        """
+        with self._lock:
+            self._loaders[name] = loader
+            self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name):
+        """
+        Возвращает модель, загружая ее при первом обращении.
+        """
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._locks[name]:
+            if name not in self._models:
+                rss_before = current_rss_bytes()
+                started_at = time.perf_counter()
+                self._models[name] = self._loaders[name]()
+                self._stats[name] = {
+                    'load_seconds': time.perf_counter() - started_at,
+                    'rss_bytes': current_rss_bytes() - rss_before,
+                }
+                print(f"Модель {name} загружена за {self._stats[name]['load_seconds']:.1f} с "
+                      f"(+{self._stats[name]['rss_bytes'] / 2**20:.0f} МБ)")
+        return self._models[name]
+
+    def override(self, name, model):
+        """
+        Подменяет модель готовым объектом (например, заглушкой в бенчмарках).
+        Зависимые объекты, уже созданные из прежней модели, нужно выгрузить
+        методом unload.
+        """
+        with self._lock:
+            self._locks.setdefault(name, threading.Lock())
+            self._loaders.setdefault(name, lambda: model)
+        self._models[name] = model
+        self._stats[name] = {'load_seconds': 0.0, 'rss_bytes': 0}
+
+    def unload(self, name):
+        """
+        Выгружает модель; при следующем обращении она будет загружена заново.
+        """
+        self._models.pop(name, None)
+        self._stats.pop(name, None)
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def warmup(self, names=None, background=True):
+        """
+        Заранее загружает модели.
+
+        Параметры:
+        names (list): Имена моделей (по умолчанию - все зарегистрированные).
+        background (bool): Загружать в фоновом потоке.
+
+        Возвращает:
+        threading.Thread или None: Поток загрузки при background=True.
+        """
+        names = list(names if names is not None else self._loaders)
+
+        def load_all():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    print(f"Ошибка при загрузке модели {name}: {e}")
+
+        if not background:
+            load_all()
+            return None
+        thread = threading.Thread(target=load_all, name='model-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        """
+        Возвращает:
+        dict: Время загрузки и прирост резидентной памяти для загруженных моделей.
+        """
+        return {name: dict(stats) for name, stats in self._stats.items()}
+
+# Process-wide model registry
+registry = ModelRegistry()
@@ -0,0 +1,305 @@
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque, Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import TRACE_JSON_LOG, TRACE_HISTORY, TRACE_PROFILE_SLOW_SECONDS, TRACE_PROFILE_INTERVAL
+
+# Границы гистограммы длительностей (секунды)
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class Span:
+    """
+    Отрезок времени выполнения одной операции с атрибутами.
+    """
+
+    __slots__ = ('name', 'span_id', 'parent_id', 'trace', 'attributes', 'started_at', 'duration')
+
+    def __init__(self, name, parent, trace, attributes):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace = trace
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.duration = None
+
+    def set(self, **attributes):
+        """Добавляет атрибуты (например, число токенов) к отрезку."""
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'trace_id': self.trace['trace_id'] if self.trace is not None else None,
+            'start': self.started_at,
+            'duration': self.duration,
+            'pid': os.getpid(),
+            'thread': threading.current_thread().name,
+            **self.attributes,
+        }
+
+class _Histogram:
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+class SamplingProfiler:
+    """
+    Выборочный профилировщик одного потока: периодически снимает его стек
+    через sys._current_frames и считает, сколько раз встречался каждый стек.
+    """
+
+    def __init__(self, thread_id, interval=0.01, max_depth=30):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='trace-profiler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, top=20):
+        """
+        Возвращает:
+        list: Самые частые стеки (свернутые, от корня к листу) с числом выборок.
+        """
+        self._stop.set()
+        self._thread.join()
+        return [{'stack': stack, 'samples': n} for stack, n in self.samples.most_common(top)]
+
+class Tracer:
+    """
+    Трассировка этапов конвейера: отрезки времени с атрибутами, гистограммы
+    длительностей и счетчики для Prometheus, JSON-журнал и история последних
+    запросов для отладочной панели. Медленные запросы можно профилировать.
+    """
+
+    def __init__(self, json_log_path=None, history=50, slow_seconds=None, profile_interval=0.01):
+        """
+        Параметры:
+        json_log_path (str): Файл JSON-журнала отрезков (None - не писать).
+        history (int): Число последних трасс, хранимых в памяти.
+        slow_seconds (float): Порог медленного запроса для профилировщика (None - не профилировать).
+        profile_interval (float): Период выборки стека профилировщиком.
+        """
+        self.json_log_path = json_log_path
+        self.slow_seconds = slow_seconds
+        self.profile_interval = profile_interval
+        self.traces = deque(maxlen=history)
+        self._histograms = {}
+        self._counters = Counter()
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        if json_log_path:
+            os.makedirs(os.path.dirname(json_log_path) or '.', exist_ok=True)
+
+    def _log(self, record):
+        if not self.json_log_path:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        with self._log_lock, open(self.json_log_path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Измеряет длительность блока кода.
+
+        Параметры:
+        name (str): Имя этапа (например, 'llm.chat').
+        attributes: Атрибуты отрезка.
+
+        Возвращает:
+        Span: Отрезок, в который можно добавить атрибуты методом set.
+        """
+        parent = _current_span.get()
+        span = Span(name, parent, parent.trace if parent is not None else None, dict(attributes))
+        token = _current_span.set(span)
+        started_at = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.set(error=repr(e))
+            raise
+        finally:
+            span.duration = time.perf_counter() - started_at
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # Генератор закрыт в другом контексте
+                _current_span.set(parent)
+            self._finish(span)
+
+    @contextmanager
+    def trace(self, name, **attributes):
+        """
+        Корневой отрезок запроса: все вложенные отрезки собираются в одну
+        трассу, доступную в истории. Если запрос выполняется дольше slow_seconds,
+        к трассе прикладывается выборка стеков профилировщика.
+        """
+        trace = {'trace_id': uuid.uuid4().hex, 'name': name, 'spans': []}
+        profiler = None
+        if self.slow_seconds is not None:
+            profiler = SamplingProfiler(threading.get_ident(), self.profile_interval).start()
+        parent = _current_span.get()
+        root = Span(name, parent, trace, dict(attributes))
+        token = _current_span.set(root)
+        started_at = time.perf_counter()
+        try:
+            yield root
+        except Exception as e:
+            root.set(error=repr(e))
+            raise
+        finally:
+            root.duration = time.perf_counter() - started_at
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                _current_span.set(parent)
+            trace['duration'] = root.duration
+            if profiler is not None:
+                stacks = profiler.stop()
+                if root.duration >= self.slow_seconds:
+                    trace['profile'] = stacks
+                    self._log({'trace_id': trace['trace_id'], 'name': name, 'profile': stacks})
+            self._finish(root)
+            self.traces.append(trace)
+
+    def record(self, name, duration, **attributes):
+        """
+        Записывает уже измеренный отрезок (например, для этапов внутри генераторов,
+        где контекст нельзя удерживать между yield).
+        """
+        parent = _current_span.get()
+        span = Span(name, parent, parent.trace if parent is not None else None, attributes)
+        span.started_at = time.time() - duration
+        span.duration = duration
+        self._finish(span)
+
+    def _finish(self, span):
+        with self._lock:
+            histogram = self._histograms.get(span.name)
+            if histogram is None:
+                histogram = self._histograms[span.name] = _Histogram()
+            histogram.observe(span.duration)
+        record = span.to_dict()
+        if span.trace is not None:
+            span.trace['spans'].append(record)
+        self._log(record)
+
+    def count(self, name, value=1, **labels):
+        """
+        Увеличивает счетчик (например, число токенов).
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def summary(self):
+        """
+        Возвращает:
+        dict: Для каждого этапа - число вызовов, суммарное и среднее время.
+        """
+        with self._lock:
+            return {
+                name: {'count': h.count, 'seconds': h.total, 'mean': h.total / h.count if h.count else 0.0}
+                for name, h in sorted(self._histograms.items())
+            }
+
+    def prometheus_text(self):
+        """
+        Возвращает:
+        str: Метрики в текстовом формате Prometheus.
+        """
+        lines = [
+            '# HELP rag_span_seconds Duration of pipeline stages.',
+            '# TYPE rag_span_seconds histogram',
+        ]
+        with self._lock:
+            for name, h in sorted(self._histograms.items()):
+                for bound, n in zip(_BUCKETS, h.counts):
+                    lines.append(f'rag_span_seconds_bucket{{span="{name}",le="{bound}"}} {n}')
+                lines.append(f'rag_span_seconds_bucket{{span="{name}",le="+Inf"}} {h.count}')
+                lines.append(f'rag_span_seconds_sum{{span="{name}"}} {h.total}')
+                lines.append(f'rag_span_seconds_count{{span="{name}"}} {h.count}')
+            counters = sorted(self._counters.items())
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f'rag_{name}_total'
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} counter')
+                typed.add(metric)
+            label_text = ','.join(f'{key}="{label}"' for key, label in labels)
+            lines.append(f'{metric}{{{label_text}}} {value}' if label_text else f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def serve_metrics(self, port, host='127.0.0.1'):
+        """
+        Запускает HTTP-эндпоинт /metrics в фоновом потоке.
+
+        Возвращает:
+        ThreadingHTTPServer: Запущенный сервер.
+        """
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = tracer.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+        return server
+
+# Process-wide tracer
+tracer = Tracer(
+    json_log_path=TRACE_JSON_LOG,
+    history=TRACE_HISTORY,
+    slow_seconds=TRACE_PROFILE_SLOW_SECONDS,
+    profile_interval=TRACE_PROFILE_INTERVAL,
+)